@@ -1,6 +1,26 @@
 import boto3
+import copy
 import json
 import os
+import time
+
+from analysis_sync import (LocalSyncStateStore, S3SyncStateStore,
+                           register_sync, sync_analyses)
+from asset_bundle_migration import migrate_analyses
+from broadcast_merge import broadcast_merge
+from dataset_preflight import (DatasetPreflightException, blocking_problems,
+                               preflight_datasets)
+from merge_provenance import (ProvenanceStore, merge_incremental,
+                              record_target_fingerprints)
+from merge_stages import (DuplicateCalculatedFieldException,
+                          DuplicateElementIdException,
+                          DuplicateParameterNameException, empty_definition,
+                          merge_definitions)
+from optimistic_update import update_with_optimistic_concurrency
+from publish_pipeline import publish_analysis
+from snapshot_store import (LocalSnapshotBackend, S3SnapshotBackend,
+                            SnapshotStore, rollback_analysis)
+from visual_dedup import dedup_visuals
 
 
 def lambda_handler(event, context):
@@ -17,6 +37,9 @@ def lambda_handler(event, context):
     target_analysis_name = os.environ['TARGET_ANALYSIS_NAME']
     target_analysis_id = os.environ['TARGET_ANALYSIS_ID']
     action = os.environ['ACTION']
+    # scheduled invocations pass the action in the event, e.g. {"ACTION": "Sync"}
+    if isinstance(event, dict) and event.get('ACTION'):
+        action = event['ACTION']
 
     # qualify the update call
     if action == 'Update':
@@ -29,8 +52,14 @@ def lambda_handler(event, context):
                     source_analysis_id=source_analysis_id,
                     target_analysis_id=target_analysis_id,
                     target_analysis_name=target_analysis_name,
-                    qs_client=qs_client
+                    qs_client=qs_client,
+                    visual_dedup_policy=os.environ.get('VISUAL_DEDUP_POLICY'),
+                    snapshot_store=merge_snapshot_store(),
+                    provenance_store=merge_provenance_store()
                 )
+                response = publish_merged_analysis(
+                    response, account_id, identity_region, target_analysis_id, target_analysis_name, user_name, qs_client,
+                    poll_options=lambda_poll_options(context))
                 print(response)
                 return response
             else:
@@ -39,6 +68,68 @@ def lambda_handler(event, context):
         except Exception as e:
             print(json.loads(json.dumps(e, indent=4, default=str)))
             return json.loads(json.dumps(e, indent=4, default=str))
+    elif action == 'Migrate':
+        analysis_ids = (os.environ.get(
+            'MIGRATION_ANALYSIS_IDS') or target_analysis_id).split(',')
+        response = migrate_analyses(
+            analysis_ids=[analysis_id.strip() for analysis_id in analysis_ids if analysis_id.strip()],
+            source_account_id=account_id,
+            destination_account_id=os.environ['DESTINATION_ACCOUNT_ID'],
+            region=identity_region,
+            source_client=qs_client,
+            destination_client=destination_quicksight_client(
+                os.environ.get('DESTINATION_REGION') or identity_region,
+                os.environ.get('DESTINATION_ROLE_ARN')),
+            import_batch_size=int(os.environ.get('IMPORT_BATCH_SIZE', 5)),
+            poll_options=lambda_poll_options(context)
+        )
+        print(response)
+        return response
+    elif action == 'Broadcast':
+        target_analysis_ids = os.environ['BROADCAST_TARGET_ANALYSIS_IDS'].split(',')
+        response = broadcast_merge(
+            account_id=account_id,
+            source_analysis_id=source_analysis_id,
+            target_analysis_ids=[analysis_id.strip() for analysis_id in target_analysis_ids if analysis_id.strip()],
+            qs_client=qs_client,
+            visual_dedup_policy=os.environ.get('VISUAL_DEDUP_POLICY'),
+            snapshot_store=merge_snapshot_store(),
+            provenance_store=merge_provenance_store()
+        )
+        print(response)
+        return response
+    elif action == 'Rollback':
+        try:
+            merge_id = rollback_analysis(
+                account_id=account_id,
+                target_analysis_id=target_analysis_id,
+                snapshot_store=merge_snapshot_store(),
+                qs_client=qs_client,
+                merge_id=os.environ.get('ROLLBACK_MERGE_ID') or None,
+                provenance_store=merge_provenance_store()
+            )
+            response = f"Analysis {target_analysis_id} rolled back to merge {merge_id}"
+        except Exception as e:
+            response = json.loads(json.dumps(e, indent=4, default=str))
+        print(response)
+        return response
+    elif action == 'Sync':
+        state_store = sync_state_store()
+        registrations = event.get('Register', []) if isinstance(event, dict) else []
+        if registrations:
+            state = state_store.load()
+            for registration in registrations:
+                register_sync(state, registration['TargetAnalysisId'],
+                              registration['TargetAnalysisName'], registration['SourceAnalysisIds'])
+            state_store.save(state)
+        response = sync_analyses(
+            account_id=account_id,
+            state_store=state_store,
+            qs_client=qs_client,
+            provenance_store=merge_provenance_store()
+        )
+        print(response)
+        return response
     else:
         response = merge_analyses_create(
             account_id=account_id,
@@ -48,49 +139,177 @@ def lambda_handler(event, context):
             target_analysis_name=target_analysis_name,
             user_name=user_name,
             namespace='default',
-            qs_client=qs_client
+            qs_client=qs_client,
+            visual_dedup_policy=os.environ.get('VISUAL_DEDUP_POLICY'),
+            snapshot_store=merge_snapshot_store(),
+            provenance_store=merge_provenance_store(),
+            preflight=os.environ.get('DATASET_PREFLIGHT', 'on') != 'off',
+            preflight_ttl=int(os.environ.get('DATASET_PREFLIGHT_TTL', 300))
         )
+        response = publish_merged_analysis(
+            response, account_id, identity_region, target_analysis_id, target_analysis_name, user_name, qs_client,
+            poll_options=lambda_poll_options(context))
         print(response)
         return response
 
 
-def merge_analyses_create(account_id, first_analysis_id, second_analysis_id, target_analysis_id, target_analysis_name, user_name, namespace, qs_client):
+def lambda_poll_options(context, margin_seconds=30):
+    """Stops job polling shortly before the Lambda runs out of time, so a report is still returned
+
+    Args:
+        context: Lambda context, None outside of Lambda
+        margin_seconds (int): seconds kept to build and return the report
+
+    Returns:
+        dict: keyword arguments for job_polling.wait_for_jobs
+    """
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return {}
+    return {'deadline': time.monotonic() + context.get_remaining_time_in_millis() / 1000 - margin_seconds}
+
+
+def destination_quicksight_client(region, role_arn=None):
+    """Creates the QuickSight client of the account analyses are migrated to
+
+    Args:
+        region (str): QuickSight Region of the destination account
+        role_arn (str): role to assume in the destination account, None to use the Lambda role
+
+    Returns:
+        QuickSight client
+    """
+    if not role_arn:
+        return boto3.client("quicksight", region_name=region)
+    credentials = boto3.client("sts").assume_role(
+        RoleArn=role_arn, RoleSessionName='analysis-merge-migration')['Credentials']
+    return boto3.client("quicksight", region_name=region,
+                        aws_access_key_id=credentials['AccessKeyId'],
+                        aws_secret_access_key=credentials['SecretAccessKey'],
+                        aws_session_token=credentials['SessionToken'])
+
+
+def sync_state_store():
+    """Picks where the sync registry and state are kept
+
+    Returns:
+        S3SyncStateStore when SYNC_STATE_BUCKET is set, LocalSyncStateStore otherwise
+    """
+    bucket = os.environ.get('SYNC_STATE_BUCKET')
+    if bucket:
+        return S3SyncStateStore(bucket, os.environ.get('SYNC_STATE_KEY', 'analysis-merge/sync-state.json'),
+                                boto3.client("s3"))
+    return LocalSyncStateStore(os.environ.get('SYNC_STATE_PATH', '/tmp/analysis_sync_state.json'))
+
+
+def publish_merged_analysis(merge_response, account_id, region, target_analysis_id, target_analysis_name, user_name, qs_client,
+                            poll_options=None):
+    """Publishes the merged analysis to its dashboards when PUBLISH_DASHBOARD_IDS is set
+
+    Args:
+        merge_response: what merge_analyses_create or merge_analyses_update returned
+        account_id (int): AWS account ID
+        region (str): QuickSight Region
+        target_analysis_id (str): Analysis ID of the target analysis
+        target_analysis_name (str): Name of the target analysis, given to the dashboards
+        user_name (str): QuickSight user given access to new dashboards
+        qs_client: QuickSight client
+        poll_options (dict): keyword arguments for wait_for_jobs, see lambda_poll_options
+
+    Returns:
+        the merge response as is when nothing is published, otherwise the merge
+            response together with the publish report
+    """
+    dashboard_ids = [dashboard_id.strip() for dashboard_id
+                     in os.environ.get('PUBLISH_DASHBOARD_IDS', '').split(',') if dashboard_id.strip()]
+    if not dashboard_ids or not (isinstance(merge_response, str) and merge_response.endswith('successfully')):
+        return merge_response
+    try:
+        publish_response = publish_analysis(
+            account_id=account_id,
+            region=region,
+            target_analysis_id=target_analysis_id,
+            template_id=os.environ.get(
+                'PUBLISH_TEMPLATE_ID') or f"{target_analysis_id}-template",
+            dashboards=[{'DashboardId': dashboard_id, 'Name': target_analysis_name}
+                        for dashboard_id in dashboard_ids],
+            qs_client=qs_client,
+            user_name=user_name,
+            poll_options=poll_options
+        )
+    except Exception as e:
+        publish_response = json.loads(json.dumps(e, indent=4, default=str))
+    return {'Merge': merge_response, 'Publish': publish_response}
+
+
+def merge_snapshot_store():
+    """Picks where merge snapshots are kept
+
+    Returns:
+        SnapshotStore on S3 when SNAPSHOT_BUCKET is set, under SNAPSHOT_DIRECTORY otherwise
+    """
+    bucket = os.environ.get('SNAPSHOT_BUCKET')
+    if bucket:
+        backend = S3SnapshotBackend(bucket, os.environ.get(
+            'SNAPSHOT_PREFIX', 'analysis-merge/snapshots'), boto3.client("s3"))
+    else:
+        backend = LocalSnapshotBackend(os.environ.get(
+            'SNAPSHOT_DIRECTORY', '/tmp/analysis-merge-snapshots'))
+    return SnapshotStore(backend)
+
+
+def merge_provenance_store():
+    """Keeps the merge provenance maps next to the merge snapshots, see merge_snapshot_store
+
+    Returns:
+        ProvenanceStore
+    """
+    return ProvenanceStore(merge_snapshot_store().backend)
+
+
+def save_merge_provenance(provenance_store, target_analysis_id, provenances):
+    """Records the provenance maps of a merge; a failure is logged and does not fail the merge"""
+    try:
+        for provenance in provenances:
+            provenance_store.save(target_analysis_id, provenance)
+    except Exception as e:
+        print(f"Could not save the merge provenance of analysis {target_analysis_id}: {e}")
+
+
+def save_merge_snapshot(snapshot_store, target_analysis_id, target_analysis_name, inputs, output, theme_arn=None,
+                        provenance=None):
+    """Records a merge in the snapshot store; a failure is logged and does not fail the merge"""
+    try:
+        merge_id = snapshot_store.save_merge(
+            target_analysis_id, target_analysis_name, inputs, output, theme_arn, provenance)
+        print(f"Merge snapshot {merge_id} saved for analysis {target_analysis_id}")
+    except Exception as e:
+        print(f"Could not save the merge snapshot of analysis {target_analysis_id}: {e}")
+
+
+def merge_analyses_create(account_id, first_analysis_id, second_analysis_id, target_analysis_id, target_analysis_name, user_name, namespace, qs_client, visual_dedup_policy=None, snapshot_store=None, provenance_store=None,
+                          preflight=False, preflight_ttl=300):
     """Merges the first sheet to the target analysis and
             brings filters, calculated fields and visuals with it
 
     Args:
         account_id (int): AWS account ID
         first_analysis_id (str): Analysis ID of the first analysis
-        first_sheet_id (str): Sheet ID that needs to be merged to the target analysis
+        second_analysis_id (str): Analysis ID of the second analysis
         target_analysis_id (str): Analysis ID of the target analysis
-        identity_region (str): QuickSight Region
+        target_analysis_name (str): Name of the target analysis
+        user_name (str): QuickSight user that owns the target analysis
+        namespace (str): QuickSight namespace of the user
+        qs_client: QuickSight client
+        visual_dedup_policy (str): 'report' or 'collapse' near-duplicate visuals, None to skip
+        snapshot_store (SnapshotStore): records the input and merged definitions, None to skip
+        provenance_store (ProvenanceStore): records where every merged element came from, None to skip
+        preflight (bool): check the datasets of the merged analysis before deleting or creating anything
+        preflight_ttl (int): seconds dataset descriptions are cached for across invocations
     """
 
     # definition of the target analysis
     target_analysis_definition = {
-        'Definition': {
-            'DataSetIdentifierDeclarations': [],
-            'Sheets': [
-            ],
-            'CalculatedFields': [],
-            'ParameterDeclarations': [],
-            'FilterGroups': [],
-            'ColumnConfigurations': [],
-            'AnalysisDefaults': {
-                'DefaultNewSheetConfiguration': {
-                    'InteractiveLayoutConfiguration': {
-                        'Grid': {
-                            'CanvasSizeOptions': {
-                                'ScreenCanvasSizeOptions': {
-                                    'ResizeOption': 'FIXED',
-                                    'OptimizedViewPortWidth': '1600px'
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        }
+        'Definition': empty_definition()
     }
 
     # get the definition of the first analysis
@@ -105,332 +324,40 @@ def merge_analyses_create(account_id, first_analysis_id, second_analysis_id, tar
         AnalysisId=second_analysis_id
     )
 
-    # write the first analysis definition
-    # with open('first_analysis_definition.json', 'w') as outfile:
-    #     json.dump(first_analysis_definition, outfile)
-
-    # write the second analysis definition
-    # with open('second_analysis_definition.json', 'w') as outfile:
-    #     json.dump(second_analysis_definition, outfile)
-
-    class DuplicateParameterNameException(Exception):
-        """Exception raised when a duplicate parameter name is found"""
-        pass
-
-    class DuplicateCalculatedFieldException(Exception):
-        """Exception raised when a duplicate calculated field is found"""
-        pass
-
-    def get_dataset_identifier(dataset_arn, datasets):
-        """Gets the dataset identifier for a given dataset arn
-
-        Args:
-            dataset_arn (str): dataset arn
-            datasets (list): list of datasets
-
-        Returns:
-            str: dataset identifier
-        """
-        for dataset in datasets:
-            if dataset['DataSetArn'] == dataset_arn:
-                return dataset['Identifier']
-
-    def get_dataset_arn(dataset_identifier, datasets):
-        """Gets the dataset arn for a given dataset identifier
-
-        Args:
-            dataset_identifier (str): dataset identifier
-            datasets (list): list of datasets
-
-        Returns:
-            str: dataset arn
-        """
-        for datasetnum in range(len(datasets)):
-            if datasets[datasetnum]['Identifier'] == dataset_identifier:
-                return datasets[datasetnum]['DataSetArn']
-
-    def update_dataset_identifier(dataset_identifier):
-        """Updates the dataset identifier with a new value
-
-        Args:
-            dataset_identifier (str): dataset identifier
-
-        Returns:
-            str: new dataset identifier
-        """
-        if dataset_identifier[-1] in '1234567890' and dataset_identifier[-2] == '-':
-            identifier_updated = int(dataset_identifier[-1]) + 1
-        else:
-            identifier_updated = dataset_identifier + '-1'
-        return identifier_updated
-
-    def update_nested_dict(in_dict, key, value, match_value=None):
-        """Replaces the existing value of the key with a new value
-
-        Args:
-            in_dict(dict): dictionary to be executed
-            key (str): key to search for ; example 'DataSetIdentifier' or 'Identifier'...
-            value (str): value to replace with ; example 'NewValue'
-
-        Returns:
-            doesn't return anything but updates the dictionary in place
-        """
-        for k, v in in_dict.items():
-            if key == k and v == match_value:
-                in_dict[k] = value
-            elif isinstance(v, dict):
-                update_nested_dict(v, key, value, match_value)
-            elif isinstance(v, list):
-                for o in v:
-                    if isinstance(o, dict):
-                        update_nested_dict(o, key, value, match_value)
-
-    # variable definitions
-    target_dataset_arns = set()
-    target_dataset_identifiers = set()
-
-    first_analysis_datasets = first_analysis_definition['Definition']['DataSetIdentifierDeclarations']
-    first_analysis_parameters = first_analysis_definition['Definition']['ParameterDeclarations']
-    first_analysis_filter_groups = first_analysis_definition['Definition']['FilterGroups']
-    first_analysis_calculated_fields = first_analysis_definition['Definition']['CalculatedFields']
-    first_analysis_sheets = first_analysis_definition['Definition']['Sheets']
-    try:
-        first_analysis_theme = first_analysis_definition['ThemeArn']
-    except KeyError:
-        first_analysis_theme = None
-
-    second_analysis_datasets = second_analysis_definition[
-        'Definition']['DataSetIdentifierDeclarations']
-    second_analysis_dataset_identifiers = set()
-    second_analysis_sheets = second_analysis_definition['Definition']['Sheets']
-    second_analysis_parameters = second_analysis_definition['Definition']['ParameterDeclarations']
-    second_analysis_filter_groups = second_analysis_definition['Definition']['FilterGroups']
-    second_analysis_calculated_fields = second_analysis_definition[
-        'Definition']['CalculatedFields']
-
-    target_datasets = target_analysis_definition['Definition']['DataSetIdentifierDeclarations']
-    target_sheets = target_analysis_definition['Definition']['Sheets']
-    target_parameters = target_analysis_definition['Definition']['ParameterDeclarations']
-    target_filters = target_analysis_definition['Definition']['FilterGroups']
-    target_calculated_fields = target_analysis_definition['Definition']['CalculatedFields']
-
-    # copy parameters from first analysis to target
-    for parameter in first_analysis_parameters:
-        target_parameters.append(parameter)
-
-    try:
-        first_analysis_parameter_names = []
-        for parameter in first_analysis_parameters:
-            parameter_type = next(iter(parameter))
-            parameter_name = parameter[parameter_type]['Name']
-            first_analysis_parameter_names.append(parameter_name)
-
-        # collect the second analysis' parameter names
-        second_analysis_parameter_names = []
-        for parameter in second_analysis_parameters:
-            parameter_type = next(iter(parameter))
-            parameter_name = parameter[parameter_type]['Name']
-            second_analysis_parameter_names.append(parameter_name)
-
-        # decide whether or not to copy the second analysis' parameters to target
-        for parameter in second_analysis_parameters:
-            parameter_type = next(iter(parameter))
-            parameter_name = parameter[parameter_type]['Name']
-            if parameter in first_analysis_parameters:
-                continue
-            elif parameter_name in first_analysis_parameter_names:
-                raise DuplicateParameterNameException(
-                    f"Parameter: {parameter_name} exists in both the analyses, change the name of the parameter in one of the analyses and retry")
-            else:
-                target_parameters.append(parameter)
-
-    except DuplicateParameterNameException as e:
-        return json.loads(json.dumps(e, indent=4, default=str))
+    first_analysis_theme = first_analysis_definition.get('ThemeArn')
 
-    # dataset section
-    # copy all datasets from first analysis to target
-    for dataset in first_analysis_datasets:
-        target_dataset_arns.add(dataset['DataSetArn'])
-        target_datasets.append(dataset)
-
-    # find out the common dataset arns in source and target
-    second_analysis_dataset_arns = set()
-    for dataset in target_datasets:
-        target_dataset_arns.add(dataset['DataSetArn'])
-        target_dataset_identifiers.add(dataset['Identifier'])
-    for dataset in second_analysis_datasets:
-        second_analysis_dataset_arns.add(dataset['DataSetArn'])
-        second_analysis_dataset_identifiers.add(dataset['Identifier'])
-    common_arns = set.intersection(
-        target_dataset_arns, second_analysis_dataset_arns)
-    common_identifiers = set.intersection(
-        target_dataset_identifiers, second_analysis_dataset_identifiers)
-
-    # check if the dataset identifiers are different in source and target
-    dataset_arns_that_need_identifier_replacement = set()
-    dataset_identifiers_that_needs_update = set()
-    same_dataset_arn_different_identifier = False
-    same_dataset_identifier_different_arn = False
-
-    if common_arns:
-        for arn in common_arns:
-            target_dataset_identifier = get_dataset_identifier(
-                arn, target_datasets)
-            second_analysis_dataset_identifier = get_dataset_identifier(
-                arn, second_analysis_datasets)
-            if target_dataset_identifier != second_analysis_dataset_identifier:
-                dataset_arns_that_need_identifier_replacement.add(arn)
-                same_dataset_arn_different_identifier = True
-
-    # source identifiers for arn replacement list
-    if same_dataset_arn_different_identifier:
-        second_analysis_identifiers_for_common_arns = []
-        target_identifiers_for_common_arns = []
-        for arn in common_arns:
-            second_analysis_identifiers_for_common_arns.append(
-                get_dataset_identifier(arn, second_analysis_datasets))
-            target_identifiers_for_common_arns.append(
-                get_dataset_identifier(arn, target_datasets))
-
-    if common_identifiers:
-        for identifier in common_identifiers:
-            target_dataset_arn = get_dataset_arn(identifier, target_datasets)
-            second_analysis_dataset_arn = get_dataset_arn(
-                identifier, second_analysis_datasets)
-            if target_dataset_arn != second_analysis_dataset_arn:
-                dataset_identifiers_that_needs_update.add(identifier)
-                same_dataset_identifier_different_arn = True
-
-    # copy datasets from second analysis if not present already in target
-    if same_dataset_identifier_different_arn:
-        for dataset_identifier in dataset_identifiers_that_needs_update:
-            updated_dataset_identifier = update_dataset_identifier(
-                dataset_identifier)
-            for dataset in second_analysis_datasets:
-                if dataset['Identifier'] == dataset_identifier:
-                    update_nested_dict(dataset, 'Identifier',
-                                       updated_dataset_identifier, dataset_identifier)
-
-    if same_dataset_arn_different_identifier:
-        for dataset_arn in dataset_arns_that_need_identifier_replacement:
-            source_dataset_identifier = get_dataset_identifier(
-                dataset_arn, second_analysis_datasets)
-            target_dataset_identifier = get_dataset_identifier(
-                dataset_arn, target_datasets)
-            for dataset in second_analysis_datasets:
-                if dataset['DataSetArn'] == dataset_arn:
-                    update_nested_dict(dataset, 'Identifier',
-                                       target_dataset_identifier, source_dataset_identifier)
-
-    for dataset in second_analysis_datasets:
-        if dataset not in target_datasets:
-            target_datasets.append(dataset)
-
-    # sheets section
-    # copy all sheets from first analysis to target
-    for sheet in first_analysis_sheets:
-        target_sheets.append(sheet)
-
-    # copy sheets from second analysis which are not present already in target
-    if same_dataset_identifier_different_arn:
-        for dataset_identifier in dataset_identifiers_that_needs_update:
-            updated_dataset_identifier = update_dataset_identifier(
-                dataset_identifier)
-            for sheet in second_analysis_sheets:
-                update_nested_dict(sheet, 'DataSetIdentifier',
-                                   updated_dataset_identifier, dataset_identifier)
-
-    if same_dataset_arn_different_identifier:
-        for dataset_identifier in dataset_arns_that_need_identifier_replacement:
-            source_dataset_identifier = get_dataset_identifier(
-                dataset_identifier, second_analysis_datasets)
-            target_dataset_identifier = get_dataset_identifier(
-                dataset_identifier, target_datasets)
-            for sheet in second_analysis_sheets:
-                update_nested_dict(sheet, 'DataSetIdentifier',
-                                   target_dataset_identifier, source_dataset_identifier)
-
-    for sheet in second_analysis_sheets:
-        if sheet not in target_sheets:
-            target_sheets.append(sheet)
-
-    # filters section
-    # copy all filters from first analysis to target
-    for filter_group in first_analysis_filter_groups:
-        target_filters.append(filter_group)
-
-    # copy filters from second analysis which are not present already in target
-    if same_dataset_identifier_different_arn:
-        for dataset_identifier in dataset_identifiers_that_needs_update:
-            updated_dataset_identifier = update_dataset_identifier(
-                dataset_identifier)
-            for filter_group in second_analysis_filter_groups:
-                update_nested_dict(filter_group, 'DataSetIdentifier',
-                                   updated_dataset_identifier, dataset_identifier)
-
-    if same_dataset_arn_different_identifier:
-        for dataset_identifier in dataset_arns_that_need_identifier_replacement:
-            source_dataset_identifier = get_dataset_identifier(
-                dataset_identifier, second_analysis_datasets)
-            target_dataset_identifier = get_dataset_identifier(
-                dataset_identifier, target_datasets)
-            update_nested_dict(filter_group, 'DataSetIdentifier',
-                               target_dataset_identifier, source_dataset_identifier)
-
-    for filter_group in second_analysis_filter_groups:
-        if filter_group not in target_filters:
-            target_filters.append(filter_group)
-
-    # copy the calculated fields in source to target
-    temp_second_analysis_calculated_fields = []
-    for calculated_field in first_analysis_calculated_fields:
-        target_calculated_fields.append(calculated_field)
-
-    if same_dataset_identifier_different_arn:
-        for dataset_identifier in dataset_identifiers_that_needs_update:
-            updated_dataset_identifier = update_dataset_identifier(
-                dataset_identifier)
-            for calculated_field in second_analysis_calculated_fields:
-                update_nested_dict(calculated_field, 'DataSetIdentifier',
-                                   updated_dataset_identifier, dataset_identifier)
-                if calculated_field not in temp_second_analysis_calculated_fields:
-                    temp_second_analysis_calculated_fields.append(
-                        calculated_field)
-
-    if same_dataset_arn_different_identifier:
-        for dataset_identifier in dataset_arns_that_need_identifier_replacement:
-            source_dataset_identifier = get_dataset_identifier(
-                dataset_identifier, second_analysis_datasets)
-            target_dataset_identifier = get_dataset_identifier(
-                dataset_identifier, target_datasets)
-            update_nested_dict(calculated_field, 'DataSetIdentifier',
-                               target_dataset_identifier, source_dataset_identifier)
+    # keep the inputs as they were read
+    if snapshot_store:
+        snapshot_inputs = {
+            first_analysis_id: copy.deepcopy(first_analysis_definition['Definition']),
+            second_analysis_id: copy.deepcopy(second_analysis_definition['Definition'])
+        }
 
+    # copy the first analysis to the target, then bring the second analysis in
+    # the target is new, so both sources are merged in full and their provenance is recorded
     try:
-        target_calculated_field_identifiers = []
-        for calculated_field in target_calculated_fields:
-            calculated_field_identifier = f"{calculated_field['Name']}->{calculated_field['DataSetIdentifier']}"
-            target_calculated_field_identifiers.append(
-                calculated_field_identifier)
-
-        for calculated_field in temp_second_analysis_calculated_fields:
-            calculated_field_identifier = f"{calculated_field['Name']}->{calculated_field['DataSetIdentifier']}"
-            if calculated_field in target_calculated_fields:
-                continue
-            elif calculated_field_identifier in target_calculated_field_identifiers:
-                raise DuplicateCalculatedFieldException(
-                    f"Calculated field: {calculated_field['Name']} exists in both the analyses, change the name of the calculated field in one of the analyses and retry")
-            else:
-                target_calculated_fields.append(calculated_field)
-
-    except DuplicateCalculatedFieldException as e:
+        first_provenance, _ = merge_incremental(
+            target_analysis_definition['Definition'], first_analysis_definition['Definition'], first_analysis_id)
+        second_provenance, _ = merge_incremental(
+            target_analysis_definition['Definition'], second_analysis_definition['Definition'], second_analysis_id)
+        dedup_visuals(
+            target_analysis_definition['Definition'], visual_dedup_policy)
+        for provenance in (first_provenance, second_provenance):
+            record_target_fingerprints(provenance, target_analysis_definition['Definition'])
+    except (DuplicateParameterNameException, DuplicateCalculatedFieldException, DuplicateElementIdException) as e:
         return json.loads(json.dumps(e, indent=4, default=str))
 
-    # write the target analysis definition to a json file
-    json_object = json.dumps(
-        target_analysis_definition, indent=4, default=str)
-    with open("./target_analysis_definition_analysis_merge.json", "w") as outfile:
-        outfile.write(json_object)
+    # report every dataset and column problem before the target is touched, permissions only warn
+    if preflight:
+        problems = preflight_datasets(
+            account_id, target_analysis_definition['Definition'], qs_client,
+            principal_arn='arn:aws:quicksight:us-east-1:{}:user/{}/{}'.format(
+                account_id, namespace, user_name),
+            ttl=preflight_ttl)
+        for problem in problems:
+            print(f"Dataset preflight {problem['Severity']}: {problem['Problem']}")
+        if blocking_problems(problems):
+            return json.loads(json.dumps(DatasetPreflightException(blocking_problems(problems)), indent=4, default=str))
 
     # delete the analysis if it already exists
     try:
@@ -440,412 +367,101 @@ def merge_analyses_create(account_id, first_analysis_id, second_analysis_id, tar
         pass
 
     try:
+        create_kwargs = dict(
+            AwsAccountId=account_id,
+            AnalysisId=target_analysis_id,
+            Name=target_analysis_name,
+            Definition=target_analysis_definition['Definition'],
+            Permissions=[
+                {
+                    'Principal': 'arn:aws:quicksight:us-east-1:{}:user/{}/{}'
+                    .format(account_id, namespace, user_name),
+                    'Actions': ['quicksight:RestoreAnalysis',
+                                'quicksight:UpdateAnalysisPermissions',
+                                'quicksight:DeleteAnalysis',
+                                'quicksight:QueryAnalysis',
+                                'quicksight:DescribeAnalysisPermissions',
+                                'quicksight:DescribeAnalysis',
+                                'quicksight:UpdateAnalysis'
+                                ]
+                }
+            ]
+        )
         if first_analysis_theme:
-            qs_client.create_analysis(
-                AwsAccountId=account_id,
-                AnalysisId=target_analysis_id,
-                Name=target_analysis_name,
-                Definition=target_analysis_definition['Definition'],
-                Permissions=[
-                    {
-                        'Principal': 'arn:aws:quicksight:us-east-1:{}:user/{}/{}'
-                        .format(account_id, namespace, user_name),
-                        'Actions': ['quicksight:RestoreAnalysis',
-                                    'quicksight:UpdateAnalysisPermissions',
-                                    'quicksight:DeleteAnalysis',
-                                    'quicksight:QueryAnalysis',
-                                    'quicksight:DescribeAnalysisPermissions',
-                                    'quicksight:DescribeAnalysis',
-                                    'quicksight:UpdateAnalysis'
-                                    ]
-                    }
-                ],
-                ThemeArn=first_analysis_theme
-            )
-            return f"Analysis {target_analysis_name} created successfully"
-        else:
-            qs_client.create_analysis(
-                AwsAccountId=account_id,
-                AnalysisId=target_analysis_id,
-                Name=target_analysis_name,
-                Definition=target_analysis_definition['Definition'],
-                Permissions=[
-                    {
-                        'Principal': 'arn:aws:quicksight:us-east-1:{}:user/{}/{}'
-                        .format(account_id, namespace, user_name),
-                        'Actions': ['quicksight:RestoreAnalysis',
-                                    'quicksight:UpdateAnalysisPermissions',
-                                    'quicksight:DeleteAnalysis',
-                                    'quicksight:QueryAnalysis',
-                                    'quicksight:DescribeAnalysisPermissions',
-                                    'quicksight:DescribeAnalysis',
-                                    'quicksight:UpdateAnalysis'
-                                    ]
-                    }
-                ]
-            )
-            return f"Analysis {target_analysis_name} created successfully"
+            create_kwargs['ThemeArn'] = first_analysis_theme
+        qs_client.create_analysis(**create_kwargs)
+        # record the inputs and the merged definition once it was written, like Update
+        if snapshot_store:
+            save_merge_snapshot(snapshot_store, target_analysis_id, target_analysis_name, snapshot_inputs,
+                                target_analysis_definition['Definition'], first_analysis_theme,
+                                [first_provenance, second_provenance])
+        if provenance_store:
+            save_merge_provenance(provenance_store, target_analysis_id,
+                                  [first_provenance, second_provenance])
+        return f"Analysis {target_analysis_name} created successfully"
 
     except Exception as e:
         return json.loads(json.dumps(e, indent=4, default=str))
 
 
-def merge_analyses_update(account_id, source_analysis_id, target_analysis_id, target_analysis_name, qs_client):
+def merge_analyses_update(account_id, source_analysis_id, target_analysis_id, target_analysis_name, qs_client, max_retries=3, visual_dedup_policy=None, snapshot_store=None, provenance_store=None):
     """Merges the target sheet to the target analysis and
             brings filters, calculated fields and visuals with it
 
+    The target is written with optimistic concurrency: if another merge
+    updates it meanwhile, the source is merged again into the new target.
+    With a provenance store, only the source elements that changed since
+    the last merge are processed, and they replace their earlier copies.
+
     Args:
         account_id (int): AWS account ID
+        source_analysis_id (str): Analysis ID of the source analysis
         target_analysis_id (str): Analysis ID of the target analysis
-        target_sheet_id (str): Sheet ID that needs to be merged to the target analysis
-        target_analysis_id (str): Analysis ID of the target analysis
-        identity_region (str): QuickSight Region
+        target_analysis_name (str): Name of the target analysis
+        qs_client: QuickSight client
+        max_retries (int): number of times the merge is re-applied after a conflict
+        visual_dedup_policy (str): 'report' or 'collapse' near-duplicate visuals, None to skip
+        snapshot_store (SnapshotStore): records the input and merged definitions, None to skip
+        provenance_store (ProvenanceStore): records where every merged element came from, None to skip
     """
 
-    # definition of the target analysis
-    target_analysis_definition = qs_client.describe_analysis_definition(
-        AwsAccountId=account_id,
-        AnalysisId=target_analysis_id)
-
     # definition of the source analysis
     source_analysis_definition = qs_client.describe_analysis_definition(
         AwsAccountId=account_id,
         AnalysisId=source_analysis_id
     )
 
-    # write the target analysis definition
-    # json_object = json.dumps(
-    #     source_analysis_definition, indent=4, default=str)
-    # with open("./source_analysis_definition.json", "w") as outfile:
-    #     outfile.write(json_object)
-
-    # write the source analysis definition
-    # json_object = json.dumps(
-    #     target_analysis_definition, indent=4, default=str)
-    # with open("./target_analysis_definition_initial.json", "w") as outfile:
-    #     outfile.write(json_object)
-
-    class DuplicateParameterNameException(Exception):
-        """Exception raised when a duplicate parameter name is found"""
-        pass
-
-    class DuplicateCalculatedFieldException(Exception):
-        """Exception raised when a duplicate calculated field is found"""
-        pass
-
-    def get_dataset_identifier(dataset_arn, datasets):
-        """Gets the dataset identifier for a given dataset arn
-
-        Args:
-            dataset_arn (str): dataset arn
-            datasets (list): list of datasets
-
-        Returns:
-            str: dataset identifier
-        """
-        for dataset in datasets:
-            if dataset['DataSetArn'] == dataset_arn:
-                return dataset['Identifier']
-
-    def get_dataset_arn(dataset_identifier, datasets):
-        """Gets the dataset arn for a given dataset identifier
-
-        Args:
-            dataset_identifier (str): dataset identifier
-            datasets (list): list of datasets
-
-        Returns:
-            str: dataset arn
-        """
-        for datasetnum in range(len(datasets)):
-            if datasets[datasetnum]['Identifier'] == dataset_identifier:
-                return datasets[datasetnum]['DataSetArn']
-
-    def update_dataset_identifier(dataset_identifier):
-        """Updates the dataset identifier with a new value
-
-        Args:
-            dataset_identifier (str): dataset identifier
-
-        Returns:
-            str: new dataset identifier
-        """
-        if dataset_identifier[-1] in '1234567890' and dataset_identifier[-2] == '-':
-            identifier_updated = int(dataset_identifier[-1]) + 1
+    # append parameters, datasets, sheets, filters and calculated fields from source analysis to target
+    # the last call is the one that was written
+    snapshot = {}
+
+    def apply_source(target_definition):
+        if snapshot_store:
+            snapshot['Target'] = copy.deepcopy(target_definition)
+        if provenance_store:
+            snapshot['Provenance'], report = merge_incremental(
+                target_definition, source_analysis_definition['Definition'], source_analysis_id,
+                provenance_store.load(target_analysis_id, source_analysis_id))
+            print(f"Merged {report['Changed']} changed and skipped {report['Unchanged']} unchanged elements of analysis {source_analysis_id}")
         else:
-            identifier_updated = dataset_identifier + '-1'
-        return identifier_updated
-
-    def update_nested_dict(in_dict, key, value, match_value=None):
-        """Replaces the existing value of the key with a new value
-
-        Args:
-            in_dict(dict): dictionary to be executed
-            key (str): key to search for ; example 'DataSetIdentifier' or 'Identifier'...
-            value (str): value to replace with ; example 'NewValue'
-
-        Returns:
-            doesn't return anything but updates the dictionary in place
-        """
-        for k, v in in_dict.items():
-            if key == k and v == match_value:
-                in_dict[k] = value
-            elif isinstance(v, dict):
-                update_nested_dict(v, key, value, match_value)
-            elif isinstance(v, list):
-                for o in v:
-                    if isinstance(o, dict):
-                        update_nested_dict(o, key, value, match_value)
-
-    # variable definitions
-    target_analysis_dataset_arns = set()
-    target_analysis_dataset_identifiers = set()
-    target_analysis_datasets = target_analysis_definition[
-        'Definition']['DataSetIdentifierDeclarations']
-    target_analysis_parameters = target_analysis_definition['Definition']['ParameterDeclarations']
-    target_analysis_filter_groups = target_analysis_definition['Definition']['FilterGroups']
-    target_analysis_calculated_fields = target_analysis_definition[
-        'Definition']['CalculatedFields']
-    target_analysis_sheets = target_analysis_definition['Definition']['Sheets']
-    try:
-        target_analysis_theme = target_analysis_definition['ThemeArn']
-    except KeyError:
-        target_analysis_theme = None
-
-    source_analysis_dataset_arns = set()
-    source_analysis_dataset_identifiers = set()
-    source_analysis_datasets = source_analysis_definition[
-        'Definition']['DataSetIdentifierDeclarations']
-    source_analysis_sheets = source_analysis_definition['Definition']['Sheets']
-    source_analysis_parameters = source_analysis_definition['Definition']['ParameterDeclarations']
-    source_analysis_filter_groups = source_analysis_definition['Definition']['FilterGroups']
-    source_analysis_calculated_fields = source_analysis_definition[
-        'Definition']['CalculatedFields']
-
-    # append parameters from source analysis to target
-    try:
-        target_analysis_parameter_names = []
-        for parameter in target_analysis_parameters:
-            parameter_type = next(iter(parameter))
-            parameter_name = parameter[parameter_type]['Name']
-            target_analysis_parameter_names.append(parameter_name)
-
-        # collect the source analysis' parameter names
-        source_analysis_parameter_names = []
-        for parameter in source_analysis_parameters:
-            parameter_type = next(iter(parameter))
-            parameter_name = parameter[parameter_type]['Name']
-            source_analysis_parameter_names.append(parameter_name)
-
-        # decide whether or not to copy the source analysis' parameters to target
-        for parameter in source_analysis_parameters:
-            parameter_type = next(iter(parameter))
-            parameter_name = parameter[parameter_type]['Name']
-            if parameter in target_analysis_parameters:
-                continue
-            elif parameter_name in target_analysis_parameter_names:
-                raise DuplicateParameterNameException(
-                    f"Parameter: {parameter_name} exists in both the analyses, change the name of the parameter in one of the analyses and retry")
-            else:
-                target_analysis_parameters.append(parameter)
-
-    except DuplicateParameterNameException as e:
-        return json.loads(json.dumps(e, indent=4, default=str))
-
-    # dataset section
-    # find out the common dataset arns in source and target
-    for dataset in target_analysis_datasets:
-        target_analysis_dataset_arns.add(dataset['DataSetArn'])
-        target_analysis_dataset_identifiers.add(dataset['Identifier'])
-    for dataset in source_analysis_datasets:
-        source_analysis_dataset_arns.add(dataset['DataSetArn'])
-        source_analysis_dataset_identifiers.add(dataset['Identifier'])
-    common_arns = set.intersection(
-        target_analysis_dataset_arns, source_analysis_dataset_arns)
-    common_identifiers = set.intersection(
-        target_analysis_dataset_identifiers, source_analysis_dataset_identifiers)
-
-    # check if the dataset identifiers are different in source and target
-    dataset_arns_that_need_identifier_replacement = set()
-    dataset_identifiers_that_needs_update = set()
-    same_dataset_arn_different_identifier = False
-    same_dataset_identifier_different_arn = False
-
-    if common_arns:
-        for arn in common_arns:
-            target_dataset_identifier = get_dataset_identifier(
-                arn, target_analysis_datasets)
-            source_analysis_dataset_identifier = get_dataset_identifier(
-                arn, source_analysis_datasets)
-            if target_dataset_identifier != source_analysis_dataset_identifier:
-                dataset_arns_that_need_identifier_replacement.add(arn)
-                same_dataset_arn_different_identifier = True
-
-    # source identifiers for arn replacement list
-    if same_dataset_arn_different_identifier:
-        source_analysis_identifiers_for_common_arns = []
-        target_identifiers_for_common_arns = []
-        for arn in common_arns:
-            source_analysis_identifiers_for_common_arns.append(
-                get_dataset_identifier(arn, source_analysis_datasets))
-            target_identifiers_for_common_arns.append(
-                get_dataset_identifier(arn, target_analysis_datasets))
-
-    if common_identifiers:
-        for identifier in common_identifiers:
-            target_dataset_arn = get_dataset_arn(
-                identifier, target_analysis_datasets)
-            source_analysis_dataset_arn = get_dataset_arn(
-                identifier, source_analysis_datasets)
-            if target_dataset_arn != source_analysis_dataset_arn:
-                dataset_identifiers_that_needs_update.add(identifier)
-                same_dataset_identifier_different_arn = True
-
-    # copy datasets from source analysis if not present already in target
-    if same_dataset_identifier_different_arn:
-        for dataset_identifier in dataset_identifiers_that_needs_update:
-            updated_dataset_identifier = update_dataset_identifier(
-                dataset_identifier)
-            for dataset in source_analysis_datasets:
-                if dataset['Identifier'] == dataset_identifier:
-                    update_nested_dict(dataset, 'Identifier',
-                                       updated_dataset_identifier, dataset_identifier)
-
-    if same_dataset_arn_different_identifier:
-        for dataset_arn in dataset_arns_that_need_identifier_replacement:
-            source_dataset_identifier = get_dataset_identifier(
-                dataset_arn, source_analysis_datasets)
-            target_dataset_identifier = get_dataset_identifier(
-                dataset_arn, target_analysis_datasets)
-            for dataset in source_analysis_datasets:
-                if dataset['DataSetArn'] == dataset_arn:
-                    update_nested_dict(dataset, 'Identifier',
-                                       target_dataset_identifier, source_dataset_identifier)
-
-    for dataset in source_analysis_datasets:
-        if dataset not in target_analysis_datasets:
-            target_analysis_datasets.append(dataset)
-
-    # sheets section
-    # copy sheets from source analysis which are not present already in target
-    if same_dataset_identifier_different_arn:
-        for dataset_identifier in dataset_identifiers_that_needs_update:
-            updated_dataset_identifier = update_dataset_identifier(
-                dataset_identifier)
-            for sheet in source_analysis_sheets:
-                update_nested_dict(sheet, 'DataSetIdentifier',
-                                   updated_dataset_identifier, dataset_identifier)
-
-    if same_dataset_arn_different_identifier:
-        for dataset_identifier in dataset_arns_that_need_identifier_replacement:
-            source_dataset_identifier = get_dataset_identifier(
-                dataset_identifier, source_analysis_datasets)
-            target_dataset_identifier = get_dataset_identifier(
-                dataset_identifier, target_analysis_datasets)
-            for sheet in source_analysis_sheets:
-                update_nested_dict(sheet, 'DataSetIdentifier',
-                                   target_dataset_identifier, source_dataset_identifier)
-
-    for sheet in source_analysis_sheets:
-        if sheet not in target_analysis_sheets:
-            target_analysis_sheets.append(sheet)
-
-    # filters section
-    # copy filters from source analysis which are not present already in target
-    if same_dataset_identifier_different_arn:
-        for dataset_identifier in dataset_identifiers_that_needs_update:
-            updated_dataset_identifier = update_dataset_identifier(
-                dataset_identifier)
-            for filter_group in source_analysis_filter_groups:
-                update_nested_dict(filter_group, 'DataSetIdentifier',
-                                   updated_dataset_identifier, dataset_identifier)
-
-    if same_dataset_arn_different_identifier:
-        for dataset_identifier in dataset_arns_that_need_identifier_replacement:
-            source_dataset_identifier = get_dataset_identifier(
-                dataset_identifier, source_analysis_datasets)
-            target_dataset_identifier = get_dataset_identifier(
-                dataset_identifier, target_analysis_datasets)
-            update_nested_dict(filter_group, 'DataSetIdentifier',
-                               target_dataset_identifier, source_dataset_identifier)
-
-    for filter_group in source_analysis_filter_groups:
-        if filter_group not in target_analysis_filter_groups:
-            target_analysis_filter_groups.append(filter_group)
-
-    # copy the calculated fields in source to target
-    temp_source_analysis_calculated_fields = []
-
-    if same_dataset_identifier_different_arn:
-        for dataset_identifier in dataset_identifiers_that_needs_update:
-            updated_dataset_identifier = update_dataset_identifier(
-                dataset_identifier)
-            for calculated_field in source_analysis_calculated_fields:
-                update_nested_dict(calculated_field, 'DataSetIdentifier',
-                                   updated_dataset_identifier, dataset_identifier)
-                if calculated_field not in temp_source_analysis_calculated_fields:
-                    temp_source_analysis_calculated_fields.append(
-                        calculated_field)
-
-    if same_dataset_arn_different_identifier:
-        for dataset_identifier in dataset_arns_that_need_identifier_replacement:
-            source_dataset_identifier = get_dataset_identifier(
-                dataset_identifier, source_analysis_datasets)
-            target_dataset_identifier = get_dataset_identifier(
-                dataset_identifier, target_analysis_datasets)
-            update_nested_dict(calculated_field, 'DataSetIdentifier',
-                               target_dataset_identifier, source_dataset_identifier)
-            if calculated_field not in temp_source_analysis_calculated_fields:
-                temp_source_analysis_calculated_fields.append(
-                    calculated_field)
-
-    if not same_dataset_arn_different_identifier and not same_dataset_identifier_different_arn:
-        temp_source_analysis_calculated_fields = source_analysis_calculated_fields
+            merge_definitions(target_definition, copy.deepcopy(
+                source_analysis_definition['Definition']))
+        dedup_visuals(target_definition, visual_dedup_policy)
+        if provenance_store:
+            record_target_fingerprints(snapshot['Provenance'], target_definition)
+        snapshot['Output'] = target_definition
 
     try:
-        target_calculated_field_identifiers = []
-        for calculated_field in target_analysis_calculated_fields:
-            calculated_field_identifier = f"{calculated_field['Name']}->{calculated_field['DataSetIdentifier']}"
-            target_calculated_field_identifiers.append(
-                calculated_field_identifier)
-
-        for calculated_field in temp_source_analysis_calculated_fields:
-            calculated_field_identifier = f"{calculated_field['Name']}->{calculated_field['DataSetIdentifier']}"
-            if calculated_field in target_analysis_calculated_fields:
-                continue
-            elif calculated_field_identifier in target_calculated_field_identifiers:
-                raise DuplicateCalculatedFieldException(
-                    f"Calculated field: {calculated_field['Name']} exists in both the analyses, change the name of the calculated field in one of the analyses and retry")
-            else:
-                target_analysis_calculated_fields.append(calculated_field)
-
-    except DuplicateCalculatedFieldException as e:
-        return json.loads(json.dumps(e, indent=4, default=str))
-
-    # write the target analysis definition to a json file
-    # json_object = json.dumps(
-    #     target_analysis_definition, indent=4, default=str)
-    # with open("./target_analysis_definition_analysis_merge.json", "w") as outfile:
-    #     outfile.write(json_object)
-
-    try:
-        if target_analysis_theme:
-            qs_client.update_analysis(
-                AwsAccountId=account_id,
-                AnalysisId=target_analysis_id,
-                Name=target_analysis_name,
-                Definition=target_analysis_definition['Definition'],
-                ThemeArn=target_analysis_theme
-            )
-            return f"Analysis {target_analysis_name} updated successfully"
-        else:
-            qs_client.update_analysis(
-                AwsAccountId=account_id,
-                AnalysisId=target_analysis_id,
-                Name=target_analysis_name,
-                Definition=target_analysis_definition['Definition']
-            )
-            return f"Analysis {target_analysis_name} updated successfully"
+        update_with_optimistic_concurrency(
+            account_id, target_analysis_id, target_analysis_name, apply_source, qs_client, max_retries)
+        if snapshot_store:
+            save_merge_snapshot(snapshot_store, target_analysis_id, target_analysis_name,
+                                {target_analysis_id: snapshot['Target'],
+                                 source_analysis_id: source_analysis_definition['Definition']},
+                                snapshot['Output'], provenance=[snapshot['Provenance']] if provenance_store else None)
+        if provenance_store:
+            save_merge_provenance(provenance_store, target_analysis_id, [snapshot['Provenance']])
+        return f"Analysis {target_analysis_name} updated successfully"
 
     except Exception as e:
         return json.loads(json.dumps(e, indent=4, default=str))
@@ -0,0 +1,236 @@
+import copy
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from merge_provenance import merge_incremental
+from merge_stages import merge_definitions
+from optimistic_update import update_with_optimistic_concurrency
+
+
+class LocalSyncStateStore:
+    """Keeps the sync registry and state in a json file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return new_sync_state()
+        with open(self.path, 'r') as infile:
+            return json.load(infile)
+
+    def save(self, state):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as outfile:
+            json.dump(state, outfile, indent=4, default=str)
+        os.replace(temp_path, self.path)
+
+
+class S3SyncStateStore:
+    """Keeps the sync registry and state in a json object, so it survives Lambda cold starts"""
+
+    def __init__(self, bucket, key, s3_client):
+        self.bucket = bucket
+        self.key = key
+        self.s3_client = s3_client
+
+    def load(self):
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket, Key=self.key)
+        except self.s3_client.exceptions.NoSuchKey:
+            return new_sync_state()
+        return json.loads(response['Body'].read())
+
+    def save(self, state):
+        self.s3_client.put_object(
+            Bucket=self.bucket, Key=self.key,
+            Body=json.dumps(state, default=str).encode('utf-8'))
+
+
+def new_sync_state():
+    """Builds an empty sync state
+
+    Returns:
+        dict: 'Registry' maps a target analysis ID to its name and source analysis IDs,
+            'Synced' maps 'target->source' to the source LastUpdatedTime merged last
+    """
+    return {'Registry': {}, 'Synced': {}}
+
+
+def register_sync(state, target_analysis_id, target_analysis_name, source_analysis_ids):
+    """Adds or replaces the sources a target analysis is kept in sync with
+
+    Args:
+        state (dict): sync state, updated in place
+        target_analysis_id (str): Analysis ID of the target analysis
+        target_analysis_name (str): Name of the target analysis
+        source_analysis_ids (list): Analysis IDs merged into the target
+    """
+    state['Registry'][target_analysis_id] = {
+        'Name': target_analysis_name,
+        'Sources': list(source_analysis_ids)
+    }
+
+
+def sync_key(target_analysis_id, source_analysis_id):
+    return f"{target_analysis_id}->{source_analysis_id}"
+
+
+def to_timestamp(value):
+    """Normalises a LastUpdatedTime from boto3 or from the stored state"""
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def describe_last_updated_times(account_id, analysis_ids, qs_client, max_workers=10):
+    """Gets the LastUpdatedTime of many analyses with the cheap describe_analysis call
+
+    Args:
+        account_id (int): AWS account ID
+        analysis_ids (set): Analysis IDs to check, each one is described once
+        qs_client: QuickSight client
+        max_workers (int): number of describe calls in flight at once
+
+    Returns:
+        tuple: (analysis_id -> LastUpdatedTime, analysis_id -> error)
+    """
+    def describe(analysis_id):
+        try:
+            response = qs_client.describe_analysis(
+                AwsAccountId=account_id, AnalysisId=analysis_id)
+            return analysis_id, to_timestamp(response['Analysis']['LastUpdatedTime']), None
+        except Exception as e:
+            return analysis_id, None, e
+
+    last_updated_times = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for analysis_id, last_updated_time, error in executor.map(describe, sorted(analysis_ids)):
+            if error is None:
+                last_updated_times[analysis_id] = last_updated_time
+            else:
+                errors[analysis_id] = error
+    return last_updated_times, errors
+
+
+def sync_target(account_id, target_analysis_id, target_analysis_name, changed_source_ids, qs_client,
+                provenance_store=None):
+    """Merges the changed sources into the target with a single update_analysis call
+
+    With a provenance store, only the elements that changed in each source
+    are merged, replacing their earlier copies in the target.
+
+    Args:
+        account_id (int): AWS account ID
+        target_analysis_id (str): Analysis ID of the target analysis
+        target_analysis_name (str): Name of the target analysis
+        changed_source_ids (list): Analysis IDs of the sources that changed since the last sync
+        qs_client: QuickSight client
+        provenance_store (ProvenanceStore): records where every merged element came from, None to skip
+    """
+    source_definitions = [qs_client.describe_analysis_definition(
+        AwsAccountId=account_id,
+        AnalysisId=source_analysis_id)['Definition'] for source_analysis_id in changed_source_ids]
+
+    # the last call is the one that was written
+    provenances = []
+
+    def apply_sources(target_definition):
+        provenances.clear()
+        for source_analysis_id, source_definition in zip(changed_source_ids, source_definitions):
+            if provenance_store:
+                provenance, _ = merge_incremental(
+                    target_definition, source_definition, source_analysis_id,
+                    provenance_store.load(target_analysis_id, source_analysis_id))
+                provenances.append(provenance)
+            else:
+                merge_definitions(target_definition,
+                                  copy.deepcopy(source_definition))
+
+    update_with_optimistic_concurrency(
+        account_id, target_analysis_id, target_analysis_name, apply_sources, qs_client)
+    try:
+        for provenance in provenances:
+            provenance_store.save(target_analysis_id, provenance)
+    except Exception as e:
+        print(f"Could not save the merge provenance of analysis {target_analysis_id}: {e}")
+
+
+def sync_analyses(account_id, state_store, qs_client, max_workers=10, provenance_store=None, save_every=10):
+    """Brings every registered target up to date with the sources that changed
+
+    Each distinct source is described once per run, whatever the number of
+    targets it feeds; only the targets with at least one changed source are
+    fetched, merged and updated. A source is marked synced for a target only
+    once that target was updated, and the state is saved every save_every
+    updated targets, so a run cut short by the Lambda timeout does not redo
+    the targets it already finished.
+
+    Args:
+        account_id (int): AWS account ID
+        state_store: LocalSyncStateStore or S3SyncStateStore
+        qs_client: QuickSight client
+        max_workers (int): number of targets synced at once
+        provenance_store (ProvenanceStore): see sync_target
+        save_every (int): number of targets updated between two saves of the state
+
+    Returns:
+        dict: targets updated, unchanged and failed, with the reason of each failure
+    """
+    state = state_store.load()
+    registry = state['Registry']
+    synced = state['Synced']
+
+    source_ids = {source_id for target in registry.values()
+                  for source_id in target['Sources']}
+    last_updated_times, errors = describe_last_updated_times(
+        account_id, source_ids, qs_client, max_workers)
+
+    report = {'Updated': [], 'Unchanged': [], 'Failed': {}}
+    pending = {}
+    for target_analysis_id, target in registry.items():
+        missing = [source_id for source_id in target['Sources']
+                   if source_id in errors]
+        if missing:
+            report['Failed'][target_analysis_id] = f"describe_analysis failed for {missing}: {errors[missing[0]]}"
+            continue
+        changed = [source_id for source_id in target['Sources']
+                   if sync_key(target_analysis_id, source_id) not in synced
+                   or to_timestamp(synced[sync_key(target_analysis_id, source_id)]) < last_updated_times[source_id]]
+        if changed:
+            pending[target_analysis_id] = changed
+        else:
+            report['Unchanged'].append(target_analysis_id)
+
+    def run(target_analysis_id):
+        try:
+            sync_target(account_id, target_analysis_id, registry[target_analysis_id]['Name'],
+                        pending[target_analysis_id], qs_client, provenance_store)
+            return target_analysis_id, None
+        except Exception as e:
+            return target_analysis_id, json.loads(json.dumps(e, indent=4, default=str))
+
+    unsaved = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run, target_analysis_id)
+                   for target_analysis_id in sorted(pending)]
+        for future in as_completed(futures):
+            target_analysis_id, error = future.result()
+            if error is None:
+                report['Updated'].append(target_analysis_id)
+                for source_id in pending[target_analysis_id]:
+                    synced[sync_key(target_analysis_id, source_id)] = last_updated_times[source_id].isoformat()
+                unsaved += 1
+                if unsaved >= save_every:
+                    state_store.save(state)
+                    unsaved = 0
+            else:
+                report['Failed'][target_analysis_id] = error
+
+    state_store.save(state)
+    report['Updated'].sort()
+    return report
@@ -0,0 +1,199 @@
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from job_polling import wait_for_jobs
+
+EXPORT_TERMINAL_STATUSES = {'SUCCESSFUL', 'FAILED'}
+IMPORT_TERMINAL_STATUSES = {'SUCCESSFUL', 'FAILED', 'FAILED_ROLLBACK_COMPLETED',
+                            'FAILED_ROLLBACK_ERROR'}
+
+
+def analysis_arn(region, account_id, analysis_id):
+    """Builds the arn of an analysis
+
+    Args:
+        region (str): QuickSight Region
+        account_id (int): AWS account ID
+        analysis_id (str): Analysis ID
+
+    Returns:
+        str: analysis arn
+    """
+    return f"arn:aws:quicksight:{region}:{account_id}:analysis/{analysis_id}"
+
+
+def download_bundle(download_url):
+    """Downloads an exported asset bundle from its pre-signed url
+
+    Args:
+        download_url (str): DownloadUrl of a successful export job
+
+    Returns:
+        bytes: the asset bundle
+    """
+    with urllib.request.urlopen(download_url) as response:
+        return response.read()
+
+
+def new_job_id(prefix, analysis_id):
+    """Builds a unique asset bundle job ID for an analysis"""
+    return f"{prefix}-{analysis_id}-{uuid.uuid4().hex[:12]}"[:512]
+
+
+def migrate_analyses(analysis_ids, source_account_id, destination_account_id, region,
+                     source_client, destination_client, import_batch_size=5, max_workers=10,
+                     override_parameters=None, failure_action='ROLLBACK', download=download_bundle,
+                     poll_options=None):
+    """Moves analyses and everything they depend on to another account with asset bundle jobs
+
+    One export job per analysis is started at once with IncludeAllDependencies,
+    so the datasets, data sources and themes of the analysis travel with it.
+    The export jobs are polled concurrently, the bundles downloaded, and then
+    imported into the destination account import_batch_size jobs at a time.
+
+    Args:
+        analysis_ids (list): Analysis IDs to migrate, usually merged analyses
+        source_account_id (int): AWS account ID the analyses are exported from
+        destination_account_id (int): AWS account ID the bundles are imported into
+        region (str): QuickSight Region of the source analyses
+        source_client: QuickSight client of the source account
+        destination_client: QuickSight client of the destination account
+        import_batch_size (int): number of import jobs running at the same time
+        max_workers (int): number of API calls in flight at once
+        override_parameters (dict): OverrideParameters passed to every import job
+        failure_action (str): FailureAction of the import jobs
+        download (callable): DownloadUrl -> bundle bytes
+        poll_options (dict): keyword arguments for wait_for_jobs
+
+    Returns:
+        dict: per analysis status and timings, plus totals
+    """
+    poll_options = poll_options or {}
+    started = time.monotonic()
+    report = {analysis_id: {'Status': 'PENDING', 'Timings': {}}
+              for analysis_id in analysis_ids}
+
+    def progress(stage):
+        done = sum(1 for asset in report.values()
+                   if asset['Status'] in ('IMPORTED', 'FAILED'))
+        print(f"[{stage}] {done}/{len(report)} analyses done, {round(time.monotonic() - started, 1)}s elapsed")
+
+    def timed(analysis_id, stage, function, *args):
+        stage_started = time.monotonic()
+        try:
+            return function(*args)
+        finally:
+            report[analysis_id]['Timings'][stage] = round(
+                time.monotonic() - stage_started, 3)
+
+    def fail(analysis_id, stage, error):
+        report[analysis_id]['Status'] = 'FAILED'
+        report[analysis_id]['Error'] = f"{stage}: {error}"
+
+    # export section
+    # start one export job per analysis, all at once
+    def start_export(analysis_id):
+        job_id = new_job_id('export', analysis_id)
+        try:
+            timed(analysis_id, 'StartExport', lambda: source_client.start_asset_bundle_export_job(
+                AwsAccountId=source_account_id,
+                AssetBundleExportJobId=job_id,
+                ResourceArns=[analysis_arn(
+                    region, source_account_id, analysis_id)],
+                IncludeAllDependencies=True,
+                ExportFormat='QUICKSIGHT_JSON'
+            ))
+            return analysis_id, job_id
+        except Exception as e:
+            fail(analysis_id, 'StartExport', e)
+            return analysis_id, None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        export_jobs = {job_id: analysis_id for analysis_id, job_id
+                       in executor.map(start_export, analysis_ids) if job_id}
+    progress('export started')
+
+    def describe_export(job_id):
+        response = source_client.describe_asset_bundle_export_job(
+            AwsAccountId=source_account_id, AssetBundleExportJobId=job_id)
+        return response['JobStatus'], response
+
+    export_results = wait_for_jobs(
+        list(export_jobs), describe_export, EXPORT_TERMINAL_STATUSES,
+        max_workers=max_workers, **poll_options)
+    for job_id, result in export_results.items():
+        analysis_id = export_jobs[job_id]
+        report[analysis_id]['Timings']['Export'] = result['Seconds']
+        if result['Status'] == 'SUCCESSFUL':
+            report[analysis_id]['Status'] = 'EXPORTED'
+            report[analysis_id]['ExportJobId'] = job_id
+        else:
+            fail(analysis_id, 'Export', (result['Response'] or {}).get(
+                'Errors', result['Status']))
+    progress('export finished')
+
+    # import section
+    # download the bundles and import them into the destination in batches
+    # the download url expires a few minutes after it is issued, so it is
+    # asked for again right before the download instead of kept from the export
+    def start_import(analysis_id):
+        job_id = new_job_id('import', analysis_id)
+        try:
+            download_url = timed(analysis_id, 'DescribeExport', lambda: source_client.describe_asset_bundle_export_job(
+                AwsAccountId=source_account_id,
+                AssetBundleExportJobId=report[analysis_id]['ExportJobId'])['DownloadUrl'])
+            bundle = timed(analysis_id, 'Download', download, download_url)
+            import_kwargs = dict(
+                AwsAccountId=destination_account_id,
+                AssetBundleImportJobId=job_id,
+                AssetBundleImportSource={'Body': bundle},
+                FailureAction=failure_action
+            )
+            if override_parameters:
+                import_kwargs['OverrideParameters'] = override_parameters
+            timed(analysis_id, 'StartImport',
+                  lambda: destination_client.start_asset_bundle_import_job(**import_kwargs))
+            return analysis_id, job_id
+        except Exception as e:
+            fail(analysis_id, 'StartImport', e)
+            return analysis_id, None
+
+    def describe_import(job_id):
+        response = destination_client.describe_asset_bundle_import_job(
+            AwsAccountId=destination_account_id, AssetBundleImportJobId=job_id)
+        return response['JobStatus'], response
+
+    exported = [analysis_id for analysis_id in analysis_ids
+                if report[analysis_id]['Status'] == 'EXPORTED']
+    for batch_start in range(0, len(exported), import_batch_size):
+        batch = exported[batch_start:batch_start + import_batch_size]
+        # do not start imports that could not be followed up before the deadline
+        if poll_options.get('deadline') is not None and time.monotonic() >= poll_options['deadline']:
+            for analysis_id in batch:
+                fail(analysis_id, 'StartImport', 'deadline reached before the import could start')
+            continue
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            import_jobs = {job_id: analysis_id for analysis_id, job_id
+                           in executor.map(start_import, batch) if job_id}
+        import_results = wait_for_jobs(
+            list(import_jobs), describe_import, IMPORT_TERMINAL_STATUSES,
+            max_workers=max_workers, **poll_options)
+        for job_id, result in import_results.items():
+            analysis_id = import_jobs[job_id]
+            report[analysis_id]['Timings']['Import'] = result['Seconds']
+            if result['Status'] == 'SUCCESSFUL':
+                report[analysis_id]['Status'] = 'IMPORTED'
+            else:
+                fail(analysis_id, 'Import', (result['Response'] or {}).get(
+                    'Errors', result['Status']))
+        progress(
+            f"import batch {batch_start // import_batch_size + 1}")
+
+    return {
+        'Analyses': report,
+        'Imported': sum(1 for asset in report.values() if asset['Status'] == 'IMPORTED'),
+        'Failed': sum(1 for asset in report.values() if asset['Status'] == 'FAILED'),
+        'Seconds': round(time.monotonic() - started, 3)
+    }
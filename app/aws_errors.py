@@ -0,0 +1,3 @@
+def error_code(e):
+    """Gets the AWS error code of a botocore ClientError, None for other exceptions"""
+    return getattr(e, 'response', {}).get('Error', {}).get('Code')
@@ -0,0 +1,122 @@
+import copy
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from merge_provenance import (PROVENANCE_SECTIONS, merge_incremental,
+                              record_target_fingerprints)
+from merge_stages import fingerprint
+from optimistic_update import update_with_optimistic_concurrency
+from visual_dedup import dedup_visuals
+
+
+class SourceIndex:
+    """A source definition prepared once to be merged into many targets
+
+    The fingerprint of every sheet, filter group and calculated field of
+    the source is computed once for all the targets. Each target then only
+    copies and remaps the elements that changed since its provenance map
+    was recorded, and replaces their earlier copies, so pushing an edited
+    source again never duplicates a sheet.
+    """
+
+    def __init__(self, source_analysis_id, source_definition):
+        self.source_analysis_id = source_analysis_id
+        self.definition = source_definition
+        self.fingerprints = {section: [fingerprint(element) for element in source_definition.get(section, [])]
+                             for section in PROVENANCE_SECTIONS}
+
+    def apply(self, target_definition, provenance=None):
+        """Merges the indexed source into a target definition, see merge_provenance.merge_incremental
+
+        Args:
+            target_definition (dict): 'Definition' of the target analysis, updated in place
+            provenance (dict): map recorded by the last merge of the source into the target, None for none
+
+        Returns:
+            tuple: (provenance map of the target after the merge, merge report)
+
+        Raises:
+            DuplicateParameterNameException, DuplicateCalculatedFieldException, DuplicateElementIdException
+        """
+        return merge_incremental(target_definition, self.definition, self.source_analysis_id,
+                                 provenance, self.fingerprints)
+
+
+def broadcast_merge(account_id, source_analysis_id, target_analysis_ids, qs_client, max_workers=10,
+                    max_retries=3, visual_dedup_policy=None, snapshot_store=None, provenance_store=None):
+    """Merges one source analysis into many target analyses
+
+    The source definition is fetched and indexed once, then applied to
+    every target concurrently. Every target is written with optimistic
+    concurrency and a failing target does not stop the others. Elements of
+    the source already in a target are replaced, not appended again.
+
+    Args:
+        account_id (int): AWS account ID
+        source_analysis_id (str): Analysis ID of the source analysis
+        target_analysis_ids (list): Analysis IDs of the target analyses, they keep their names
+        qs_client: QuickSight client
+        max_workers (int): number of targets merged at once
+        max_retries (int): number of times the merge is re-applied to a target after a conflict
+        visual_dedup_policy (str): 'report' or 'collapse' near-duplicate visuals, None to skip
+        snapshot_store (SnapshotStore): records the input and merged definitions, None to skip
+        provenance_store (ProvenanceStore): records where every merged element came from, None to skip
+
+    Returns:
+        dict: per target status, error and duration, plus totals
+    """
+    started = time.monotonic()
+    source_analysis_definition = qs_client.describe_analysis_definition(
+        AwsAccountId=account_id,
+        AnalysisId=source_analysis_id)
+    source_index = SourceIndex(source_analysis_id, source_analysis_definition['Definition'])
+
+    def run(target_analysis_id):
+        target_started = time.monotonic()
+        # the last call is the one that was written
+        snapshot = {}
+
+        def apply_source(target_definition):
+            if snapshot_store:
+                snapshot['Target'] = copy.deepcopy(target_definition)
+            snapshot['Provenance'], _ = source_index.apply(
+                target_definition,
+                provenance_store.load(target_analysis_id, source_analysis_id) if provenance_store else None)
+            dedup_visuals(target_definition, visual_dedup_policy)
+            record_target_fingerprints(snapshot['Provenance'], target_definition)
+            snapshot['Output'] = target_definition
+
+        try:
+            update_with_optimistic_concurrency(
+                account_id, target_analysis_id, None, apply_source, qs_client, max_retries)
+            result = {'Status': 'UPDATED'}
+        except Exception as e:
+            result = {'Status': 'FAILED',
+                      'Error': json.loads(json.dumps(e, indent=4, default=str))}
+        if snapshot_store and result['Status'] == 'UPDATED':
+            try:
+                result['MergeId'] = snapshot_store.save_merge(
+                    target_analysis_id, None,
+                    {target_analysis_id: snapshot['Target'],
+                     source_analysis_id: source_analysis_definition['Definition']},
+                    snapshot['Output'], provenance=[snapshot['Provenance']] if provenance_store else None)
+            except Exception as e:
+                print(f"Could not save the merge snapshot of analysis {target_analysis_id}: {e}")
+        if provenance_store and result['Status'] == 'UPDATED':
+            try:
+                provenance_store.save(target_analysis_id, snapshot['Provenance'])
+            except Exception as e:
+                print(f"Could not save the merge provenance of analysis {target_analysis_id}: {e}")
+        result['Seconds'] = round(time.monotonic() - target_started, 3)
+        return target_analysis_id, result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(executor.map(run, target_analysis_ids))
+
+    return {
+        'Targets': results,
+        'Updated': sum(1 for result in results.values() if result['Status'] == 'UPDATED'),
+        'Failed': sum(1 for result in results.values() if result['Status'] == 'FAILED'),
+        'Seconds': round(time.monotonic() - started, 3)
+    }
@@ -0,0 +1,215 @@
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_errors import error_code
+
+ERROR = 'ERROR'
+WARNING = 'WARNING'
+
+# errors that will not go away by retrying, cached like a successful describe
+CACHED_ERROR_CODES = {'ResourceNotFoundException', 'AccessDeniedException'}
+
+# the only describe error that means the merged analysis cannot be created;
+# others (throttling, dataset types the API does not describe...) only warn
+MISSING_DATASET_ERROR_CODE = 'ResourceNotFoundException'
+
+# {field name} references of calculated field expressions; ${parameter} references are skipped
+FIELD_REFERENCE = re.compile(r'(?<!\$)\{([^{}]+)\}')
+
+# shared by every invocation of a warm Lambda container
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class DatasetPreflightException(Exception):
+    """Exception raised when the datasets of a merged analysis cannot be used by its target"""
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__(f"Dataset preflight found {len(problems)} problems: "
+                         + '; '.join(problem['Problem'] for problem in problems))
+
+
+def blocking_problems(problems):
+    """Keeps the problems that stop the merge, warnings are only reported"""
+    return [problem for problem in problems if problem['Severity'] == ERROR]
+
+
+def cached(key, load, ttl, clock=time.monotonic):
+    """Returns the cached value of a key, loading it when it is missing or older than ttl seconds"""
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] > clock():
+            return entry[1]
+    value = load()
+    with _cache_lock:
+        _cache[key] = (clock() + ttl, value)
+    return value
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def dataset_id(dataset_arn):
+    """Gets the dataset ID at the end of a dataset arn"""
+    return dataset_arn.rsplit('/', 1)[-1]
+
+
+def describe_dataset(account_id, dataset_arn, qs_client, ttl=300):
+    """Describes a dataset and its permissions, cached for ttl seconds
+
+    Args:
+        account_id (int): AWS account ID
+        dataset_arn (str): DataSetArn of a dataset declaration
+        qs_client: QuickSight client
+        ttl (int): seconds a description is reused for
+
+    Returns:
+        dict: 'Columns' (list of output column names), 'Principals' (list of principal arns),
+            'Error' (str, None when the dataset could be described), 'ErrorCode' (str, AWS error code)
+    """
+    def load():
+        try:
+            dataset = qs_client.describe_data_set(
+                AwsAccountId=account_id, DataSetId=dataset_id(dataset_arn))['DataSet']
+            permissions = qs_client.describe_data_set_permissions(
+                AwsAccountId=account_id, DataSetId=dataset_id(dataset_arn))['Permissions']
+        except Exception as e:
+            if error_code(e) not in CACHED_ERROR_CODES:
+                raise
+            return {'Columns': [], 'Principals': [], 'Error': str(e), 'ErrorCode': error_code(e)}
+        return {'Columns': [column['Name'] for column in dataset.get('OutputColumns', [])],
+                'Principals': [permission['Principal'] for permission in permissions],
+                'Error': None, 'ErrorCode': None}
+
+    try:
+        return cached(('dataset', account_id, dataset_arn), load, ttl)
+    except Exception as e:
+        return {'Columns': [], 'Principals': [], 'Error': str(e), 'ErrorCode': error_code(e)}
+
+
+def describe_principals(account_id, principal_arn, qs_client, ttl=300):
+    """Lists the arns a QuickSight user can be granted dataset permissions through, cached for ttl seconds
+
+    Returns:
+        set: the user arn, the arn of the namespace of the user and the arns of the groups of the user
+    """
+    arn_prefix, user_path = principal_arn.split(':user/', 1)
+    namespace, user_name = user_path.split('/', 1)
+    namespace_arn = f"{arn_prefix}:namespace/{namespace}"
+
+    def load():
+        group_arns = []
+        kwargs = dict(AwsAccountId=account_id,
+                      Namespace=namespace, UserName=user_name)
+        while True:
+            response = qs_client.list_user_groups(**kwargs)
+            group_arns.extend(group['Arn'] for group in response.get('GroupList', []))
+            if not response.get('NextToken'):
+                return group_arns
+            kwargs['NextToken'] = response['NextToken']
+
+    return {principal_arn, namespace_arn, *cached(('principals', account_id, principal_arn), load, ttl)}
+
+
+def referenced_columns(in_dict, columns=None):
+    """Collects every {'DataSetIdentifier', 'ColumnName'} column reference of a definition
+
+    Args:
+        in_dict (dict): analysis 'Definition' or any part of it
+        columns (set): set to add to
+
+    Returns:
+        set: (dataset identifier, column name)
+    """
+    columns = set() if columns is None else columns
+    if isinstance(in_dict.get('DataSetIdentifier'), str) and isinstance(in_dict.get('ColumnName'), str):
+        columns.add((in_dict['DataSetIdentifier'], in_dict['ColumnName']))
+    for v in in_dict.values():
+        if isinstance(v, dict):
+            referenced_columns(v, columns)
+        elif isinstance(v, list):
+            for o in v:
+                if isinstance(o, dict):
+                    referenced_columns(o, columns)
+    return columns
+
+
+def preflight_datasets(account_id, definition, qs_client, principal_arn=None, max_workers=10, ttl=300):
+    """Checks, before any write, that a merged analysis can be created on its datasets
+
+    Every dataset declared in the definition is described concurrently,
+    and descriptions are cached across invocations for ttl seconds. Checks
+    that each dataset exists, that every column referenced by visuals,
+    filters and calculated fields is an output column of its dataset or a
+    calculated field of the analysis, and that every {field} of a
+    calculated field expression is one of those too; these are errors.
+    A dataset that cannot be described for another reason than not existing,
+    e.g. throttling or a file upload the API does not describe, is only a
+    warning and its columns are not checked. Whether the principal has a
+    permission on each dataset, directly, through its namespace or through
+    one of its groups, is only a warning too: access granted through a
+    shared folder does not show in the dataset permissions.
+
+    Args:
+        account_id (int): AWS account ID
+        definition (dict): merged analysis 'Definition'
+        qs_client: QuickSight client
+        principal_arn (str): QuickSight user the analysis is created for, None to skip the permission check
+        max_workers (int): number of datasets described at once
+        ttl (int): seconds a dataset description is reused for
+
+    Returns:
+        list: every problem found, {'DataSetIdentifier', 'DataSetArn', 'Severity', 'Problem'},
+            'Severity' being ERROR or WARNING, empty if none
+    """
+    datasets = {dataset['Identifier']: dataset['DataSetArn']
+                for dataset in definition.get('DataSetIdentifierDeclarations', [])}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        described = dict(zip(datasets, executor.map(
+            lambda dataset_arn: describe_dataset(account_id, dataset_arn, qs_client, ttl),
+            datasets.values())))
+        principals = executor.submit(
+            describe_principals, account_id, principal_arn, qs_client, ttl) if principal_arn else None
+
+    problems = []
+
+    def report(identifier, problem, severity=ERROR):
+        problems.append({'DataSetIdentifier': identifier, 'DataSetArn': datasets.get(identifier),
+                         'Severity': severity, 'Problem': problem})
+
+    if principals is not None:
+        try:
+            principals = principals.result()
+        except Exception as e:
+            report(None, f"Could not list the groups of {principal_arn}: {e}", WARNING)
+            principals = None
+
+    for identifier, description in described.items():
+        if description['Error']:
+            report(identifier, f"Dataset {identifier} could not be described: {description['Error']}",
+                   ERROR if description['ErrorCode'] == MISSING_DATASET_ERROR_CODE else WARNING)
+        elif principals is not None and not principals.intersection(description['Principals']):
+            report(identifier, f"{principal_arn} has no direct, namespace or group permission on dataset {identifier}",
+                   WARNING)
+
+    fields = {identifier: set(description['Columns']) for identifier, description in described.items()}
+    for calculated_field in definition.get('CalculatedFields', []):
+        fields.setdefault(calculated_field['DataSetIdentifier'], set()).add(calculated_field['Name'])
+
+    columns = referenced_columns(definition)
+    for calculated_field in definition.get('CalculatedFields', []):
+        for field_name in FIELD_REFERENCE.findall(calculated_field.get('Expression', '')):
+            columns.add((calculated_field['DataSetIdentifier'], field_name))
+
+    for identifier, column_name in sorted(columns):
+        if identifier not in datasets:
+            report(identifier, f"Column {column_name} refers to undeclared dataset {identifier}")
+        elif not described[identifier]['Error'] and column_name not in fields[identifier]:
+            report(identifier, f"Column {column_name} is not in dataset {identifier}")
+    return problems
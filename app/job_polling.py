@@ -0,0 +1,78 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+TIMED_OUT = 'TIMED_OUT'
+
+
+def wait_for_jobs(job_ids, describe_status, terminal_statuses, initial_delay=1, max_delay=30,
+                  timeout=600, max_workers=10, sleep=time.sleep, clock=time.monotonic, on_status=None,
+                  deadline=None):
+    """Polls many asynchronous QuickSight jobs concurrently until they finish
+
+    Every job keeps its own exponential backoff: a job that is still running
+    is polled again after twice the previous delay, up to max_delay. A failed
+    describe call (throttling, network) is treated like a running job, so a
+    throttled account is polled less often instead of failing the run.
+
+    Args:
+        job_ids (list): identifiers of the jobs to poll
+        describe_status (callable): job_id -> (status, response)
+        terminal_statuses (set): statuses after which a job is not polled anymore
+        initial_delay (float): seconds before a job is polled the second time
+        max_delay (float): upper bound of the delay between two polls of a job
+        timeout (float): seconds after which the remaining jobs are reported as TIMED_OUT
+        max_workers (int): number of describe calls in flight at once
+        sleep (callable): used to wait between polling rounds
+        clock (callable): monotonic clock in seconds
+        on_status (callable): called with (job_id, status) whenever a status changes
+        deadline (float): clock value after which the remaining jobs are reported as TIMED_OUT,
+            whatever the timeout, e.g. shortly before the Lambda runs out of time
+
+    Returns:
+        dict: job_id -> {'Status', 'Response', 'Seconds'}
+    """
+    started = clock()
+    if deadline is not None:
+        timeout = min(timeout, deadline - started)
+    results = {}
+    pending = {job_id: {'next_poll': started, 'delay': initial_delay, 'status': None}
+               for job_id in job_ids}
+
+    def poll(job_id):
+        try:
+            return job_id, describe_status(job_id), None
+        except Exception as e:
+            return job_id, None, e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending:
+            now = clock()
+            if now - started >= timeout:
+                for job_id in pending:
+                    results[job_id] = {'Status': TIMED_OUT, 'Response': None,
+                                       'Seconds': round(now - started, 3)}
+                break
+            due = [job_id for job_id, state in pending.items()
+                   if state['next_poll'] <= now]
+            for job_id, status_response, error in executor.map(poll, due):
+                state = pending[job_id]
+                if error is None:
+                    status, response = status_response
+                    if status != state['status'] and on_status:
+                        on_status(job_id, status)
+                    state['status'] = status
+                    if status in terminal_statuses:
+                        results[job_id] = {'Status': status, 'Response': response,
+                                           'Seconds': round(clock() - started, 3)}
+                        del pending[job_id]
+                        continue
+                else:
+                    print(f"Polling job {job_id} failed, backing off: {error}")
+                state['next_poll'] = clock() + state['delay']
+                state['delay'] = min(state['delay'] * 2, max_delay)
+            if pending:
+                next_poll = min(state['next_poll']
+                                for state in pending.values())
+                sleep(max(0, min(next_poll, started + timeout) - clock()))
+    return results
@@ -0,0 +1,231 @@
+import copy
+import json
+
+from merge_stages import (DuplicateCalculatedFieldException,
+                          DuplicateElementIdException, fingerprint,
+                          get_calculated_field_identifier, merge_datasets,
+                          merge_parameters, remap_element)
+from snapshot_store import SnapshotNotFoundException
+from visual_dedup import get_visual_id
+
+# sections whose elements are tracked one by one, and replaced when their source changes
+PROVENANCE_SECTIONS = ['Sheets', 'FilterGroups', 'CalculatedFields']
+
+
+def get_element_id(section, element):
+    """Gets the ID an element is tracked by in its section
+
+    Args:
+        section (str): 'Sheets', 'FilterGroups' or 'CalculatedFields'
+        element (dict): sheet, filter group or calculated field
+
+    Returns:
+        str: SheetId, FilterGroupId or calculated field identifier
+    """
+    if section == 'Sheets':
+        return element['SheetId']
+    if section == 'FilterGroups':
+        return element['FilterGroupId']
+    return get_calculated_field_identifier(element)
+
+
+def new_provenance(source_analysis_id):
+    """Builds an empty provenance map
+
+    Returns:
+        dict: 'Elements' maps a section, and 'Visuals', to the target element IDs that
+            came from the source, each with its 'SourceAnalysisId', 'SourceElementId',
+            the 'Fingerprint' of the source element when it was merged and, for sheets,
+            filter groups and calculated fields, the 'TargetFingerprint' of the copy written
+    """
+    return {'SourceAnalysisId': source_analysis_id,
+            'Elements': {section: {} for section in PROVENANCE_SECTIONS + ['Visuals']}}
+
+
+class ProvenanceStore:
+    """Keeps one provenance map per target and source, next to the merge snapshots
+
+    Maps are stored at 'provenance/<target analysis ID>/<source analysis ID>.json'
+    so merges of different sources into the same target never overwrite
+    each other's map.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _key(self, target_analysis_id, source_analysis_id):
+        return f"provenance/{target_analysis_id}/{source_analysis_id}.json"
+
+    def load(self, target_analysis_id, source_analysis_id):
+        """Loads the provenance map of a source in a target
+
+        Returns:
+            dict: the provenance map, None if the source was never merged or the map
+                could not be read, in which case the next merge is a full merge
+        """
+        try:
+            return json.loads(self.backend.get(self._key(target_analysis_id, source_analysis_id)))
+        except SnapshotNotFoundException:
+            return None
+        except Exception as e:
+            print(f"Could not load the merge provenance of analysis {source_analysis_id} "
+                  f"in analysis {target_analysis_id}, merging it in full: {e}")
+            return None
+
+    def save(self, target_analysis_id, provenance):
+        self.backend.put(self._key(target_analysis_id, provenance['SourceAnalysisId']),
+                         json.dumps(provenance, indent=4).encode('utf-8'))
+
+    def clear(self, target_analysis_id):
+        """Forgets every provenance map of a target, e.g. after it was rolled back"""
+        for key in self.backend.list_keys(f"provenance/{target_analysis_id}"):
+            self.backend.delete(key)
+
+
+def duplicate_element_exception(section, element):
+    """Builds the exception raised when an element ID is already used by a different element"""
+    if section == 'CalculatedFields':
+        return DuplicateCalculatedFieldException(
+            f"Calculated field: {element['Name']} exists in both the analyses, change the name of the calculated field in one of the analyses and retry")
+    return DuplicateElementIdException(
+        f"{section[:-1]}: {get_element_id(section, element)} exists with a different content in both the analyses, "
+        f"change the ID in one of the analyses and retry")
+
+
+def record_visuals(recorded_visuals, sheet, target_sheet_id, source_analysis_id, previous_visuals):
+    """Records the visuals of a changed source sheet
+
+    Returns:
+        int: number of visuals that are new or changed since the previous merge
+    """
+    changed = 0
+    for visual in sheet.get('Visuals', []):
+        visual_id = get_visual_id(visual)
+        visual_fingerprint = fingerprint(visual)
+        previous = previous_visuals.get(visual_id)
+        if previous is None or previous['Fingerprint'] != visual_fingerprint:
+            changed += 1
+        recorded_visuals[visual_id] = {
+            'SourceAnalysisId': source_analysis_id,
+            'SourceElementId': visual_id,
+            'SheetId': target_sheet_id,
+            'Fingerprint': visual_fingerprint
+        }
+    return changed
+
+
+def record_target_fingerprints(provenance, target_definition):
+    """Records the fingerprint of the copies as they are written, after the later merge stages
+
+    Stages that run after merge_incremental, like visual_dedup.dedup_visuals,
+    change the copies it placed in the target; without this the next merge
+    would take every such copy for an edited one and merge it again.
+
+    Args:
+        provenance (dict): map returned by merge_incremental, updated in place
+        target_definition (dict): 'Definition' that is written to the target
+    """
+    for section in PROVENANCE_SECTIONS:
+        elements = {get_element_id(section, element): element for element in target_definition.get(section, [])}
+        for target_id, entry in provenance['Elements'][section].items():
+            if target_id in elements:
+                entry['TargetFingerprint'] = fingerprint(elements[target_id])
+
+
+def merge_incremental(target_definition, source_definition, source_analysis_id, provenance=None,
+                      source_fingerprints=None):
+    """Merges a source definition into a target, processing only what changed since the last merge
+
+    A source sheet, filter group or calculated field whose fingerprint is
+    the one recorded at the last merge, and whose copy in the target is
+    still the one that was written, is skipped without being copied or
+    remapped. A changed element, or one whose copy was edited or rolled
+    back since, replaces its earlier copy where it stands instead of being
+    appended next to it. Only copies the provenance map attributes to this
+    source are ever replaced: an element without provenance is skipped when
+    the target already has an identical one, appended when its ID is free,
+    and refused when its ID is used by a different element, since the
+    target's own element must not be lost. A merge without a provenance map
+    is a full merge that records one. Copies of elements removed from the
+    source are left in the target.
+
+    Args:
+        target_definition (dict): 'Definition' of the target analysis, updated in place
+        source_definition (dict): 'Definition' of the source analysis, not modified
+        source_analysis_id (str): Analysis ID of the source analysis
+        provenance (dict): map recorded by the last merge of this source into the target, None for none
+        source_fingerprints (dict): section -> fingerprints of the source elements, in order,
+            when they were computed once for many targets; None to compute them
+
+    Returns:
+        tuple: (provenance map of the target after the merge, {'Changed', 'Unchanged', 'ChangedVisuals'})
+
+    Raises:
+        DuplicateParameterNameException, DuplicateCalculatedFieldException, DuplicateElementIdException
+    """
+    previous = (provenance or new_provenance(source_analysis_id))['Elements']
+    merged = new_provenance(source_analysis_id)
+    report = {'Changed': 0, 'Unchanged': 0, 'ChangedVisuals': 0}
+
+    merge_parameters(target_definition.setdefault('ParameterDeclarations', []),
+                     copy.deepcopy(source_definition.get('ParameterDeclarations', [])))
+    identifier_map = merge_datasets(target_definition.setdefault('DataSetIdentifierDeclarations', []),
+                                    copy.deepcopy(source_definition.get('DataSetIdentifierDeclarations', [])))
+
+    previous_visuals = previous.get('Visuals', {})
+    recorded_visuals = merged['Elements']['Visuals']
+    for section in PROVENANCE_SECTIONS:
+        target_elements = target_definition.setdefault(section, [])
+        positions = {get_element_id(section, element): position
+                     for position, element in enumerate(target_elements)}
+        previous_by_source_id = {entry['SourceElementId']: (target_id, entry)
+                                 for target_id, entry in previous.get(section, {}).items()}
+        recorded = merged['Elements'][section]
+
+        for position, element in enumerate(source_definition.get(section, [])):
+            source_id = get_element_id(section, element)
+            element_fingerprint = source_fingerprints[section][position] if source_fingerprints \
+                else fingerprint(element)
+            target_id, entry = previous_by_source_id.get(source_id, (None, None))
+            replaces = entry is not None and target_id in positions
+
+            # unchanged since the last merge and the copy written then is still there, keep it
+            if replaces and entry['Fingerprint'] == element_fingerprint \
+                    and entry.get('TargetFingerprint') == fingerprint(target_elements[positions[target_id]]):
+                recorded[target_id] = entry
+                if section == 'Sheets':
+                    recorded_visuals.update({visual_id: visual for visual_id, visual in previous_visuals.items()
+                                             if visual['SheetId'] == target_id})
+                report['Unchanged'] += 1
+                continue
+
+            new_element = remap_element(copy.deepcopy(element), identifier_map)
+            new_target_id = get_element_id(section, new_element)
+            if replaces:
+                position = positions.pop(target_id)
+                if new_target_id in positions:
+                    raise duplicate_element_exception(section, new_element)
+                target_elements[position] = new_element
+                positions[new_target_id] = position
+            elif new_target_id in positions and target_elements[positions[new_target_id]] == new_element:
+                # already in the target but not attributed to this source, e.g. after "Save as"
+                report['Unchanged'] += 1
+                continue
+            elif new_target_id in positions:
+                raise duplicate_element_exception(section, new_element)
+            else:
+                positions[new_target_id] = len(target_elements)
+                target_elements.append(new_element)
+            report['Changed'] += 1
+
+            recorded[new_target_id] = {
+                'SourceAnalysisId': source_analysis_id,
+                'SourceElementId': source_id,
+                'Fingerprint': element_fingerprint,
+                'TargetFingerprint': fingerprint(new_element)
+            }
+            if section == 'Sheets':
+                report['ChangedVisuals'] += record_visuals(
+                    recorded_visuals, element, new_target_id, source_analysis_id, previous_visuals)
+
+    return merged, report
@@ -0,0 +1,344 @@
+import hashlib
+import json
+
+
+class DuplicateParameterNameException(Exception):
+    """Exception raised when a duplicate parameter name is found"""
+    pass
+
+
+class DuplicateCalculatedFieldException(Exception):
+    """Exception raised when a duplicate calculated field is found"""
+    pass
+
+
+class DuplicateElementIdException(Exception):
+    """Exception raised when two different sheets or filter groups have the same ID"""
+    pass
+
+
+def empty_definition():
+    """Builds the skeleton definition every merged analysis starts from
+
+    Returns:
+        dict: analysis definition with empty sections
+    """
+    return {
+        'DataSetIdentifierDeclarations': [],
+        'Sheets': [],
+        'CalculatedFields': [],
+        'ParameterDeclarations': [],
+        'FilterGroups': [],
+        'ColumnConfigurations': [],
+        'AnalysisDefaults': {
+            'DefaultNewSheetConfiguration': {
+                'InteractiveLayoutConfiguration': {
+                    'Grid': {
+                        'CanvasSizeOptions': {
+                            'ScreenCanvasSizeOptions': {
+                                'ResizeOption': 'FIXED',
+                                'OptimizedViewPortWidth': '1600px'
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+
+def get_dataset_identifier(dataset_arn, datasets):
+    """Gets the dataset identifier for a given dataset arn
+
+    Args:
+        dataset_arn (str): dataset arn
+        datasets (list): list of datasets
+
+    Returns:
+        str: dataset identifier
+    """
+    for dataset in datasets:
+        if dataset['DataSetArn'] == dataset_arn:
+            return dataset['Identifier']
+
+
+def get_dataset_arn(dataset_identifier, datasets):
+    """Gets the dataset arn for a given dataset identifier
+
+    Args:
+        dataset_identifier (str): dataset identifier
+        datasets (list): list of datasets
+
+    Returns:
+        str: dataset arn
+    """
+    for dataset in datasets:
+        if dataset['Identifier'] == dataset_identifier:
+            return dataset['DataSetArn']
+
+
+def update_dataset_identifier(dataset_identifier):
+    """Updates the dataset identifier with a new value
+
+    Args:
+        dataset_identifier (str): dataset identifier
+
+    Returns:
+        str: new dataset identifier
+    """
+    prefix, _, suffix = dataset_identifier.rpartition('-')
+    if prefix and suffix.isdigit():
+        return f"{prefix}-{int(suffix) + 1}"
+    return dataset_identifier + '-1'
+
+
+def update_nested_dict(in_dict, key, value, match_value=None):
+    """Replaces the existing value of the key with a new value
+
+    Args:
+        in_dict(dict): dictionary to be executed
+        key (str): key to search for ; example 'DataSetIdentifier' or 'Identifier'...
+        value (str): value to replace with ; example 'NewValue'
+
+    Returns:
+        doesn't return anything but updates the dictionary in place
+    """
+    for k, v in in_dict.items():
+        if key == k and v == match_value:
+            in_dict[k] = value
+        elif isinstance(v, dict):
+            update_nested_dict(v, key, value, match_value)
+        elif isinstance(v, list):
+            for o in v:
+                if isinstance(o, dict):
+                    update_nested_dict(o, key, value, match_value)
+
+
+def remap_nested_dict(in_dict, key, identifier_map):
+    """Replaces every value of the key found in the identifier map in a single pass
+
+    Unlike calling update_nested_dict once per identifier, a value that is
+    renamed is never renamed a second time by a later entry of the map.
+
+    Args:
+        in_dict (dict): dictionary to be executed
+        key (str): key to search for ; example 'DataSetIdentifier'
+        identifier_map (dict): old value -> new value
+
+    Returns:
+        doesn't return anything but updates the dictionary in place
+    """
+    for k, v in in_dict.items():
+        if key == k and isinstance(v, str) and v in identifier_map:
+            in_dict[k] = identifier_map[v]
+        elif isinstance(v, dict):
+            remap_nested_dict(v, key, identifier_map)
+        elif isinstance(v, list):
+            for o in v:
+                if isinstance(o, dict):
+                    remap_nested_dict(o, key, identifier_map)
+
+
+def get_parameter_name(parameter):
+    """Gets the name of a parameter declaration
+
+    Args:
+        parameter (dict): parameter declaration, keyed by its parameter type
+
+    Returns:
+        str: parameter name
+    """
+    parameter_type = next(iter(parameter))
+    return parameter[parameter_type]['Name']
+
+
+def get_calculated_field_identifier(calculated_field):
+    """Gets the key two calculated fields conflict on
+
+    Args:
+        calculated_field (dict): calculated field
+
+    Returns:
+        str: calculated field identifier
+    """
+    return f"{calculated_field['Name']}->{calculated_field['DataSetIdentifier']}"
+
+
+def fingerprint(element):
+    """Computes a stable fingerprint of a definition element
+
+    Args:
+        element (dict): sheet, filter group, calculated field...
+
+    Returns:
+        str: hex digest of the canonical json of the element
+    """
+    canonical = json.dumps(element, sort_keys=True,
+                           separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def build_dataset_identifier_map(target_datasets, source_datasets):
+    """Decides how the source dataset identifiers have to be renamed in the target
+
+    A source dataset whose arn already exists in the target takes the target
+    identifier; a source dataset whose identifier is already used by another
+    arn in the target gets a new, unused identifier.
+
+    Args:
+        target_datasets (list): dataset declarations of the target analysis
+        source_datasets (list): dataset declarations of the source analysis
+
+    Returns:
+        dict: source dataset identifier -> target dataset identifier,
+            only for the identifiers that change
+    """
+    target_identifiers = {dataset['Identifier'] for dataset in target_datasets}
+    identifier_map = {}
+    for dataset in source_datasets:
+        source_identifier = dataset['Identifier']
+        target_identifier = get_dataset_identifier(
+            dataset['DataSetArn'], target_datasets)
+        if target_identifier is not None:
+            if target_identifier != source_identifier:
+                identifier_map[source_identifier] = target_identifier
+        elif source_identifier in target_identifiers:
+            updated_identifier = update_dataset_identifier(source_identifier)
+            while updated_identifier in target_identifiers:
+                updated_identifier = update_dataset_identifier(
+                    updated_identifier)
+            target_identifiers.add(updated_identifier)
+            identifier_map[source_identifier] = updated_identifier
+    return identifier_map
+
+
+def merge_parameters(target_parameters, source_parameters):
+    """Appends the source parameters that are not already in the target
+
+    Args:
+        target_parameters (list): parameter declarations of the target, updated in place
+        source_parameters (list): parameter declarations of the source
+
+    Raises:
+        DuplicateParameterNameException: a parameter with the same name but a
+            different declaration exists in the target
+    """
+    target_parameter_names = {get_parameter_name(
+        parameter) for parameter in target_parameters}
+    for parameter in source_parameters:
+        parameter_name = get_parameter_name(parameter)
+        if parameter in target_parameters:
+            continue
+        elif parameter_name in target_parameter_names:
+            raise DuplicateParameterNameException(
+                f"Parameter: {parameter_name} exists in both the analyses, change the name of the parameter in one of the analyses and retry")
+        else:
+            target_parameters.append(parameter)
+            target_parameter_names.add(parameter_name)
+
+
+def merge_datasets(target_datasets, source_datasets):
+    """Appends the source datasets to the target, renaming identifiers where needed
+
+    Args:
+        target_datasets (list): dataset declarations of the target, updated in place
+        source_datasets (list): dataset declarations of the source
+
+    Returns:
+        dict: identifier map to apply to every other section of the source,
+            see build_dataset_identifier_map
+    """
+    identifier_map = build_dataset_identifier_map(
+        target_datasets, source_datasets)
+    for dataset in source_datasets:
+        remap_nested_dict(dataset, 'Identifier', identifier_map)
+        if dataset not in target_datasets:
+            target_datasets.append(dataset)
+    return identifier_map
+
+
+def remap_element(element, identifier_map):
+    """Points a sheet, filter group or calculated field at the target dataset identifiers
+
+    Args:
+        element (dict): definition element, updated in place
+        identifier_map (dict): see build_dataset_identifier_map
+
+    Returns:
+        dict: the same element
+    """
+    if identifier_map:
+        remap_nested_dict(element, 'DataSetIdentifier', identifier_map)
+    return element
+
+
+def merge_elements(target_elements, source_elements, identifier_map):
+    """Appends the remapped source elements that are not already in the target
+
+    Args:
+        target_elements (list): sheets or filter groups of the target, updated in place
+        source_elements (list): sheets or filter groups of the source
+        identifier_map (dict): see build_dataset_identifier_map
+    """
+    for element in source_elements:
+        remap_element(element, identifier_map)
+        if element not in target_elements:
+            target_elements.append(element)
+
+
+def merge_calculated_fields(target_calculated_fields, source_calculated_fields, identifier_map):
+    """Appends the remapped source calculated fields that are not already in the target
+
+    Args:
+        target_calculated_fields (list): calculated fields of the target, updated in place
+        source_calculated_fields (list): calculated fields of the source
+        identifier_map (dict): see build_dataset_identifier_map
+
+    Raises:
+        DuplicateCalculatedFieldException: a calculated field with the same name
+            and dataset but a different expression exists in the target
+    """
+    target_calculated_field_identifiers = {get_calculated_field_identifier(
+        calculated_field) for calculated_field in target_calculated_fields}
+    for calculated_field in source_calculated_fields:
+        remap_element(calculated_field, identifier_map)
+        calculated_field_identifier = get_calculated_field_identifier(
+            calculated_field)
+        if calculated_field in target_calculated_fields:
+            continue
+        elif calculated_field_identifier in target_calculated_field_identifiers:
+            raise DuplicateCalculatedFieldException(
+                f"Calculated field: {calculated_field['Name']} exists in both the analyses, change the name of the calculated field in one of the analyses and retry")
+        else:
+            target_calculated_fields.append(calculated_field)
+            target_calculated_field_identifiers.add(
+                calculated_field_identifier)
+
+
+def merge_definitions(target_definition, source_definition):
+    """Merges the source definition into the target definition
+
+    Runs every merge stage in order: parameters, datasets, sheets,
+    filter groups and calculated fields.
+
+    Args:
+        target_definition (dict): 'Definition' of the target analysis, updated in place
+        source_definition (dict): 'Definition' of the source analysis
+
+    Returns:
+        dict: identifier map used for the source, see build_dataset_identifier_map
+
+    Raises:
+        DuplicateParameterNameException, DuplicateCalculatedFieldException
+    """
+    merge_parameters(target_definition.setdefault('ParameterDeclarations', []),
+                     source_definition.get('ParameterDeclarations', []))
+    identifier_map = merge_datasets(target_definition.setdefault('DataSetIdentifierDeclarations', []),
+                                    source_definition.get('DataSetIdentifierDeclarations', []))
+    merge_elements(target_definition.setdefault('Sheets', []),
+                   source_definition.get('Sheets', []), identifier_map)
+    merge_elements(target_definition.setdefault('FilterGroups', []),
+                   source_definition.get('FilterGroups', []), identifier_map)
+    merge_calculated_fields(target_definition.setdefault('CalculatedFields', []),
+                            source_definition.get('CalculatedFields', []), identifier_map)
+    return identifier_map
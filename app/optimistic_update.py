@@ -0,0 +1,132 @@
+import random
+import threading
+import time
+
+IN_PROGRESS_STATUSES = {'CREATION_IN_PROGRESS', 'UPDATE_IN_PROGRESS'}
+
+# closes the check-then-write window between threads of the same process;
+# targets are spread over a fixed set of locks so memory stays bounded however
+# many targets a warm Lambda sees, and different targets rarely share a lock
+TARGET_LOCK_STRIPES = 64
+_target_locks = [threading.Lock() for _ in range(TARGET_LOCK_STRIPES)]
+
+
+class ConcurrentUpdateException(Exception):
+    """Exception raised when the target kept changing under the merge for every retry"""
+    pass
+
+
+def read_target_version(account_id, target_analysis_id, qs_client, max_wait=60, sleep=time.sleep):
+    """Reads the version of the target analysis, waiting for a running update to finish
+
+    Args:
+        account_id (int): AWS account ID
+        target_analysis_id (str): Analysis ID of the target analysis
+        qs_client: QuickSight client
+        max_wait (float): seconds to wait for an update in progress
+        sleep (callable): used to wait between two describe calls
+
+    Returns:
+        LastUpdatedTime of the target analysis
+    """
+    delay = 0.5
+    waited = 0
+    while True:
+        analysis = qs_client.describe_analysis(
+            AwsAccountId=account_id, AnalysisId=target_analysis_id)['Analysis']
+        if analysis.get('Status') not in IN_PROGRESS_STATUSES or waited >= max_wait:
+            return analysis['LastUpdatedTime']
+        sleep(delay)
+        waited += delay
+        delay = min(delay * 2, 8)
+
+
+def read_target(account_id, target_analysis_id, qs_client, max_reads=5, sleep=time.sleep):
+    """Reads the definition of the target together with the version it belongs to
+
+    The version is read before and after the definition; if it moved in
+    between, the definition may mix two writes and is read again.
+
+    Args:
+        account_id (int): AWS account ID
+        target_analysis_id (str): Analysis ID of the target analysis
+        qs_client: QuickSight client
+        max_reads (int): number of times the definition is read before giving up
+        sleep (callable): used to wait for an update in progress
+
+    Returns:
+        tuple: (describe_analysis_definition response, LastUpdatedTime)
+
+    Raises:
+        ConcurrentUpdateException: the target changed during every read
+    """
+    version = read_target_version(
+        account_id, target_analysis_id, qs_client, sleep=sleep)
+    for _ in range(max_reads):
+        target_analysis_definition = qs_client.describe_analysis_definition(
+            AwsAccountId=account_id,
+            AnalysisId=target_analysis_id)
+        current_version = read_target_version(
+            account_id, target_analysis_id, qs_client, sleep=sleep)
+        if current_version == version:
+            return target_analysis_definition, version
+        version = current_version
+    raise ConcurrentUpdateException(
+        f"Analysis {target_analysis_id} changed during each of {max_reads} reads, retry later")
+
+
+def update_with_optimistic_concurrency(account_id, target_analysis_id, target_analysis_name, apply_delta,
+                                       qs_client, max_retries=3, sleep=time.sleep):
+    """Applies a change to the target analysis without losing concurrent writes
+
+    The target is read with its LastUpdatedTime, the delta is applied, and
+    the LastUpdatedTime is checked again right before update_analysis. If
+    another merge wrote the target in the meantime, the target is read again
+    and only this delta is re-applied, up to max_retries times, after a
+    randomized backoff so conflicting merges do not retry in lockstep.
+
+    QuickSight has no conditional update, so a write landing between the
+    last check and update_analysis is still possible; the window is one
+    describe_analysis round trip instead of the whole merge.
+
+    Args:
+        account_id (int): AWS account ID
+        target_analysis_id (str): Analysis ID of the target analysis
+        target_analysis_name (str): Name of the target analysis, None to keep the current name
+        apply_delta (callable): merges the incoming change into the 'Definition' it is given,
+            must not depend on a previous call
+        qs_client: QuickSight client
+        max_retries (int): number of times the delta is re-applied after a conflict
+        sleep (callable): used to back off between two attempts
+
+    Returns:
+        dict: update_analysis response
+
+    Raises:
+        ConcurrentUpdateException: the target changed before every attempt to write it
+    """
+    for attempt in range(max_retries + 1):
+        target_analysis_definition, version = read_target(
+            account_id, target_analysis_id, qs_client, sleep=sleep)
+        apply_delta(target_analysis_definition['Definition'])
+
+        update_kwargs = dict(
+            AwsAccountId=account_id,
+            AnalysisId=target_analysis_id,
+            Name=target_analysis_name or target_analysis_definition['Name'],
+            Definition=target_analysis_definition['Definition']
+        )
+        if target_analysis_definition.get('ThemeArn'):
+            update_kwargs['ThemeArn'] = target_analysis_definition['ThemeArn']
+
+        target_lock = _target_locks[hash((account_id, target_analysis_id)) % TARGET_LOCK_STRIPES]
+        with target_lock:
+            if read_target_version(account_id, target_analysis_id, qs_client, sleep=sleep) == version:
+                return qs_client.update_analysis(**update_kwargs)
+
+        if attempt < max_retries:
+            print(f"Analysis {target_analysis_id} changed during the merge, retrying ({attempt + 1}/{max_retries})")
+            sleep(random.uniform(0, min(0.5 * 2 ** attempt, 8)))
+
+    raise ConcurrentUpdateException(
+        f"Analysis {target_analysis_id} was updated by another merge {max_retries + 1} times in a row, retry later")
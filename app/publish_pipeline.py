@@ -0,0 +1,220 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asset_bundle_migration import analysis_arn
+from aws_errors import error_code
+from job_polling import wait_for_jobs
+
+SUCCESSFUL_STATUSES = {'CREATION_SUCCESSFUL', 'UPDATE_SUCCESSFUL'}
+FAILED_STATUSES = {'CREATION_FAILED', 'UPDATE_FAILED', 'DELETED'}
+TERMINAL_STATUSES = SUCCESSFUL_STATUSES | FAILED_STATUSES
+
+DASHBOARD_ACTIONS = ['quicksight:DescribeDashboard',
+                     'quicksight:ListDashboardVersions',
+                     'quicksight:UpdateDashboardPermissions',
+                     'quicksight:QueryDashboard',
+                     'quicksight:UpdateDashboard',
+                     'quicksight:DeleteDashboard',
+                     'quicksight:DescribeDashboardPermissions',
+                     'quicksight:UpdateDashboardPublishedVersion']
+
+
+class PublishException(Exception):
+    """Exception raised when a stage of the publish pipeline does not succeed"""
+    pass
+
+
+def version_number(version_arn):
+    """Gets the version number at the end of a template or dashboard VersionArn"""
+    return int(version_arn.rsplit('/', 1)[-1])
+
+
+def dataset_references(definition):
+    """Maps the dataset declarations of an analysis to template dataset references
+
+    Args:
+        definition (dict): analysis 'Definition'
+
+    Returns:
+        list: DataSetReferences, one placeholder per dataset identifier
+    """
+    return [{'DataSetPlaceholder': dataset['Identifier'], 'DataSetArn': dataset['DataSetArn']}
+            for dataset in definition['DataSetIdentifierDeclarations']]
+
+
+def publish_analysis(account_id, region, target_analysis_id, template_id, dashboards, qs_client,
+                     user_name=None, namespace='default', max_workers=10, poll_options=None):
+    """Publishes a merged analysis to a template and then to many dashboards
+
+    Waits for the create_analysis or update_analysis of the merge to finish,
+    creates or updates the template from the analysis, and then creates or
+    updates every dashboard from that template version concurrently,
+    publishing the new version of the dashboards that already existed.
+
+    Args:
+        account_id (int): AWS account ID
+        region (str): QuickSight Region
+        target_analysis_id (str): Analysis ID of the merged analysis
+        template_id (str): Template ID created or updated from the analysis
+        dashboards (list): {'DashboardId', 'Name'} of every dashboard to publish
+        qs_client: QuickSight client
+        user_name (str): QuickSight user given access to new dashboards, None for none
+        namespace (str): QuickSight namespace of the user
+        max_workers (int): number of dashboards published at once
+        poll_options (dict): keyword arguments for wait_for_jobs
+
+    Returns:
+        dict: template version, per dashboard status and timings, per stage timings
+
+    Raises:
+        PublishException: the analysis or the template did not reach a successful status
+    """
+    poll_options = poll_options or {}
+    started = time.monotonic()
+    report = {'Timings': {}, 'Dashboards': {}}
+
+    # analysis section
+    # wait for the merge to be applied before taking a template out of it
+    def describe_analysis_status(analysis_id):
+        analysis = qs_client.describe_analysis(
+            AwsAccountId=account_id, AnalysisId=analysis_id)['Analysis']
+        return analysis['Status'], analysis
+
+    analysis_result = wait_for_jobs(
+        [target_analysis_id], describe_analysis_status, TERMINAL_STATUSES, **poll_options)[target_analysis_id]
+    report['Timings']['Analysis'] = analysis_result['Seconds']
+    if analysis_result['Status'] not in SUCCESSFUL_STATUSES:
+        raise PublishException(
+            f"Analysis {target_analysis_id} ended in status {analysis_result['Status']}")
+
+    # template section
+    stage_started = time.monotonic()
+    definition = qs_client.describe_analysis_definition(
+        AwsAccountId=account_id, AnalysisId=target_analysis_id)
+    references = dataset_references(definition['Definition'])
+    template_kwargs = dict(
+        AwsAccountId=account_id,
+        TemplateId=template_id,
+        Name=definition.get('Name', template_id),
+        SourceEntity={'SourceAnalysis': {
+            'Arn': analysis_arn(region, account_id, target_analysis_id),
+            'DataSetReferences': references
+        }}
+    )
+    try:
+        template_response = qs_client.create_template(**template_kwargs)
+    except Exception as e:
+        if error_code(e) != 'ResourceExistsException':
+            raise
+        template_response = qs_client.update_template(**template_kwargs)
+
+    template_version_arn = template_response['VersionArn']
+
+    def describe_template_status(template_id):
+        template = qs_client.describe_template(
+            AwsAccountId=account_id, TemplateId=template_id,
+            VersionNumber=version_number(template_version_arn))['Template']
+        return template['Version']['Status'], template
+
+    template_result = wait_for_jobs(
+        [template_id], describe_template_status, TERMINAL_STATUSES, **poll_options)[template_id]
+    report['Timings']['Template'] = round(
+        time.monotonic() - stage_started, 3)
+    if template_result['Status'] not in SUCCESSFUL_STATUSES:
+        raise PublishException(
+            f"Template {template_id} ended in status {template_result['Status']}")
+    report['TemplateVersion'] = version_number(template_version_arn)
+
+    # dashboards section
+    # create or update every dashboard from the template version at once
+    stage_started = time.monotonic()
+    started_by_dashboard = {}
+
+    def start_dashboard(dashboard):
+        dashboard_id = dashboard['DashboardId']
+        started_by_dashboard[dashboard_id] = time.monotonic()
+        dashboard_kwargs = dict(
+            AwsAccountId=account_id,
+            DashboardId=dashboard_id,
+            Name=dashboard.get('Name', dashboard_id),
+            SourceEntity={'SourceTemplate': {
+                'Arn': template_version_arn,
+                'DataSetReferences': references
+            }}
+        )
+        if definition.get('ThemeArn'):
+            dashboard_kwargs['ThemeArn'] = definition['ThemeArn']
+        try:
+            create_kwargs = dict(dashboard_kwargs)
+            if user_name:
+                create_kwargs['Permissions'] = [{
+                    'Principal': f"arn:aws:quicksight:{region}:{account_id}:user/{namespace}/{user_name}",
+                    'Actions': DASHBOARD_ACTIONS
+                }]
+            try:
+                response = qs_client.create_dashboard(**create_kwargs)
+                operation = 'CREATED'
+            except Exception as e:
+                if error_code(e) != 'ResourceExistsException':
+                    raise
+                response = qs_client.update_dashboard(**dashboard_kwargs)
+                operation = 'UPDATED'
+            return dashboard_id, (operation, version_number(response['VersionArn'])), None
+        except Exception as e:
+            return dashboard_id, None, e
+
+    # without a VersionNumber, describe_dashboard returns the published version, not the new one
+    def describe_dashboard_status(dashboard_id):
+        dashboard = qs_client.describe_dashboard(
+            AwsAccountId=account_id, DashboardId=dashboard_id,
+            VersionNumber=operations[dashboard_id][1])['Dashboard']
+        return dashboard['Version']['Status'], dashboard
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        started_dashboards = list(executor.map(start_dashboard, dashboards))
+
+    operations = {}
+    for dashboard_id, operation, error in started_dashboards:
+        if error is None:
+            operations[dashboard_id] = operation
+        else:
+            report['Dashboards'][dashboard_id] = {
+                'Status': 'FAILED', 'Error': str(error),
+                'Seconds': round(time.monotonic() - started_by_dashboard[dashboard_id], 3)}
+
+    dashboard_results = wait_for_jobs(
+        list(operations), describe_dashboard_status, TERMINAL_STATUSES,
+        max_workers=max_workers, **poll_options)
+
+    def publish_dashboard(dashboard_id):
+        result = dashboard_results[dashboard_id]
+        operation, dashboard_version = operations[dashboard_id]
+        dashboard_report = {'Operation': operation, 'Version': dashboard_version}
+        try:
+            if result['Status'] not in SUCCESSFUL_STATUSES:
+                raise PublishException(
+                    f"Dashboard {dashboard_id} ended in status {result['Status']}")
+            # an updated dashboard keeps showing its previous version until the new one is published
+            if operation == 'UPDATED':
+                qs_client.update_dashboard_published_version(
+                    AwsAccountId=account_id, DashboardId=dashboard_id,
+                    VersionNumber=dashboard_version)
+            dashboard_report['Status'] = 'PUBLISHED'
+        except Exception as e:
+            dashboard_report['Status'] = 'FAILED'
+            dashboard_report['Error'] = str(e)
+        dashboard_report['Seconds'] = round(
+            time.monotonic() - started_by_dashboard[dashboard_id], 3)
+        return dashboard_id, dashboard_report
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        report['Dashboards'].update(executor.map(
+            publish_dashboard, list(operations)))
+
+    report['Timings']['Dashboards'] = round(
+        time.monotonic() - stage_started, 3)
+    report['Timings']['Total'] = round(time.monotonic() - started, 3)
+    report['Published'] = sum(1 for dashboard in report['Dashboards'].values()
+                              if dashboard['Status'] == 'PUBLISHED')
+    report['Failed'] = len(report['Dashboards']) - report['Published']
+    return report
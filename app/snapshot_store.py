@@ -0,0 +1,283 @@
+import gzip
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from merge_stages import fingerprint
+
+# sections stored element by element, so an unchanged sheet is stored once for all snapshots
+ELEMENT_SECTIONS = {'DataSetIdentifierDeclarations', 'Sheets', 'CalculatedFields',
+                    'ParameterDeclarations', 'FilterGroups', 'ColumnConfigurations'}
+
+
+class SnapshotNotFoundException(Exception):
+    """Exception raised when a merge snapshot does not exist"""
+    pass
+
+
+class SnapshotBackend:
+    """Where the snapshot store keeps its objects"""
+
+    def put(self, key, data):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def list_keys(self, prefix):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class LocalSnapshotBackend(SnapshotBackend):
+    """Keeps snapshot objects as files under a directory, /tmp in Lambda"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, *key.split('/'))
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as outfile:
+            outfile.write(data)
+        os.replace(temp_path, path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as infile:
+                return infile.read()
+        except FileNotFoundError:
+            raise SnapshotNotFoundException(f"Snapshot object {key} not found")
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def list_keys(self, prefix):
+        directory = self._path(prefix)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(f"{prefix.rstrip('/')}/{name}" for name in os.listdir(directory)
+                      if not name.endswith('.tmp'))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3SnapshotBackend(SnapshotBackend):
+    """Keeps snapshot objects in an S3 bucket"""
+
+    def __init__(self, bucket, prefix, s3_client):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.s3_client = s3_client
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key, data):
+        self.s3_client.put_object(
+            Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def get(self, key):
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket, Key=self._key(key))
+        except self.s3_client.exceptions.NoSuchKey:
+            raise SnapshotNotFoundException(f"Snapshot object {key} not found")
+        return response['Body'].read()
+
+    def exists(self, key):
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except self.s3_client.exceptions.ClientError:
+            return False
+
+    def list_keys(self, prefix):
+        keys = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix.rstrip('/') + '/')):
+            for item in page.get('Contents', []):
+                keys.append(item['Key'][len(self._key('')):])
+        return sorted(keys)
+
+    def delete(self, key):
+        self.s3_client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+class SnapshotStore:
+    """Content-addressed, compressed history of the definitions read and written by merges
+
+    Every definition element (dataset declaration, sheet, calculated field,
+    parameter, filter group) and every other definition section is stored
+    once under the hash of its content in 'objects/'. A merge is recorded in
+    'merges/<target analysis ID>/<merge ID>.json' as the list of hashes of
+    its input and output definitions, so thousands of snapshots of analyses
+    that mostly do not change take little more space than one.
+    """
+
+    def __init__(self, backend, max_workers=8):
+        self.backend = backend
+        self.max_workers = max_workers
+
+    def _put_blob(self, value):
+        blob_hash = fingerprint(value)
+        key = f"objects/{blob_hash[:2]}/{blob_hash}"
+        if not self.backend.exists(key):
+            canonical = json.dumps(value, sort_keys=True,
+                                   separators=(',', ':'), default=str)
+            self.backend.put(key, gzip.compress(canonical.encode('utf-8')))
+        return blob_hash
+
+    def _get_blob(self, blob_hash):
+        return json.loads(gzip.decompress(self.backend.get(f"objects/{blob_hash[:2]}/{blob_hash}")))
+
+    def save_definition(self, definition):
+        """Stores the sections of a definition that are not stored yet
+
+        Args:
+            definition (dict): analysis 'Definition'
+
+        Returns:
+            dict: manifest of the definition, section -> hash or list of hashes
+        """
+        values = []
+        for section, value in definition.items():
+            if section in ELEMENT_SECTIONS and isinstance(value, list):
+                values.extend(value)
+            else:
+                values.append(value)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            hashes = iter(list(executor.map(self._put_blob, values)))
+
+        manifest = {}
+        for section, value in definition.items():
+            if section in ELEMENT_SECTIONS and isinstance(value, list):
+                manifest[section] = [next(hashes) for _ in value]
+            else:
+                manifest[section] = next(hashes)
+        return manifest
+
+    def load_definition(self, manifest):
+        """Rebuilds a definition from its manifest
+
+        Args:
+            manifest (dict): see save_definition
+
+        Returns:
+            dict: analysis 'Definition'
+        """
+        definition = {}
+        for section, hashes in manifest.items():
+            if isinstance(hashes, list):
+                definition[section] = [self._get_blob(
+                    blob_hash) for blob_hash in hashes]
+            else:
+                definition[section] = self._get_blob(hashes)
+        return definition
+
+    def save_merge(self, target_analysis_id, target_analysis_name, inputs, output, theme_arn=None,
+                   provenance=None):
+        """Records the definitions a merge read and the definition it wrote
+
+        Args:
+            target_analysis_id (str): Analysis ID of the target analysis
+            target_analysis_name (str): Name of the target analysis, None if it was kept
+            inputs (dict): Analysis ID -> 'Definition' of each analysis the merge read
+            output (dict): merged 'Definition'
+            theme_arn (str): theme of the target analysis, if any
+            provenance (list): provenance maps of the target after the merge, restored with it on rollback
+
+        Returns:
+            str: merge ID, sorts by time
+        """
+        now = datetime.now(timezone.utc)
+        output_manifest = self.save_definition(output)
+        merge_id = f"{now:%Y%m%dT%H%M%S%fZ}-{fingerprint(output_manifest)[:12]}"
+        record = {
+            'MergeId': merge_id,
+            'TargetAnalysisId': target_analysis_id,
+            'TargetAnalysisName': target_analysis_name,
+            'ThemeArn': theme_arn,
+            'CreatedTime': now.isoformat(),
+            'Inputs': {analysis_id: self.save_definition(definition)
+                       for analysis_id, definition in inputs.items()},
+            'Output': output_manifest,
+            'Provenance': provenance or []
+        }
+        self.backend.put(f"merges/{target_analysis_id}/{merge_id}.json",
+                         json.dumps(record, indent=4).encode('utf-8'))
+        return merge_id
+
+    def list_merges(self, target_analysis_id):
+        """Lists the merge IDs recorded for a target, oldest first"""
+        return [key.rsplit('/', 1)[-1][:-len('.json')]
+                for key in self.backend.list_keys(f"merges/{target_analysis_id}")
+                if key.endswith('.json')]
+
+    def load_merge(self, target_analysis_id, merge_id):
+        """Loads the record of a merge, see save_merge"""
+        return json.loads(self.backend.get(f"merges/{target_analysis_id}/{merge_id}.json"))
+
+
+def rollback_analysis(account_id, target_analysis_id, snapshot_store, qs_client, merge_id=None,
+                      provenance_store=None):
+    """Restores the definition written by an earlier merge with a single update_analysis call
+
+    Args:
+        account_id (int): AWS account ID
+        target_analysis_id (str): Analysis ID of the target analysis
+        snapshot_store (SnapshotStore): where the merges were recorded
+        qs_client: QuickSight client
+        merge_id (str): merge to restore, None for the one before the latest
+        provenance_store (ProvenanceStore): its maps of the target are replaced by the ones
+            recorded with the restored merge; a merge recorded without them leaves none, so
+            the next merge into the restored definition is a full merge
+
+    Returns:
+        str: the merge ID restored
+
+    Raises:
+        SnapshotNotFoundException: there is no such merge for the target
+    """
+    if merge_id is None:
+        merge_ids = snapshot_store.list_merges(target_analysis_id)
+        if len(merge_ids) < 2:
+            raise SnapshotNotFoundException(
+                f"Analysis {target_analysis_id} has no earlier merge to roll back to")
+        merge_id = merge_ids[-2]
+    record = snapshot_store.load_merge(target_analysis_id, merge_id)
+    analysis = qs_client.describe_analysis(
+        AwsAccountId=account_id, AnalysisId=target_analysis_id)['Analysis']
+
+    update_kwargs = dict(
+        AwsAccountId=account_id,
+        AnalysisId=target_analysis_id,
+        Name=record['TargetAnalysisName'] or analysis['Name'],
+        Definition=snapshot_store.load_definition(record['Output'])
+    )
+    theme_arn = record.get('ThemeArn') or analysis.get('ThemeArn')
+    if theme_arn:
+        update_kwargs['ThemeArn'] = theme_arn
+    qs_client.update_analysis(**update_kwargs)
+    if provenance_store:
+        try:
+            provenance_store.clear(target_analysis_id)
+            for provenance in record.get('Provenance', []):
+                provenance_store.save(target_analysis_id, provenance)
+        except Exception as e:
+            print(f"Could not restore the merge provenance of analysis {target_analysis_id}: {e}")
+    return merge_id
@@ -0,0 +1,266 @@
+import argparse
+import json
+from collections import namedtuple
+
+from merge_stages import (empty_definition, fingerprint, merge_calculated_fields,
+                          merge_datasets, merge_elements, merge_parameters,
+                          remap_element)
+
+CHUNK_SIZE = 1024 * 1024
+
+# sections that are merged before any sheet is written
+HEADER_SECTIONS = ['DataSetIdentifierDeclarations', 'ParameterDeclarations',
+                   'FilterGroups', 'CalculatedFields']
+
+# one value read from a definition file; list sections yield one event per element
+SectionEvent = namedtuple('SectionEvent', ['scope', 'section', 'value', 'is_item'])
+
+
+class DefinitionStreamReader:
+    """Reads a json analysis definition one value at a time
+
+    Only the enclosing objects and arrays are walked by hand, every value
+    below them is decoded with json.JSONDecoder.raw_decode, so the memory
+    used is bounded by the largest single element instead of the file size.
+    """
+
+    def __init__(self, infile, chunk_size=CHUNK_SIZE):
+        self.infile = infile
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=None):
+        """Drops the consumed part of the buffer and reads the next chunk"""
+        chunk = self.infile.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def _skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return
+            self._fill()
+
+    def peek(self):
+        """Returns the next significant character, or '' at the end of the file"""
+        self._skip_whitespace()
+        return self.buffer[self.pos] if self.pos < len(self.buffer) else ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(
+                f"Expected '{char}' at offset {self.pos} of the definition, found '{self.peek()}'")
+        self.pos += 1
+
+    def decode_value(self):
+        """Decodes the next complete json value from the stream"""
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # grow geometrically so a large element is not re-decoded once per chunk
+            self._fill(max(self.chunk_size, len(self.buffer) - self.pos))
+
+    def iter_object(self):
+        """Yields the keys of the object at the current position
+
+        The caller must consume the value of each key before asking for the next one.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode_value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+    def iter_array(self):
+        """Yields the decoded elements of the array at the current position"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+
+def iter_definition_sections(path, sections=None, chunk_size=CHUNK_SIZE):
+    """Streams an exported analysis definition section by section
+
+    Accepts either a describe_analysis_definition response written to disk
+    or a bare 'Definition' object.
+
+    Args:
+        path (str): path of the exported definition
+        sections (set): definition sections to decode, others are skipped; None for all
+        chunk_size (int): number of characters read from the file at a time
+
+    Yields:
+        SectionEvent: one event per list element and per other value
+    """
+    with open(path, 'r') as infile:
+        reader = DefinitionStreamReader(infile, chunk_size)
+        for key in reader.iter_object():
+            if key == 'Definition' and reader.peek() == '{':
+                for section in reader.iter_object():
+                    yield from _iter_section(reader, 'Definition', section, sections)
+            elif key in HEADER_SECTIONS or key == 'Sheets':
+                yield from _iter_section(reader, 'Definition', key, sections)
+            else:
+                value = reader.decode_value()
+                if sections is None or key in sections:
+                    yield SectionEvent(None, key, value, False)
+
+
+def _iter_section(reader, scope, section, sections):
+    wanted = sections is None or section in sections
+    if reader.peek() == '[':
+        for element in reader.iter_array():
+            if wanted:
+                yield SectionEvent(scope, section, element, True)
+    else:
+        value = reader.decode_value()
+        if wanted:
+            yield SectionEvent(scope, section, value, False)
+
+
+def read_definition_header(path, chunk_size=CHUNK_SIZE):
+    """Reads everything but the sheets of an exported analysis definition
+
+    Args:
+        path (str): path of the exported definition
+        chunk_size (int): number of characters read from the file at a time
+
+    Returns:
+        tuple: (header sections keyed by section name, theme arn or None, sheet count)
+    """
+    header = {section: [] for section in HEADER_SECTIONS}
+    theme_arn = None
+    sheet_count = 0
+    for event in iter_definition_sections(path, chunk_size=chunk_size):
+        if event.scope is None:
+            if event.section == 'ThemeArn':
+                theme_arn = event.value
+        elif event.section == 'Sheets':
+            # the sheet is decoded and dropped right away, it is streamed again later
+            sheet_count += 1
+        elif event.section in header and event.is_item:
+            header[event.section].append(event.value)
+    return header, theme_arn, sheet_count
+
+
+def merge_header(target_definition, header):
+    """Feeds the header sections of one definition to the merge stages
+
+    Args:
+        target_definition (dict): merged definition, updated in place
+        header (dict): see read_definition_header
+
+    Returns:
+        dict: identifier map to apply to the sheets of that definition
+    """
+    merge_parameters(
+        target_definition['ParameterDeclarations'], header['ParameterDeclarations'])
+    identifier_map = merge_datasets(
+        target_definition['DataSetIdentifierDeclarations'], header['DataSetIdentifierDeclarations'])
+    merge_elements(target_definition['FilterGroups'],
+                   header['FilterGroups'], identifier_map)
+    merge_calculated_fields(
+        target_definition['CalculatedFields'], header['CalculatedFields'], identifier_map)
+    return identifier_map
+
+
+def merge_definition_files(definition_paths, output_path, chunk_size=CHUNK_SIZE):
+    """Merges exported analysis definitions into one file without loading them whole
+
+    The header sections (datasets, parameters, filter groups and calculated
+    fields) of every file are read first and merged in order, the merged
+    header is written, and then the sheets of every file are streamed one
+    at a time, remapped to the merged dataset identifiers and appended to
+    the output. Only a fingerprint of each written sheet is kept to drop
+    duplicates, so memory stays flat in the number of sheets.
+
+    Args:
+        definition_paths (list): exported definitions, the first one gives the theme
+        output_path (str): where to write the merged {'Definition': ..., 'ThemeArn': ...}
+        chunk_size (int): number of characters read from each file at a time
+
+    Returns:
+        dict: number of sheets read and written
+
+    Raises:
+        DuplicateParameterNameException, DuplicateCalculatedFieldException
+    """
+    target_definition = empty_definition()
+    identifier_maps = []
+    theme_arn = None
+    sheets_read = 0
+    for path in definition_paths:
+        header, definition_theme_arn, sheet_count = read_definition_header(
+            path, chunk_size)
+        identifier_maps.append(merge_header(target_definition, header))
+        theme_arn = theme_arn or definition_theme_arn
+        sheets_read += sheet_count
+
+    sheets_written = 0
+    written_fingerprints = set()
+    with open(output_path, 'w') as outfile:
+        outfile.write('{"Definition": {')
+        for section, value in target_definition.items():
+            if section == 'Sheets':
+                continue
+            outfile.write(f'{json.dumps(section)}: {json.dumps(value, default=str)}, ')
+        outfile.write('"Sheets": [')
+        for path, identifier_map in zip(definition_paths, identifier_maps):
+            for event in iter_definition_sections(path, {'Sheets'}, chunk_size):
+                sheet = remap_element(event.value, identifier_map)
+                sheet_fingerprint = fingerprint(sheet)
+                if sheet_fingerprint in written_fingerprints:
+                    continue
+                written_fingerprints.add(sheet_fingerprint)
+                if sheets_written:
+                    outfile.write(', ')
+                outfile.write(json.dumps(sheet, default=str))
+                sheets_written += 1
+        outfile.write(']}')
+        if theme_arn:
+            outfile.write(f', "ThemeArn": {json.dumps(theme_arn)}')
+        outfile.write('}')
+
+    return {'SheetsRead': sheets_read, 'SheetsWritten': sheets_written}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Merge exported analysis definitions without loading them into memory')
+    parser.add_argument('definitions', nargs='+',
+                        help='exported analysis definitions, in merge order')
+    parser.add_argument('--output', required=True,
+                        help='path of the merged definition')
+    args = parser.parse_args()
+    print(merge_definition_files(args.definitions, args.output))
@@ -0,0 +1,248 @@
+from merge_stages import fingerprint
+
+REPORT = 'report'
+COLLAPSE = 'collapse'
+
+# parts of a visual that identify or label it but do not change what it queries or draws
+IGNORED_VISUAL_KEYS = {'VisualId', 'Title', 'Subtitle', 'VisualContentAltText'}
+
+# parts of a visual action that identify it but do not change what it does
+IGNORED_ACTION_KEYS = {'CustomActionId'}
+
+# keys listing the FieldIds of the visual an action works on
+FIELD_ID_LIST_KEYS = {'SelectedFieldIds'}
+
+# keys under which a visual is referenced by its VisualId outside of the layouts
+VISUAL_REFERENCE_KEYS = {'VisualIds', 'TargetVisuals'}
+
+
+def get_visual_id(visual):
+    """Gets the VisualId of a visual, keyed by its visual type
+
+    Args:
+        visual (dict): visual, e.g. {'BarChartVisual': {...}}
+
+    Returns:
+        str: visual ID
+    """
+    visual_type = next(iter(visual))
+    return visual[visual_type]['VisualId']
+
+
+def _canonicalize(value, field_ids):
+    """Copies a visual with its FieldIds replaced by their order of appearance"""
+    if isinstance(value, dict):
+        canonical = {}
+        for key in sorted(value):
+            if key == 'FieldId' and isinstance(value[key], str):
+                canonical[key] = field_ids.setdefault(
+                    value[key], f"field-{len(field_ids)}")
+            elif key in FIELD_ID_LIST_KEYS and isinstance(value[key], list):
+                canonical[key] = [field_ids.setdefault(field_id, f"field-{len(field_ids)}")
+                                  for field_id in value[key]]
+            else:
+                canonical[key] = _canonicalize(value[key], field_ids)
+        return canonical
+    if isinstance(value, list):
+        return [_canonicalize(item, field_ids) for item in value]
+    return value
+
+
+def _collect_visual_references(in_dict, visual_ids):
+    """Collects the visual IDs listed under VISUAL_REFERENCE_KEYS"""
+    for k, v in in_dict.items():
+        if k in VISUAL_REFERENCE_KEYS and isinstance(v, list):
+            visual_ids.update(visual_id for visual_id in v if isinstance(visual_id, str))
+        elif isinstance(v, dict):
+            _collect_visual_references(v, visual_ids)
+        elif isinstance(v, list):
+            for o in v:
+                if isinstance(o, dict):
+                    _collect_visual_references(o, visual_ids)
+    return visual_ids
+
+
+def visual_scopes(definition):
+    """Finds the filter groups and visual actions that apply to each visual
+
+    A filter group applies to a visual when it is scoped to the visual's
+    sheet with ALL_VISUALS or lists the visual in its VisualIds. A custom
+    action of another visual applies to a visual when it lists it in its
+    TargetVisuals. Filter groups scoped to all sheets apply to every visual
+    alike and are left out.
+
+    Args:
+        definition (dict): analysis 'Definition'
+
+    Returns:
+        dict: VisualId -> set of scope keys, the filter group ID and content
+            fingerprint, or the visual and custom action IDs of the action
+    """
+    scopes = {}
+    visual_ids_by_sheet = {sheet['SheetId']: [get_visual_id(visual) for visual in sheet.get('Visuals', [])]
+                           for sheet in definition.get('Sheets', [])}
+    for filter_group in definition.get('FilterGroups', []):
+        content = {key: value for key, value in filter_group.items()
+                   if key != 'ScopeConfiguration'}
+        scope_key = f"filter:{filter_group.get('FilterGroupId')}:{fingerprint(content)}"
+        selected_sheets = filter_group.get('ScopeConfiguration', {}).get('SelectedSheets', {})
+        for configuration in selected_sheets.get('SheetVisualScopingConfigurations', []):
+            if configuration.get('Scope') == 'ALL_VISUALS':
+                visual_ids = visual_ids_by_sheet.get(configuration.get('SheetId'), [])
+            else:
+                visual_ids = configuration.get('VisualIds', [])
+            for visual_id in visual_ids:
+                scopes.setdefault(visual_id, set()).add(scope_key)
+    for sheet in definition.get('Sheets', []):
+        for visual in sheet.get('Visuals', []):
+            visual_type = next(iter(visual))
+            for action in visual[visual_type].get('Actions', []):
+                scope_key = f"action:{get_visual_id(visual)}:{action.get('CustomActionId')}"
+                for visual_id in _collect_visual_references(action, set()):
+                    scopes.setdefault(visual_id, set()).add(scope_key)
+    return scopes
+
+
+def visual_signature(visual, scope=()):
+    """Computes an ID-insensitive signature of a visual
+
+    Two visuals have the same signature when they have the same type, the
+    same configuration (dataset, fields, aggregations, formatting) and the
+    same filter groups and visual actions applying to them, whatever their
+    VisualId, title and the FieldIds their authors were given. The same
+    chart with and without a filter shows different data, so it is never a
+    duplicate; nor is a copy with drill-down, filter or navigation actions
+    of its own that the other one lacks, since collapsing it would lose them.
+
+    Args:
+        visual (dict): visual, e.g. {'BarChartVisual': {...}}
+        scope (set): scope keys of the visual, see visual_scopes
+
+    Returns:
+        str: signature of the visual
+    """
+    visual_type = next(iter(visual))
+    body = {key: value for key, value in visual[visual_type].items()
+            if key not in IGNORED_VISUAL_KEYS}
+    if 'Actions' in body:
+        body['Actions'] = [{key: value for key, value in action.items() if key not in IGNORED_ACTION_KEYS}
+                           for action in body['Actions']]
+    return fingerprint({visual_type: _canonicalize(body, {}), 'Scope': sorted(scope)})
+
+
+def find_duplicate_visuals(definition):
+    """Groups the visuals of the analysis that have the same signature
+
+    Args:
+        definition (dict): analysis 'Definition'
+
+    Returns:
+        list: one {'Signature', 'Visuals'} per group of two or more visuals,
+            'Visuals' listing {'SheetId', 'VisualId'} in definition order
+    """
+    by_signature = {}
+    scopes = visual_scopes(definition)
+    for sheet in definition.get('Sheets', []):
+        for visual in sheet.get('Visuals', []):
+            scope = scopes.get(get_visual_id(visual), set())
+            by_signature.setdefault(visual_signature(visual, scope), []).append(
+                {'SheetId': sheet['SheetId'], 'VisualId': get_visual_id(visual)})
+    return [{'Signature': signature, 'Visuals': visuals}
+            for signature, visuals in by_signature.items() if len(visuals) > 1]
+
+
+def _remove_layout_elements(in_dict, removed_visual_ids):
+    for k, v in in_dict.items():
+        if k == 'Elements' and isinstance(v, list):
+            v[:] = [element for element in v
+                    if not (isinstance(element, dict)
+                            and element.get('ElementType') == 'VISUAL'
+                            and element.get('ElementId') in removed_visual_ids)]
+        if isinstance(v, dict):
+            _remove_layout_elements(v, removed_visual_ids)
+        elif isinstance(v, list):
+            for o in v:
+                if isinstance(o, dict):
+                    _remove_layout_elements(o, removed_visual_ids)
+
+
+def _remove_visual_references(in_dict, removed_visual_ids):
+    for k, v in in_dict.items():
+        if k in VISUAL_REFERENCE_KEYS and isinstance(v, list):
+            v[:] = [visual_id for visual_id in v if visual_id not in removed_visual_ids]
+        elif isinstance(v, dict):
+            _remove_visual_references(v, removed_visual_ids)
+        elif isinstance(v, list):
+            for o in v:
+                if isinstance(o, dict):
+                    _remove_visual_references(o, removed_visual_ids)
+
+
+def collapse_duplicate_visuals(definition, groups):
+    """Keeps the first visual of each group on every sheet and removes the others
+
+    A visual is only removed when an identical one is kept on the same
+    sheet, so collapsing never takes a chart away from a sheet. The layout
+    elements of the removed visuals are dropped, and so are their entries in
+    filter scopes and visual actions. Those scopes and actions already apply
+    to the kept visual, since they are part of the signature, and a removed
+    visual whose scopes differ from the kept one is left in place: no
+    filter or action is ever moved onto a visual it did not apply to.
+
+    Args:
+        definition (dict): analysis 'Definition', updated in place
+        groups (list): see find_duplicate_visuals
+
+    Returns:
+        int: number of visuals removed
+    """
+    scopes = visual_scopes(definition)
+    replacements = {}
+    removed_by_sheet = {}
+    for group in groups:
+        kept_by_sheet = {}
+        for visual in group['Visuals']:
+            kept_visual_id = kept_by_sheet.setdefault(
+                visual['SheetId'], visual['VisualId'])
+            if kept_visual_id != visual['VisualId'] \
+                    and scopes.get(kept_visual_id, set()) == scopes.get(visual['VisualId'], set()):
+                replacements[visual['VisualId']] = kept_visual_id
+                removed_by_sheet.setdefault(
+                    visual['SheetId'], set()).add(visual['VisualId'])
+
+    for sheet in definition.get('Sheets', []):
+        removed_visual_ids = removed_by_sheet.get(sheet['SheetId'])
+        if not removed_visual_ids:
+            continue
+        sheet['Visuals'] = [visual for visual in sheet['Visuals']
+                            if get_visual_id(visual) not in removed_visual_ids]
+        for layout in sheet.get('Layouts', []):
+            _remove_layout_elements(layout, removed_visual_ids)
+    if replacements:
+        _remove_visual_references(definition, set(replacements))
+    return len(replacements)
+
+
+def dedup_visuals(definition, policy):
+    """Optional merge stage that finds, and optionally collapses, near-duplicate visuals
+
+    Duplicates are reported across the whole analysis; collapsing only
+    removes the copies that share a sheet with the visual that is kept.
+
+    Args:
+        definition (dict): merged analysis 'Definition', updated in place for 'collapse'
+        policy (str): 'report' to only report the duplicates, 'collapse' to remove them,
+            anything else to skip the stage
+
+    Returns:
+        list: see find_duplicate_visuals
+    """
+    if policy not in (REPORT, COLLAPSE):
+        return []
+    groups = find_duplicate_visuals(definition)
+    for group in groups:
+        print(f"Near-duplicate visuals: {[(visual['SheetId'], visual['VisualId']) for visual in group['Visuals']]}")
+    if policy == COLLAPSE and groups:
+        removed = collapse_duplicate_visuals(definition, groups)
+        print(f"Removed {removed} near-duplicate visuals")
+    return groups
@@ -2,6 +2,8 @@ import aws_cdk as cdk
 from aws_cdk import (
     aws_lambda as _lambda,
     aws_iam as iam,
+    aws_events as events,
+    aws_events_targets as targets,
     Stack
 )
 from constructs import Construct
@@ -24,7 +26,12 @@ class ApplicationStack(Stack):
                 iam.PolicyStatement(
                     actions=[
                         'quicksight:*',
-                        'logs:*'
+                        'logs:*',
+                        'sts:AssumeRole',
+                        's3:GetObject',
+                        's3:PutObject',
+                        's3:DeleteObject',
+                        's3:ListBucket'
                         ],
                     resources=['*']
                     )
@@ -40,7 +47,7 @@ class ApplicationStack(Stack):
             code=_lambda.Code.from_asset('./app'),
             handler='lambda_function.lambda_handler',
             role=lambda_iam_role,
-            timeout=cdk.Duration.minutes(1),
+            timeout=cdk.Duration.minutes(15),
             environment={
                 'REGION': '<Enter region here>',
                 'ACCOUNT_ID': '<Enter QuickSight account ID here>',
@@ -50,6 +57,27 @@ class ApplicationStack(Stack):
                 'SOURCE_ANALYSIS_ID': '<Enter source analysis ID here>',
                 'TARGET_ANALYSIS_NAME': '<Enter target analysis name here>',
                 'TARGET_ANALYSIS_ID': '<Enter target analysis ID here>',
-                'ACTION': '<Enter action here>'
+                'ACTION': '<Enter action here>',
+                'VISUAL_DEDUP_POLICY': 'off',
+                'DATASET_PREFLIGHT': 'on',
+                'BROADCAST_TARGET_ANALYSIS_IDS': '<Enter comma separated target analysis IDs here for Broadcast>',
+                'PUBLISH_DASHBOARD_IDS': '',
+                'DESTINATION_ACCOUNT_ID': '<Enter destination account ID here for Migrate>',
+                'DESTINATION_REGION': '',
+                'MIGRATION_ANALYSIS_IDS': '',
+                'SYNC_STATE_BUCKET': '',
+                'SNAPSHOT_BUCKET': ''
                 }
+            )
+
+        # keep registered target analyses in sync with their sources
+        # enable once the sync registry has been populated
+        events.Rule(
+            self, 'CollaborativeAuthoringSyncSchedule',
+            schedule=events.Schedule.rate(cdk.Duration.minutes(15)),
+            targets=[targets.LambdaFunction(
+                analysis_merge,
+                event=events.RuleTargetInput.from_object({'ACTION': 'Sync'})
+                )],
+            enabled=False
             )
\ No newline at end of file
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the Lambda code is flat modules under app/, imported the way the Lambda runtime does
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(TESTS_DIRECTORY, '..', 'app'), TESTS_DIRECTORY]
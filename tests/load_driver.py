@@ -0,0 +1,167 @@
+import argparse
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from analysis_merge import merge_analyses_create, merge_analyses_update
+from quicksight_stub import FakeQuickSight, make_definition
+
+CREATE = 'create'
+UPDATE = 'update'
+MIXED = 'mixed'
+
+LOAD_TEST_ACCOUNT_ID = '000000000000'
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of values, None for an empty list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, -(-len(ordered) * percent // 100) - 1)
+    return ordered[int(rank)]
+
+
+def latency_summary(latencies):
+    """Summarizes merge latencies in seconds"""
+    latencies = [round(latency, 3) for latency in latencies]
+    return {
+        'Count': len(latencies),
+        'P50': percentile(latencies, 50),
+        'P95': percentile(latencies, 95),
+        'P99': percentile(latencies, 99),
+        'Max': max(latencies) if latencies else None
+    }
+
+
+def merge_plan(merges, mode, targets):
+    """Lists the merges of a load test
+
+    Args:
+        merges (int): number of merges
+        mode (str): 'create', 'update' or 'mixed' (every other merge is a create)
+        targets (int): number of existing analyses the updates are spread over,
+            fewer targets means more concurrent updates of the same analysis
+
+    Returns:
+        list: (kind, merge number, target analysis ID) of every merge
+    """
+    plan = []
+    for number in range(merges):
+        if mode == CREATE or (mode == MIXED and number % 2 == 0):
+            plan.append((CREATE, number, f"created-{number}"))
+        else:
+            plan.append((UPDATE, number, f"target-{number % targets}"))
+    return plan
+
+
+def seed_analyses(client, plan, definition_size, account_id=LOAD_TEST_ACCOUNT_ID):
+    """Adds the analyses the merges of the plan read to the fake client"""
+    for kind, number, target_analysis_id in plan:
+        if kind == CREATE:
+            client.add_analysis(account_id, f"first-{number}", f"first-{number}",
+                                make_definition(f"first-{number}", **definition_size))
+            client.add_analysis(account_id, f"second-{number}", f"second-{number}",
+                                make_definition(f"second-{number}", **definition_size))
+        else:
+            client.add_analysis(account_id, f"source-{number}", f"source-{number}",
+                                make_definition(f"source-{number}", **definition_size))
+            if (account_id, target_analysis_id) not in client.analyses:
+                client.add_analysis(account_id, target_analysis_id, target_analysis_id,
+                                    make_definition(target_analysis_id, **definition_size))
+
+
+def run_load_test(client, plan, concurrency=10, account_id=LOAD_TEST_ACCOUNT_ID, max_retries=3,
+                  visual_dedup_policy=None):
+    """Runs the merges of a plan concurrently and measures them
+
+    A merge fails when it raises or when it returns anything else than its
+    success message, e.g. a throttled create_analysis or an update that
+    kept conflicting after max_retries.
+
+    Args:
+        client: QuickSight client the merges run against, usually a seeded FakeQuickSight
+        plan (list): see merge_plan
+        concurrency (int): number of merges run at once
+        account_id (str): AWS account ID of the analyses
+        max_retries (int): passed to merge_analyses_update
+        visual_dedup_policy (str): passed to the merges
+
+    Returns:
+        dict: throughput, latency percentiles, error rate and most common errors
+    """
+
+    def run(merge):
+        kind, number, target_analysis_id = merge
+        started = time.monotonic()
+        try:
+            if kind == CREATE:
+                response = merge_analyses_create(
+                    account_id, f"first-{number}", f"second-{number}", target_analysis_id,
+                    target_analysis_id, 'load-test', 'default', client,
+                    visual_dedup_policy=visual_dedup_policy)
+            else:
+                response = merge_analyses_update(
+                    account_id, f"source-{number}", target_analysis_id, target_analysis_id,
+                    client, max_retries, visual_dedup_policy=visual_dedup_policy)
+            error = None if str(response).endswith('successfully') else str(response)
+        except Exception as e:
+            error = str(e)
+        return kind, time.monotonic() - started, error
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(run, plan))
+    seconds = time.monotonic() - started
+
+    latencies = {}
+    errors = Counter()
+    for kind, latency, error in results:
+        latencies.setdefault(kind, []).append(latency)
+        if error is not None:
+            errors[error] += 1
+    failed = sum(errors.values())
+
+    report = {
+        'Merges': len(results),
+        'Succeeded': len(results) - failed,
+        'Failed': failed,
+        'ErrorRate': round(failed / len(results), 4) if results else 0,
+        'Seconds': round(seconds, 3),
+        'Throughput': round(len(results) / seconds, 2) if seconds else None,
+        'Latency': latency_summary([latency for _, latency, _ in results]),
+        'LatencyByKind': {kind: latency_summary(values) for kind, values in latencies.items()},
+        'Errors': dict(errors.most_common(5))
+    }
+    if isinstance(client, FakeQuickSight):
+        report['Calls'] = dict(client.operation_counts)
+        report['Throttled'] = dict(client.throttled_counts)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run concurrent merges against an in-process fake QuickSight')
+    parser.add_argument('--merges', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--mode', choices=[CREATE, UPDATE, MIXED], default=MIXED)
+    parser.add_argument('--targets', type=int, default=10,
+                        help='number of analyses the updates are spread over')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds per QuickSight call')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='probability that a QuickSight call is throttled')
+    parser.add_argument('--status-delay', type=float, default=0.0,
+                        help='seconds an analysis stays in *_IN_PROGRESS after a write')
+    parser.add_argument('--sheets', type=int, default=5)
+    parser.add_argument('--visuals-per-sheet', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    fake_client = FakeQuickSight(latency=args.latency, throttle_rate=args.throttle_rate,
+                                 status_delay=args.status_delay, seed=args.seed)
+    load_plan = merge_plan(args.merges, args.mode, args.targets)
+    seed_analyses(fake_client, load_plan,
+                  {'sheets': args.sheets, 'visuals_per_sheet': args.visuals_per_sheet})
+    print(json.dumps(run_load_test(fake_client, load_plan, args.concurrency), indent=4))
@@ -0,0 +1,378 @@
+import copy
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+from merge_stages import empty_definition
+
+FAKE_EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+
+class QuickSightStub:
+    """In-memory stand-in for the QuickSight asset bundle job APIs
+
+    Jobs move from QUEUED_FOR_IMMEDIATE_EXECUTION to IN_PROGRESS to
+    SUCCESSFUL one step per describe call, after polls_to_complete calls.
+    Jobs of the analyses listed in failing_analysis_ids end up FAILED.
+    Download urls expire url_ttl seconds after the describe call that
+    returned them, like the pre-signed urls of the real service.
+    """
+
+    def __init__(self, polls_to_complete=2, failing_analysis_ids=(), url_ttl=None):
+        self.polls_to_complete = polls_to_complete
+        self.failing_analysis_ids = set(failing_analysis_ids)
+        self.url_ttl = url_ttl
+        self.export_jobs = {}
+        self.import_jobs = {}
+        self.imported_bundles = []
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _record(self, operation, **kwargs):
+        with self.lock:
+            self.calls.append((operation, kwargs))
+
+    def _advance(self, job):
+        job['Polls'] += 1
+        if job['Polls'] >= self.polls_to_complete:
+            job['JobStatus'] = 'FAILED' if job['Fails'] else 'SUCCESSFUL'
+        else:
+            job['JobStatus'] = 'IN_PROGRESS'
+
+    def start_asset_bundle_export_job(self, AwsAccountId, AssetBundleExportJobId, ResourceArns, **kwargs):
+        self._record('start_asset_bundle_export_job', AwsAccountId=AwsAccountId,
+                     AssetBundleExportJobId=AssetBundleExportJobId, ResourceArns=ResourceArns, **kwargs)
+        analysis_ids = [arn.rsplit('/', 1)[-1] for arn in ResourceArns]
+        with self.lock:
+            self.export_jobs[AssetBundleExportJobId] = {
+                'JobStatus': 'QUEUED_FOR_IMMEDIATE_EXECUTION',
+                'Polls': 0,
+                'Fails': bool(self.failing_analysis_ids.intersection(analysis_ids)),
+                'ResourceArns': ResourceArns
+            }
+        return {'Status': 202, 'AssetBundleExportJobId': AssetBundleExportJobId}
+
+    def describe_asset_bundle_export_job(self, AwsAccountId, AssetBundleExportJobId):
+        self._record('describe_asset_bundle_export_job', AwsAccountId=AwsAccountId,
+                     AssetBundleExportJobId=AssetBundleExportJobId)
+        with self.lock:
+            job = self.export_jobs[AssetBundleExportJobId]
+            self._advance(job)
+            response = {'Status': 200, 'JobStatus': job['JobStatus'],
+                        'AssetBundleExportJobId': AssetBundleExportJobId}
+            if job['JobStatus'] == 'SUCCESSFUL':
+                expires = time.monotonic() + self.url_ttl if self.url_ttl is not None else float('inf')
+                response['DownloadUrl'] = f"stub://bundles/{AssetBundleExportJobId}?expires={expires}"
+            elif job['JobStatus'] == 'FAILED':
+                response['Errors'] = [{'Message': 'Export failed in the stub'}]
+            return response
+
+    def download(self, download_url):
+        """Returns the bundle of a successful export job, used in place of download_bundle"""
+        job_id, _, expires = download_url.rsplit('/', 1)[-1].partition('?expires=')
+        if time.monotonic() > float(expires):
+            raise PermissionError(f"Download url of export job {job_id} expired")
+        return json.dumps({'ResourceArns': self.export_jobs[job_id]['ResourceArns']}).encode('utf-8')
+
+    def start_asset_bundle_import_job(self, AwsAccountId, AssetBundleImportJobId, AssetBundleImportSource, **kwargs):
+        self._record('start_asset_bundle_import_job', AwsAccountId=AwsAccountId,
+                     AssetBundleImportJobId=AssetBundleImportJobId, **kwargs)
+        with self.lock:
+            self.import_jobs[AssetBundleImportJobId] = {
+                'JobStatus': 'QUEUED_FOR_IMMEDIATE_EXECUTION',
+                'Polls': 0,
+                'Fails': False,
+                'Body': AssetBundleImportSource.get('Body')
+            }
+        return {'Status': 202, 'AssetBundleImportJobId': AssetBundleImportJobId}
+
+    def describe_asset_bundle_import_job(self, AwsAccountId, AssetBundleImportJobId):
+        self._record('describe_asset_bundle_import_job', AwsAccountId=AwsAccountId,
+                     AssetBundleImportJobId=AssetBundleImportJobId)
+        with self.lock:
+            job = self.import_jobs[AssetBundleImportJobId]
+            self._advance(job)
+            if job['JobStatus'] == 'SUCCESSFUL' and job['Body'] not in self.imported_bundles:
+                self.imported_bundles.append(job['Body'])
+            return {'Status': 200, 'JobStatus': job['JobStatus'],
+                    'AssetBundleImportJobId': AssetBundleImportJobId}
+
+
+class FakeQuickSight(QuickSightStub):
+    """In-process stand-in for the QuickSight analysis APIs, for load tests
+
+    Implements describe_analysis, describe_analysis_definition,
+    create_analysis, update_analysis and delete_analysis, and the template
+    and dashboard calls of the publish pipeline, on top of the asset bundle
+    job APIs of QuickSightStub. Every call sleeps for the configured latency
+    and is throttled with the configured probability, raising the same
+    ClientError boto3 would. Created and updated analyses, templates and
+    dashboards stay in *_IN_PROGRESS for status_delay seconds, like the real
+    service; versions of the dashboards in failing_dashboard_ids end up
+    *_FAILED.
+    """
+
+    def __init__(self, latency=0.0, latency_by_operation=None, jitter=0.5, throttle_rate=0.0,
+                 status_delay=0.0, seed=None, failing_dashboard_ids=(), **kwargs):
+        super().__init__(**kwargs)
+        self.failing_dashboard_ids = set(failing_dashboard_ids)
+        self.templates = {}
+        self.dashboards = {}
+        self.latency = latency
+        self.latency_by_operation = latency_by_operation or {}
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.status_delay = status_delay
+        self.random = random.Random(seed)
+        self.analyses = {}
+        self.version = 0
+        self.operation_counts = Counter()
+        self.throttled_counts = Counter()
+
+    def _call(self, operation):
+        """Counts the call, waits for its latency and throttles it"""
+        with self.lock:
+            self.operation_counts[operation] += 1
+            latency = self.latency_by_operation.get(operation, self.latency)
+            latency *= 1 + self.jitter * (2 * self.random.random() - 1)
+            throttled = self.random.random() < self.throttle_rate
+            if throttled:
+                self.throttled_counts[operation] += 1
+        if latency > 0:
+            time.sleep(latency)
+        if throttled:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'},
+                               'ResponseMetadata': {'HTTPStatusCode': 429}},
+                              ''.join(word.title() for word in operation.split('_')))
+
+    def _not_found(self, operation, analysis_id, resource='Analysis'):
+        return ClientError({'Error': {'Code': 'ResourceNotFoundException',
+                                      'Message': f"{resource} {analysis_id} not found"},
+                            'ResponseMetadata': {'HTTPStatusCode': 404}}, operation)
+
+    def _exists(self, operation, resource_id, resource='Analysis'):
+        return ClientError({'Error': {'Code': 'ResourceExistsException',
+                                      'Message': f"{resource} {resource_id} already exists"},
+                            'ResponseMetadata': {'HTTPStatusCode': 409}}, operation)
+
+    def _status(self, analysis):
+        if time.monotonic() < analysis['ReadyAt']:
+            return analysis['Operation'] + '_IN_PROGRESS'
+        return analysis['Operation'] + '_SUCCESSFUL'
+
+    def _write(self, AwsAccountId, AnalysisId, Name, Definition, ThemeArn, operation):
+        """Stores an analysis, the caller holds the lock so its existence check and the write are atomic"""
+        self.version += 1
+        self.analyses[(AwsAccountId, AnalysisId)] = {
+            'Name': Name,
+            'Definition': copy.deepcopy(Definition),
+            'ThemeArn': ThemeArn,
+            'Operation': operation,
+            'ReadyAt': time.monotonic() + self.status_delay,
+            # one microsecond per write keeps concurrent writes distinguishable
+            'LastUpdatedTime': FAKE_EPOCH + timedelta(microseconds=self.version)
+        }
+
+    def add_analysis(self, account_id, analysis_id, name, definition, theme_arn=None):
+        """Seeds an analysis without going through the latency and throttling"""
+        with self.lock:
+            self._write(account_id, analysis_id, name, definition, theme_arn, 'CREATION')
+            self.analyses[(account_id, analysis_id)]['ReadyAt'] = 0
+
+    def describe_analysis(self, AwsAccountId, AnalysisId):
+        self._call('describe_analysis')
+        with self.lock:
+            analysis = self.analyses.get((AwsAccountId, AnalysisId))
+            if analysis is None:
+                raise self._not_found('DescribeAnalysis', AnalysisId)
+            response = {'AnalysisId': AnalysisId, 'Name': analysis['Name'],
+                        'Status': self._status(analysis),
+                        'LastUpdatedTime': analysis['LastUpdatedTime']}
+            if analysis['ThemeArn']:
+                response['ThemeArn'] = analysis['ThemeArn']
+            return {'Status': 200, 'Analysis': response}
+
+    def describe_analysis_definition(self, AwsAccountId, AnalysisId):
+        self._call('describe_analysis_definition')
+        with self.lock:
+            analysis = self.analyses.get((AwsAccountId, AnalysisId))
+            if analysis is None:
+                raise self._not_found('DescribeAnalysisDefinition', AnalysisId)
+            response = {'Status': 200, 'AnalysisId': AnalysisId, 'Name': analysis['Name'],
+                        'ResourceStatus': self._status(analysis),
+                        'Definition': copy.deepcopy(analysis['Definition'])}
+            if analysis['ThemeArn']:
+                response['ThemeArn'] = analysis['ThemeArn']
+            return response
+
+    def create_analysis(self, AwsAccountId, AnalysisId, Name, Definition, ThemeArn=None, **kwargs):
+        self._call('create_analysis')
+        with self.lock:
+            if (AwsAccountId, AnalysisId) in self.analyses:
+                raise self._exists('CreateAnalysis', AnalysisId)
+            self._write(AwsAccountId, AnalysisId, Name, Definition, ThemeArn, 'CREATION')
+        return {'Status': 202, 'AnalysisId': AnalysisId, 'CreationStatus': 'CREATION_IN_PROGRESS'}
+
+    def update_analysis(self, AwsAccountId, AnalysisId, Name, Definition, ThemeArn=None, **kwargs):
+        self._call('update_analysis')
+        with self.lock:
+            if (AwsAccountId, AnalysisId) not in self.analyses:
+                raise self._not_found('UpdateAnalysis', AnalysisId)
+            self._write(AwsAccountId, AnalysisId, Name, Definition, ThemeArn, 'UPDATE')
+        return {'Status': 202, 'AnalysisId': AnalysisId, 'UpdateStatus': 'UPDATE_IN_PROGRESS'}
+
+    def delete_analysis(self, AwsAccountId, AnalysisId, **kwargs):
+        self._call('delete_analysis')
+        with self.lock:
+            if self.analyses.pop((AwsAccountId, AnalysisId), None) is None:
+                raise self._not_found('DeleteAnalysis', AnalysisId)
+        return {'Status': 200, 'AnalysisId': AnalysisId}
+
+    def _add_version(self, resources, key, resource_type, operation, source_entity, fails=False):
+        """Appends a version to a template or dashboard, the caller holds the lock
+
+        Returns:
+            str: VersionArn of the new version
+        """
+        versions = resources.setdefault(key, {'Versions': [], 'PublishedVersion': 1})['Versions']
+        versions.append({'Operation': operation, 'Fails': fails,
+                         'ReadyAt': time.monotonic() + self.status_delay,
+                         'SourceEntity': copy.deepcopy(source_entity)})
+        account_id, resource_id = key
+        return f"arn:aws:quicksight:us-east-1:{account_id}:{resource_type}/{resource_id}/version/{len(versions)}"
+
+    def _version_status(self, version):
+        if time.monotonic() < version['ReadyAt']:
+            return version['Operation'] + '_IN_PROGRESS'
+        return version['Operation'] + ('_FAILED' if version['Fails'] else '_SUCCESSFUL')
+
+    def _describe_version(self, resources, key, version_number, operation, resource):
+        resource_entry = resources.get(key)
+        if resource_entry is None or not 1 <= version_number <= len(resource_entry['Versions']):
+            raise self._not_found(operation, key[1], resource)
+        return {'VersionNumber': version_number,
+                'Status': self._version_status(resource_entry['Versions'][version_number - 1]),
+                'SourceEntity': resource_entry['Versions'][version_number - 1]['SourceEntity']}
+
+    def create_template(self, AwsAccountId, TemplateId, SourceEntity, **kwargs):
+        self._call('create_template')
+        with self.lock:
+            if (AwsAccountId, TemplateId) in self.templates:
+                raise self._exists('CreateTemplate', TemplateId, 'Template')
+            version_arn = self._add_version(self.templates, (AwsAccountId, TemplateId), 'template',
+                                            'CREATION', SourceEntity)
+        return {'Status': 202, 'TemplateId': TemplateId, 'VersionArn': version_arn,
+                'CreationStatus': 'CREATION_IN_PROGRESS'}
+
+    def update_template(self, AwsAccountId, TemplateId, SourceEntity, **kwargs):
+        self._call('update_template')
+        with self.lock:
+            if (AwsAccountId, TemplateId) not in self.templates:
+                raise self._not_found('UpdateTemplate', TemplateId, 'Template')
+            version_arn = self._add_version(self.templates, (AwsAccountId, TemplateId), 'template',
+                                            'UPDATE', SourceEntity)
+        return {'Status': 202, 'TemplateId': TemplateId, 'VersionArn': version_arn,
+                'CreationStatus': 'UPDATE_IN_PROGRESS'}
+
+    def describe_template(self, AwsAccountId, TemplateId, VersionNumber):
+        self._call('describe_template')
+        with self.lock:
+            version = self._describe_version(self.templates, (AwsAccountId, TemplateId), VersionNumber,
+                                             'DescribeTemplate', 'Template')
+        return {'Status': 200, 'Template': {'TemplateId': TemplateId, 'Version': version}}
+
+    def create_dashboard(self, AwsAccountId, DashboardId, Name, SourceEntity, **kwargs):
+        self._call('create_dashboard')
+        with self.lock:
+            if (AwsAccountId, DashboardId) in self.dashboards:
+                raise self._exists('CreateDashboard', DashboardId, 'Dashboard')
+            version_arn = self._add_version(self.dashboards, (AwsAccountId, DashboardId), 'dashboard',
+                                            'CREATION', SourceEntity, DashboardId in self.failing_dashboard_ids)
+        return {'Status': 202, 'DashboardId': DashboardId, 'VersionArn': version_arn,
+                'CreationStatus': 'CREATION_IN_PROGRESS'}
+
+    def update_dashboard(self, AwsAccountId, DashboardId, Name, SourceEntity, **kwargs):
+        self._call('update_dashboard')
+        with self.lock:
+            if (AwsAccountId, DashboardId) not in self.dashboards:
+                raise self._not_found('UpdateDashboard', DashboardId, 'Dashboard')
+            version_arn = self._add_version(self.dashboards, (AwsAccountId, DashboardId), 'dashboard',
+                                            'UPDATE', SourceEntity, DashboardId in self.failing_dashboard_ids)
+        return {'Status': 202, 'DashboardId': DashboardId, 'VersionArn': version_arn,
+                'CreationStatus': 'UPDATE_IN_PROGRESS'}
+
+    def describe_dashboard(self, AwsAccountId, DashboardId, VersionNumber):
+        self._call('describe_dashboard')
+        with self.lock:
+            version = self._describe_version(self.dashboards, (AwsAccountId, DashboardId), VersionNumber,
+                                             'DescribeDashboard', 'Dashboard')
+        return {'Status': 200, 'Dashboard': {'DashboardId': DashboardId, 'Version': version}}
+
+    def update_dashboard_published_version(self, AwsAccountId, DashboardId, VersionNumber):
+        self._call('update_dashboard_published_version')
+        with self.lock:
+            self._describe_version(self.dashboards, (AwsAccountId, DashboardId), VersionNumber,
+                                   'UpdateDashboardPublishedVersion', 'Dashboard')
+            self.dashboards[(AwsAccountId, DashboardId)]['PublishedVersion'] = VersionNumber
+        return {'Status': 200, 'DashboardId': DashboardId}
+
+
+def make_definition(prefix, datasets=2, sheets=5, visuals_per_sheet=10, calculated_fields=5, parameters=3):
+    """Builds a synthetic analysis definition of a given size for load tests
+
+    Args:
+        prefix (str): makes the sheet, visual, field and parameter names of the analysis unique
+        datasets (int): number of datasets, shared by every analysis built with the same count
+        sheets (int): number of sheets
+        visuals_per_sheet (int): number of bar charts per sheet
+        calculated_fields (int): number of calculated fields
+        parameters (int): number of parameters
+
+    Returns:
+        dict: analysis 'Definition'
+    """
+    dataset_declarations = [{'Identifier': f"dataset-{number}",
+                             'DataSetArn': f"arn:aws:quicksight:us-east-1:000000000000:dataset/dataset-{number}"}
+                            for number in range(datasets)]
+    definition = empty_definition()
+    definition['DataSetIdentifierDeclarations'] = dataset_declarations
+    for sheet_number in range(sheets):
+        visuals = []
+        elements = []
+        for visual_number in range(visuals_per_sheet):
+            visual_id = f"{prefix}-visual-{sheet_number}-{visual_number}"
+            dataset_identifier = dataset_declarations[visual_number % datasets]['Identifier']
+            visuals.append({'BarChartVisual': {
+                'VisualId': visual_id,
+                'Title': {'Visibility': 'VISIBLE', 'FormatText': {'PlainText': visual_id}},
+                'ChartConfiguration': {'FieldWells': {'BarChartAggregatedFieldWells': {
+                    'Category': [{'CategoricalDimensionField': {
+                        'FieldId': f"{visual_id}-category",
+                        'Column': {'DataSetIdentifier': dataset_identifier, 'ColumnName': f"column_{visual_number}"}}}],
+                    'Values': [{'NumericalMeasureField': {
+                        'FieldId': f"{visual_id}-value",
+                        'Column': {'DataSetIdentifier': dataset_identifier, 'ColumnName': 'amount'},
+                        'AggregationFunction': {'SimpleNumericalAggregation': 'SUM'}}}]
+                }}}
+            }})
+            elements.append({'ElementId': visual_id, 'ElementType': 'VISUAL',
+                             'ColumnSpan': 12, 'RowSpan': 8})
+        definition['Sheets'].append({
+            'SheetId': f"{prefix}-sheet-{sheet_number}",
+            'Name': f"{prefix} sheet {sheet_number}",
+            'Visuals': visuals,
+            'Layouts': [{'Configuration': {'GridLayout': {'Elements': elements}}}]
+        })
+    definition['CalculatedFields'] = [{'DataSetIdentifier': dataset_declarations[number % datasets]['Identifier'],
+                                       'Name': f"{prefix}_field_{number}",
+                                       'Expression': f"amount * {number + 1}"}
+                                      for number in range(calculated_fields)]
+    definition['ParameterDeclarations'] = [{'StringParameterDeclaration': {
+        'ParameterValueType': 'SINGLE_VALUED', 'Name': f"{prefix}Parameter{number}",
+        'DefaultValues': {'StaticValues': ['all']}}} for number in range(parameters)]
+    return definition
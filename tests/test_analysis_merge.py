@@ -0,0 +1,86 @@
+import copy
+
+from analysis_merge import merge_analyses_create, merge_analyses_update
+from merge_provenance import ProvenanceStore
+from quicksight_stub import FakeQuickSight, make_definition
+from snapshot_store import LocalSnapshotBackend
+
+ACCOUNT_ID = '111111111111'
+
+
+def sheets(qs_client, analysis_id):
+    return [(sheet['SheetId'], sheet['Name'])
+            for sheet in qs_client.analyses[(ACCOUNT_ID, analysis_id)]['Definition']['Sheets']]
+
+
+def create(qs_client, tmp_path):
+    return merge_analyses_create(ACCOUNT_ID, 'first', 'second', 'merged', 'Merged', 'author', 'default', qs_client,
+                                 provenance_store=ProvenanceStore(LocalSnapshotBackend(str(tmp_path))))
+
+
+def save_as(definition):
+    """Copies an analysis the way "Save as" does, keeping its sheet IDs"""
+    return copy.deepcopy(definition)
+
+
+def test_create_keeps_a_sheet_both_analyses_share_once(tmp_path):
+    qs_client = FakeQuickSight()
+    first = make_definition('first', sheets=2)
+    second = save_as(first)
+    second['Sheets'].append(make_definition('second', sheets=1)['Sheets'][0])
+    qs_client.add_analysis(ACCOUNT_ID, 'first', 'First', first)
+    qs_client.add_analysis(ACCOUNT_ID, 'second', 'Second', second)
+
+    assert create(qs_client, tmp_path) == 'Analysis Merged created successfully'
+
+    assert sheets(qs_client, 'merged') == [
+        ('first-sheet-0', 'first sheet 0'), ('first-sheet-1', 'first sheet 1'), ('second-sheet-0', 'second sheet 0')]
+
+
+def test_create_refuses_a_shared_sheet_id_with_different_content(tmp_path):
+    qs_client = FakeQuickSight()
+    first = make_definition('first', sheets=2)
+    second = save_as(first)
+    second['Sheets'][0]['Name'] = 'edited after save as'
+    qs_client.add_analysis(ACCOUNT_ID, 'first', 'First', first)
+    qs_client.add_analysis(ACCOUNT_ID, 'second', 'Second', second)
+
+    response = create(qs_client, tmp_path)
+
+    assert 'first-sheet-0' in str(response)
+    assert (ACCOUNT_ID, 'merged') not in qs_client.analyses
+
+
+def test_update_without_provenance_keeps_the_target_sheet(tmp_path):
+    qs_client = FakeQuickSight()
+    target = make_definition('target', sheets=1)
+    source = make_definition('source', sheets=1)
+    source['Sheets'][0]['SheetId'] = 'target-sheet-0'
+    qs_client.add_analysis(ACCOUNT_ID, 'target', 'Target', target)
+    qs_client.add_analysis(ACCOUNT_ID, 'source', 'Source', source)
+
+    response = merge_analyses_update(ACCOUNT_ID, 'source', 'target', 'Target', qs_client,
+                                     provenance_store=ProvenanceStore(LocalSnapshotBackend(str(tmp_path))))
+
+    assert 'target-sheet-0' in str(response)
+    assert sheets(qs_client, 'target') == [('target-sheet-0', 'target sheet 0')]
+
+
+def test_collapsed_copies_are_not_merged_again(tmp_path, capsys):
+    qs_client = FakeQuickSight()
+    source = make_definition('source', sheets=1, visuals_per_sheet=1)
+    duplicate = copy.deepcopy(source['Sheets'][0]['Visuals'][0])
+    duplicate['BarChartVisual']['VisualId'] = 'duplicate'
+    source['Sheets'][0]['Visuals'].append(duplicate)
+    qs_client.add_analysis(ACCOUNT_ID, 'target', 'Target', make_definition('target', sheets=1))
+    qs_client.add_analysis(ACCOUNT_ID, 'source', 'Source', source)
+    provenance_store = ProvenanceStore(LocalSnapshotBackend(str(tmp_path)))
+
+    for _ in range(2):
+        merge_analyses_update(ACCOUNT_ID, 'source', 'target', 'Target', qs_client,
+                              visual_dedup_policy='collapse', provenance_store=provenance_store)
+
+    merged = capsys.readouterr().out.splitlines()
+    assert [line for line in merged if line.startswith('Merged')][-1].startswith('Merged 0 changed')
+    visuals = qs_client.analyses[(ACCOUNT_ID, 'target')]['Definition']['Sheets'][1]['Visuals']
+    assert len(visuals) == 1
@@ -0,0 +1,91 @@
+from analysis_sync import LocalSyncStateStore, register_sync, sync_analyses
+from quicksight_stub import FakeQuickSight, make_definition
+
+ACCOUNT_ID = '111111111111'
+
+
+class RecordingQuickSight(FakeQuickSight):
+    """Remembers which analysis definitions were fetched"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.fetched = []
+
+    def describe_analysis_definition(self, AwsAccountId, AnalysisId):
+        self.fetched.append(AnalysisId)
+        return super().describe_analysis_definition(AwsAccountId, AnalysisId)
+
+
+class RecordingStateStore(LocalSyncStateStore):
+    """Remembers how many targets were marked synced at each save"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.saved_counts = []
+
+    def save(self, state):
+        self.saved_counts.append(len(state['Synced']))
+        super().save(state)
+
+
+def seed(qs_client, state_store, registry):
+    state = state_store.load()
+    for target_id, source_ids in registry.items():
+        qs_client.add_analysis(ACCOUNT_ID, target_id, target_id, make_definition(target_id, sheets=1))
+        register_sync(state, target_id, target_id, source_ids)
+        for source_id in source_ids:
+            if (ACCOUNT_ID, source_id) not in qs_client.analyses:
+                qs_client.add_analysis(ACCOUNT_ID, source_id, source_id, make_definition(source_id, sheets=1))
+    state_store.save(state)
+
+
+def test_only_targets_of_changed_sources_are_fetched_and_updated(tmp_path):
+    qs_client = RecordingQuickSight()
+    state_store = LocalSyncStateStore(str(tmp_path / 'state.json'))
+    seed(qs_client, state_store, {'sales': ['north', 'south'], 'finance': ['south'], 'hr': ['people']})
+
+    assert sync_analyses(ACCOUNT_ID, state_store, qs_client)['Updated'] == ['finance', 'hr', 'sales']
+
+    qs_client.fetched.clear()
+    qs_client.operation_counts.clear()
+    report = sync_analyses(ACCOUNT_ID, state_store, qs_client)
+    assert report['Updated'] == []
+    assert sorted(report['Unchanged']) == ['finance', 'hr', 'sales']
+    assert qs_client.fetched == []
+    # each source is described once, whatever the number of targets it feeds
+    assert qs_client.operation_counts['describe_analysis'] == 3
+
+    north = make_definition('north', sheets=2)
+    qs_client.add_analysis(ACCOUNT_ID, 'north', 'north', north)
+    qs_client.fetched.clear()
+    report = sync_analyses(ACCOUNT_ID, state_store, qs_client)
+
+    assert report['Updated'] == ['sales']
+    assert sorted(qs_client.fetched) == ['north', 'sales']
+    sheet_ids = [sheet['SheetId'] for sheet in qs_client.analyses[(ACCOUNT_ID, 'sales')]['Definition']['Sheets']]
+    assert 'north-sheet-1' in sheet_ids
+
+
+def test_state_is_saved_as_targets_finish(tmp_path):
+    qs_client = FakeQuickSight()
+    state_store = RecordingStateStore(str(tmp_path / 'state.json'))
+    seed(qs_client, state_store, {f"target-{number:02d}": ['source'] for number in range(25)})
+    state_store.saved_counts.clear()
+
+    report = sync_analyses(ACCOUNT_ID, state_store, qs_client, max_workers=4, save_every=10)
+
+    assert len(report['Updated']) == 25
+    assert state_store.saved_counts == [10, 20, 25]
+
+
+def test_failed_source_fails_only_its_targets(tmp_path):
+    qs_client = FakeQuickSight()
+    state_store = LocalSyncStateStore(str(tmp_path / 'state.json'))
+    seed(qs_client, state_store, {'sales': ['north'], 'finance': ['south']})
+    del qs_client.analyses[(ACCOUNT_ID, 'south')]
+
+    report = sync_analyses(ACCOUNT_ID, state_store, qs_client)
+
+    assert report['Updated'] == ['sales']
+    assert list(report['Failed']) == ['finance']
+    assert 'finance->south' not in state_store.load()['Synced']
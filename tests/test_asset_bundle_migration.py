@@ -0,0 +1,53 @@
+import json
+import time
+
+from asset_bundle_migration import migrate_analyses
+from quicksight_stub import QuickSightStub
+
+POLL_OPTIONS = {'initial_delay': 0.001, 'max_delay': 0.001}
+
+
+def migrate(stub, analysis_ids, **kwargs):
+    return migrate_analyses(analysis_ids, '111111111111', '222222222222', 'us-east-1', stub, stub,
+                            download=stub.download, poll_options=dict(POLL_OPTIONS, **kwargs.pop('poll_options', {})),
+                            **kwargs)
+
+
+def test_migrates_every_analysis_in_batches():
+    stub = QuickSightStub()
+    report = migrate(stub, ['a', 'b', 'c'], import_batch_size=2)
+
+    assert report['Imported'] == 3
+    assert report['Failed'] == 0
+    assert all(analysis['Status'] == 'IMPORTED' for analysis in report['Analyses'].values())
+    imported = sorted(json.loads(bundle)['ResourceArns'][0].rsplit('/', 1)[-1]
+                      for bundle in stub.imported_bundles)
+    assert imported == ['a', 'b', 'c']
+    assert sum(1 for operation, _ in stub.calls if operation == 'start_asset_bundle_export_job') == 3
+
+
+def test_failed_export_does_not_stop_the_others():
+    stub = QuickSightStub(failing_analysis_ids=['b'])
+    report = migrate(stub, ['a', 'b', 'c'])
+
+    assert report['Imported'] == 2
+    assert report['Analyses']['b']['Status'] == 'FAILED'
+    assert report['Analyses']['b']['Error'].startswith('Export')
+
+
+def test_deadline_reports_instead_of_running_over():
+    stub = QuickSightStub(polls_to_complete=10 ** 6)
+    report = migrate(stub, ['a', 'b'], poll_options={'deadline': time.monotonic() + 0.05})
+
+    assert report['Failed'] == 2
+    assert all(analysis['Error'] == 'Export: TIMED_OUT' for analysis in report['Analyses'].values())
+    assert stub.imported_bundles == []
+
+
+def test_later_batches_download_with_a_fresh_url():
+    # each import batch outlives the url the export returned
+    stub = QuickSightStub(url_ttl=0.1)
+    report = migrate(stub, ['a', 'b', 'c'], import_batch_size=1,
+                     poll_options={'initial_delay': 0.1, 'max_delay': 0.1})
+
+    assert report['Imported'] == 3, report
@@ -0,0 +1,28 @@
+from broadcast_merge import broadcast_merge
+from merge_provenance import ProvenanceStore
+from quicksight_stub import FakeQuickSight, make_definition
+from snapshot_store import LocalSnapshotBackend
+
+ACCOUNT_ID = '111111111111'
+TARGET_IDS = [f"target-{number}" for number in range(3)]
+
+
+def test_broadcast_again_replaces_instead_of_appending(tmp_path):
+    qs_client = FakeQuickSight()
+    provenance_store = ProvenanceStore(LocalSnapshotBackend(str(tmp_path)))
+    source = make_definition('kpi', sheets=1)
+    qs_client.add_analysis(ACCOUNT_ID, 'kpi', 'KPI', source)
+    for target_id in TARGET_IDS:
+        qs_client.add_analysis(ACCOUNT_ID, target_id, target_id, make_definition(target_id, sheets=1))
+
+    report = broadcast_merge(ACCOUNT_ID, 'kpi', TARGET_IDS, qs_client, provenance_store=provenance_store)
+    assert report['Updated'] == 3
+    source['Sheets'][0]['Name'] = 'KPIs'
+    qs_client.add_analysis(ACCOUNT_ID, 'kpi', 'KPI', source)
+    report = broadcast_merge(ACCOUNT_ID, 'kpi', TARGET_IDS, qs_client, provenance_store=provenance_store)
+
+    assert report['Updated'] == 3
+    for target_id in TARGET_IDS:
+        sheets = qs_client.analyses[(ACCOUNT_ID, target_id)]['Definition']['Sheets']
+        assert [(sheet['SheetId'], sheet['Name']) for sheet in sheets] == [
+            (f"{target_id}-sheet-0", f"{target_id} sheet 0"), ('kpi-sheet-0', 'KPIs')]
@@ -0,0 +1,108 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from dataset_preflight import ERROR, WARNING, blocking_problems, clear_cache, preflight_datasets
+
+ACCOUNT_ID = '111111111111'
+USER_ARN = f"arn:aws:quicksight:us-east-1:{ACCOUNT_ID}:user/default/author"
+NAMESPACE_ARN = f"arn:aws:quicksight:us-east-1:{ACCOUNT_ID}:namespace/default"
+
+
+def dataset_arn(dataset_id):
+    return f"arn:aws:quicksight:us-east-1:{ACCOUNT_ID}:dataset/{dataset_id}"
+
+
+def client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class DatasetStub:
+    """describe_data_set, describe_data_set_permissions and list_user_groups over fixed datasets"""
+
+    def __init__(self, columns, principals=(USER_ARN,), errors=None):
+        self.columns = columns
+        self.principals = list(principals)
+        self.errors = errors or {}
+        self.describe_calls = 0
+
+    def describe_data_set(self, AwsAccountId, DataSetId):
+        self.describe_calls += 1
+        if DataSetId in self.errors:
+            raise client_error(self.errors[DataSetId], 'DescribeDataSet')
+        return {'DataSet': {'OutputColumns': [{'Name': name} for name in self.columns[DataSetId]]}}
+
+    def describe_data_set_permissions(self, AwsAccountId, DataSetId):
+        return {'Permissions': [{'Principal': principal} for principal in self.principals]}
+
+    def list_user_groups(self, AwsAccountId, Namespace, UserName, **kwargs):
+        return {'GroupList': [{'Arn': f"arn:aws:quicksight:us-east-1:{AwsAccountId}:group/default/authors"}]}
+
+
+def definition(*datasets, columns=('amount',)):
+    return {
+        'DataSetIdentifierDeclarations': [{'Identifier': dataset, 'DataSetArn': dataset_arn(dataset)}
+                                          for dataset in datasets],
+        'Sheets': [{'SheetId': 'sheet', 'Visuals': [
+            {'TableVisual': {'VisualId': f"{dataset}-{column}", 'Column': {
+                'DataSetIdentifier': dataset, 'ColumnName': column}}}
+            for dataset in datasets for column in columns]}],
+        'CalculatedFields': [{'DataSetIdentifier': datasets[0], 'Name': 'double', 'Expression': '{amount} * 2'}]
+    }
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_cache()
+
+
+def severities(problems):
+    return sorted((problem['DataSetIdentifier'], problem['Severity']) for problem in problems)
+
+
+def test_datasets_with_every_column_pass():
+    qs_client = DatasetStub({'sales': ['amount']})
+
+    assert preflight_datasets(ACCOUNT_ID, definition('sales'), qs_client, USER_ARN) == []
+
+
+def test_missing_dataset_and_column_block_the_merge():
+    qs_client = DatasetStub({'sales': ['amount']}, errors={'returns': 'ResourceNotFoundException'})
+
+    problems = preflight_datasets(ACCOUNT_ID, definition('sales', 'returns', columns=('amount', 'region')),
+                                  qs_client, USER_ARN)
+
+    assert severities(problems) == [('returns', ERROR), ('sales', ERROR)]
+    assert 'region' in [problem for problem in problems if problem['DataSetIdentifier'] == 'sales'][0]['Problem']
+
+
+@pytest.mark.parametrize('code', ['ThrottlingException', 'InvalidParameterValueException'])
+def test_dataset_that_cannot_be_described_only_warns(code):
+    qs_client = DatasetStub({}, errors={'uploaded': code})
+
+    problems = preflight_datasets(ACCOUNT_ID, definition('uploaded'), qs_client, USER_ARN)
+
+    assert severities(problems) == [('uploaded', WARNING)]
+    assert blocking_problems(problems) == []
+
+
+@pytest.mark.parametrize('principal, warned', [
+    (USER_ARN, False),
+    (NAMESPACE_ARN, False),
+    (f"arn:aws:quicksight:us-east-1:{ACCOUNT_ID}:group/default/authors", False),
+    (f"arn:aws:quicksight:us-east-1:{ACCOUNT_ID}:user/default/someone-else", True)
+])
+def test_permission_is_found_through_namespace_and_groups(principal, warned):
+    qs_client = DatasetStub({'sales': ['amount']}, principals=[principal])
+
+    problems = preflight_datasets(ACCOUNT_ID, definition('sales'), qs_client, USER_ARN)
+
+    assert severities(problems) == ([('sales', WARNING)] if warned else [])
+
+
+def test_descriptions_are_cached_but_transient_errors_are_not():
+    qs_client = DatasetStub({'sales': ['amount']}, errors={'busy': 'ThrottlingException'})
+
+    for _ in range(2):
+        preflight_datasets(ACCOUNT_ID, definition('sales', 'busy'), qs_client)
+
+    assert qs_client.describe_calls == 3
@@ -0,0 +1,117 @@
+import copy
+
+import pytest
+
+from merge_provenance import ProvenanceStore, merge_incremental
+from merge_stages import DuplicateElementIdException, fingerprint
+from quicksight_stub import FakeQuickSight, make_definition
+from snapshot_store import LocalSnapshotBackend, SnapshotStore, rollback_analysis
+
+ACCOUNT_ID = '111111111111'
+
+
+def sheet_ids(definition):
+    return [sheet['SheetId'] for sheet in definition['Sheets']]
+
+
+def rename_sheet(definition, position, name):
+    definition['Sheets'][position]['Name'] = name
+
+
+def test_unchanged_source_is_skipped():
+    target = make_definition('target', sheets=1)
+    source = make_definition('source', sheets=3)
+    provenance, report = merge_incremental(target, source, 'source')
+    assert report['Changed'] == 3 + len(source['CalculatedFields'])
+
+    provenance, report = merge_incremental(target, source, 'source', provenance)
+
+    assert report['Changed'] == 0
+    assert report['Unchanged'] == 3 + len(source['CalculatedFields'])
+    assert sheet_ids(target) == ['target-sheet-0', 'source-sheet-0', 'source-sheet-1', 'source-sheet-2']
+
+
+def test_changed_sheet_replaces_its_copy_in_place():
+    target = make_definition('target', sheets=1)
+    source = make_definition('source', sheets=3)
+    provenance, _ = merge_incremental(target, source, 'source')
+    rename_sheet(source, 1, 'renamed')
+
+    provenance, report = merge_incremental(target, source, 'source', provenance)
+
+    assert report['Changed'] == 1
+    assert report['ChangedVisuals'] == 0
+    assert sheet_ids(target) == ['target-sheet-0', 'source-sheet-0', 'source-sheet-1', 'source-sheet-2']
+    assert target['Sheets'][2]['Name'] == 'renamed'
+
+
+def test_edited_copy_is_merged_again():
+    target = make_definition('target', sheets=1)
+    source = make_definition('source', sheets=2)
+    provenance, _ = merge_incremental(target, source, 'source')
+    rename_sheet(target, 1, 'edited in the target')
+
+    _, report = merge_incremental(target, source, 'source', provenance)
+
+    assert report['Changed'] == 1
+    assert target['Sheets'][1] == source['Sheets'][0]
+
+
+def test_merge_without_provenance_never_replaces_a_target_element():
+    target = make_definition('target', sheets=1)
+    source = make_definition('source', sheets=2)
+    merge_incremental(target, source, 'source')
+
+    _, report = merge_incremental(target, source, 'source')
+    assert report['Changed'] == 0
+    rename_sheet(source, 0, 'renamed')
+    with pytest.raises(DuplicateElementIdException):
+        merge_incremental(target, source, 'source')
+
+    assert sheet_ids(target) == ['target-sheet-0', 'source-sheet-0', 'source-sheet-1']
+    assert target['Sheets'][1]['Name'] == 'source sheet 0'
+
+
+def test_unreadable_provenance_means_a_full_merge(tmp_path, capsys):
+    backend = LocalSnapshotBackend(str(tmp_path))
+    backend.put('provenance/target/source.json', b'not json')
+
+    assert ProvenanceStore(backend).load('target', 'source') is None
+    assert ProvenanceStore(backend).load('target', 'other') is None
+    assert 'merging it in full' in capsys.readouterr().out
+
+
+def test_merge_after_rollback_restores_the_source(tmp_path):
+    backend = LocalSnapshotBackend(str(tmp_path))
+    snapshot_store = SnapshotStore(backend)
+    provenance_store = ProvenanceStore(backend)
+    qs_client = FakeQuickSight()
+    target = make_definition('target', sheets=1)
+    source = make_definition('source', sheets=2)
+
+    def merge():
+        definition = qs_client.describe_analysis_definition(
+            AwsAccountId=ACCOUNT_ID, AnalysisId='target')['Definition']
+        inputs = {'target': copy.deepcopy(definition), 'source': source}
+        provenance, _ = merge_incremental(definition, source, 'source', provenance_store.load('target', 'source'))
+        qs_client.update_analysis(AwsAccountId=ACCOUNT_ID, AnalysisId='target', Name='Target',
+                                  Definition=definition)
+        snapshot_store.save_merge('target', None, inputs, definition, provenance=[provenance])
+        provenance_store.save('target', provenance)
+        return definition
+
+    qs_client.add_analysis(ACCOUNT_ID, 'target', 'Target', target)
+    merge()
+    rename_sheet(source, 0, 'edited')
+    merge()
+
+    rollback_analysis(ACCOUNT_ID, 'target', snapshot_store, qs_client, provenance_store=provenance_store)
+
+    # the maps are the ones of the restored merge, so they match the restored copies
+    restored = qs_client.analyses[(ACCOUNT_ID, 'target')]['Definition']['Sheets'][1]
+    assert restored['Name'] == 'source sheet 0'
+    entry = provenance_store.load('target', 'source')['Elements']['Sheets']['source-sheet-0']
+    assert entry['TargetFingerprint'] == fingerprint(restored)
+    merged = merge()
+    assert sheet_ids(merged) == ['target-sheet-0', 'source-sheet-0', 'source-sheet-1']
+    assert merged['Sheets'][1]['Name'] == 'edited'
@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from optimistic_update import ConcurrentUpdateException, update_with_optimistic_concurrency
+from quicksight_stub import FakeQuickSight, make_definition
+
+ACCOUNT_ID = '111111111111'
+
+
+def no_sleep(seconds):
+    pass
+
+
+def test_concurrent_updates_are_not_lost():
+    qs_client = FakeQuickSight(latency=0.002, seed=1)
+    qs_client.add_analysis(ACCOUNT_ID, 'target', 'Target', make_definition('target', sheets=1))
+
+    def add_parameter(number):
+        def apply_delta(definition):
+            definition['ParameterDeclarations'].append({'StringParameterDeclaration': {
+                'ParameterValueType': 'SINGLE_VALUED', 'Name': f"Added{number}",
+                'DefaultValues': {'StaticValues': ['all']}}})
+        update_with_optimistic_concurrency(ACCOUNT_ID, 'target', None, apply_delta, qs_client,
+                                           max_retries=50, sleep=no_sleep)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(add_parameter, range(8)))
+
+    names = {parameter['StringParameterDeclaration']['Name']
+             for parameter in qs_client.analyses[(ACCOUNT_ID, 'target')]['Definition']['ParameterDeclarations']}
+    assert {f"Added{number}" for number in range(8)} <= names
+
+
+def test_gives_up_when_the_target_keeps_changing():
+    qs_client = FakeQuickSight()
+    qs_client.add_analysis(ACCOUNT_ID, 'target', 'Target', make_definition('target', sheets=1))
+    backoffs = []
+
+    def conflicting_write(definition):
+        # another writer lands between the read and the write of every attempt
+        qs_client.add_analysis(ACCOUNT_ID, 'target', 'Target', make_definition('other', sheets=1))
+
+    def record_sleep(seconds):
+        backoffs.append(seconds)
+
+    with pytest.raises(ConcurrentUpdateException):
+        update_with_optimistic_concurrency(ACCOUNT_ID, 'target', None, conflicting_write, qs_client,
+                                           max_retries=3, sleep=record_sleep)
+    assert qs_client.operation_counts['update_analysis'] == 0
+    assert len(backoffs) == 3
+    assert all(0 <= seconds <= 0.5 * 2 ** attempt for attempt, seconds in enumerate(backoffs))
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from publish_pipeline import PublishException, publish_analysis
+from quicksight_stub import FakeQuickSight, make_definition
+
+ACCOUNT_ID = '111111111111'
+DASHBOARDS = [{'DashboardId': 'sales', 'Name': 'Sales'}, {'DashboardId': 'finance', 'Name': 'Finance'}]
+POLL_OPTIONS = {'initial_delay': 0.001, 'max_delay': 0.001}
+
+
+def publish(qs_client, **kwargs):
+    return publish_analysis(ACCOUNT_ID, 'us-east-1', 'merged', 'merged-template', DASHBOARDS, qs_client,
+                            user_name='author', poll_options=dict(POLL_OPTIONS, **kwargs))
+
+
+def merged_analysis(**kwargs):
+    qs_client = FakeQuickSight(**kwargs)
+    qs_client.add_analysis(ACCOUNT_ID, 'merged', 'Merged', make_definition('merged', sheets=1))
+    return qs_client
+
+
+def test_first_publish_creates_the_template_and_dashboards():
+    qs_client = merged_analysis()
+
+    report = publish(qs_client)
+
+    assert report['TemplateVersion'] == 1
+    assert (report['Published'], report['Failed']) == (2, 0)
+    assert {dashboard_id: dashboard['Operation'] for dashboard_id, dashboard in report['Dashboards'].items()} == \
+        {'sales': 'CREATED', 'finance': 'CREATED'}
+    source = qs_client.dashboards[(ACCOUNT_ID, 'sales')]['Versions'][0]['SourceEntity']['SourceTemplate']
+    assert source['Arn'].endswith('template/merged-template/version/1')
+    assert [reference['DataSetPlaceholder'] for reference in source['DataSetReferences']] == \
+        ['dataset-0', 'dataset-1']
+
+
+def test_publishing_again_updates_and_publishes_the_new_versions():
+    qs_client = merged_analysis(status_delay=0.01)
+    publish(qs_client)
+
+    report = publish(qs_client)
+
+    assert report['TemplateVersion'] == 2
+    for dashboard_id in ('sales', 'finance'):
+        assert report['Dashboards'][dashboard_id]['Operation'] == 'UPDATED'
+        assert report['Dashboards'][dashboard_id]['Version'] == 2
+        assert qs_client.dashboards[(ACCOUNT_ID, dashboard_id)]['PublishedVersion'] == 2
+
+
+def test_failed_dashboard_does_not_stop_the_others():
+    qs_client = merged_analysis(failing_dashboard_ids=['finance'])
+
+    report = publish(qs_client)
+
+    assert report['Dashboards']['sales']['Status'] == 'PUBLISHED'
+    assert report['Dashboards']['finance']['Status'] == 'FAILED'
+    assert 'CREATION_FAILED' in report['Dashboards']['finance']['Error']
+    assert (report['Published'], report['Failed']) == (1, 1)
+
+
+def test_analysis_still_in_progress_at_the_deadline_is_not_published():
+    qs_client = merged_analysis()
+    qs_client.update_analysis(AwsAccountId=ACCOUNT_ID, AnalysisId='merged', Name='Merged',
+                              Definition=make_definition('merged', sheets=1))
+    qs_client.analyses[(ACCOUNT_ID, 'merged')]['ReadyAt'] = float('inf')
+
+    with pytest.raises(PublishException):
+        publish(qs_client, deadline=time.monotonic() + 0.05)
+    assert qs_client.templates == {}
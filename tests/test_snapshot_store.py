@@ -0,0 +1,101 @@
+import pytest
+
+from merge_provenance import ProvenanceStore, new_provenance
+from quicksight_stub import FakeQuickSight, make_definition
+from snapshot_store import LocalSnapshotBackend, SnapshotNotFoundException, SnapshotStore, rollback_analysis
+
+ACCOUNT_ID = '111111111111'
+
+
+class CountingBackend(LocalSnapshotBackend):
+    """Counts the objects written"""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.puts = []
+
+    def put(self, key, data):
+        self.puts.append(key)
+        super().put(key, data)
+
+
+def object_puts(backend):
+    return [key for key in backend.puts if key.startswith('objects/')]
+
+
+def test_definition_round_trips(tmp_path):
+    snapshot_store = SnapshotStore(LocalSnapshotBackend(str(tmp_path)))
+    definition = make_definition('a', sheets=3)
+
+    assert snapshot_store.load_definition(snapshot_store.save_definition(definition)) == definition
+
+
+def test_unchanged_elements_are_stored_once(tmp_path):
+    backend = CountingBackend(str(tmp_path))
+    snapshot_store = SnapshotStore(backend)
+    target = make_definition('target', sheets=5)
+    source = make_definition('source', sheets=5)
+
+    snapshot_store.save_merge('target', None, {'target': target, 'source': source}, target)
+    first_merge_objects = len(object_puts(backend))
+    target['Sheets'][0]['Name'] = 'renamed'
+    snapshot_store.save_merge('target', None, {'target': target, 'source': source}, target)
+
+    # only the renamed sheet is new
+    assert len(object_puts(backend)) == first_merge_objects + 1
+    assert len(snapshot_store.list_merges('target')) == 2
+
+
+def seeded_merges(tmp_path, names):
+    """Records one merge per name, each writing a target whose first sheet has that name"""
+    backend = LocalSnapshotBackend(str(tmp_path))
+    snapshot_store = SnapshotStore(backend)
+    qs_client = FakeQuickSight()
+    merge_ids = []
+    for name in names:
+        definition = make_definition('target', sheets=1)
+        definition['Sheets'][0]['Name'] = name
+        qs_client.add_analysis(ACCOUNT_ID, 'target', 'Target', definition)
+        merge_ids.append(snapshot_store.save_merge('target', f"Target {name}", {'target': definition}, definition,
+                                                   theme_arn=f"arn:theme/{name}"))
+    return backend, snapshot_store, qs_client, merge_ids
+
+
+def written(qs_client):
+    analysis = qs_client.analyses[(ACCOUNT_ID, 'target')]
+    return analysis['Name'], analysis['ThemeArn'], analysis['Definition']['Sheets'][0]['Name']
+
+
+def test_rollback_restores_the_merge_before_the_latest(tmp_path):
+    _, snapshot_store, qs_client, merge_ids = seeded_merges(tmp_path, ['one', 'two', 'three'])
+
+    assert rollback_analysis(ACCOUNT_ID, 'target', snapshot_store, qs_client) == merge_ids[1]
+    assert written(qs_client) == ('Target two', 'arn:theme/two', 'two')
+
+
+def test_rollback_restores_the_merge_asked_for(tmp_path):
+    _, snapshot_store, qs_client, merge_ids = seeded_merges(tmp_path, ['one', 'two', 'three'])
+
+    rollback_analysis(ACCOUNT_ID, 'target', snapshot_store, qs_client, merge_id=merge_ids[0])
+
+    assert written(qs_client) == ('Target one', 'arn:theme/one', 'one')
+
+
+def test_rollback_needs_an_earlier_merge(tmp_path):
+    _, snapshot_store, qs_client, merge_ids = seeded_merges(tmp_path, ['one'])
+
+    with pytest.raises(SnapshotNotFoundException):
+        rollback_analysis(ACCOUNT_ID, 'target', snapshot_store, qs_client)
+    with pytest.raises(SnapshotNotFoundException):
+        rollback_analysis(ACCOUNT_ID, 'target', snapshot_store, qs_client, merge_id='unknown')
+    assert written(qs_client) == ('Target', None, 'one')
+
+
+def test_rollback_to_a_merge_without_provenance_clears_the_maps(tmp_path):
+    backend, snapshot_store, qs_client, _ = seeded_merges(tmp_path, ['one', 'two'])
+    provenance_store = ProvenanceStore(backend)
+    provenance_store.save('target', new_provenance('source'))
+
+    rollback_analysis(ACCOUNT_ID, 'target', snapshot_store, qs_client, provenance_store=provenance_store)
+
+    assert provenance_store.load('target', 'source') is None
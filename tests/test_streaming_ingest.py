@@ -0,0 +1,47 @@
+import copy
+import json
+
+import pytest
+
+from merge_stages import empty_definition, merge_definitions
+from quicksight_stub import make_definition
+from streaming_ingest import merge_definition_files
+
+COMPARED_SECTIONS = ['DataSetIdentifierDeclarations', 'ParameterDeclarations', 'FilterGroups',
+                     'CalculatedFields', 'Sheets']
+
+
+def exported_definitions():
+    # one visual per sheet, so every sheet of the first analysis only uses dataset-0
+    first = make_definition('first', sheets=3, visuals_per_sheet=1)
+    second = make_definition('second', sheets=3, visuals_per_sheet=2)
+    # same identifier, different dataset: the second one is renamed in the merge
+    second['DataSetIdentifierDeclarations'][1]['DataSetArn'] += '-other'
+    second['FilterGroups'] = [{'FilterGroupId': 'second-filter', 'CrossDataset': 'SINGLE_DATASET',
+                               'Filters': [{'CategoryFilter': {'FilterId': 'f', 'Column': {
+                                   'DataSetIdentifier': 'dataset-1', 'ColumnName': 'year'}}}]}]
+    # a sheet both analyses share is written once
+    second['Sheets'].append(copy.deepcopy(first['Sheets'][0]))
+    return [{'Status': 200, 'AnalysisId': 'first', 'Definition': first, 'ThemeArn': 'arn:theme'},
+            {'Status': 200, 'AnalysisId': 'second', 'Definition': second}]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1024 * 1024])
+def test_streamed_merge_matches_in_memory_merge(tmp_path, chunk_size):
+    paths = []
+    for number, exported in enumerate(exported_definitions()):
+        path = tmp_path / f"analysis_{number}.json"
+        path.write_text(json.dumps(exported))
+        paths.append(str(path))
+    output_path = tmp_path / 'merged.json'
+
+    counts = merge_definition_files(paths, str(output_path), chunk_size)
+
+    expected = empty_definition()
+    for exported in exported_definitions():
+        merge_definitions(expected, exported['Definition'])
+    merged = json.loads(output_path.read_text())
+    for section in COMPARED_SECTIONS:
+        assert merged['Definition'][section] == expected[section], section
+    assert merged['ThemeArn'] == 'arn:theme'
+    assert counts == {'SheetsRead': 7, 'SheetsWritten': 6}
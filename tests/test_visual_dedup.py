@@ -0,0 +1,92 @@
+import copy
+
+from quicksight_stub import make_definition
+from visual_dedup import COLLAPSE, dedup_visuals, find_duplicate_visuals, get_visual_id
+
+
+def sheet_with_copies(*copy_ids):
+    definition = make_definition('a', datasets=1, sheets=1, visuals_per_sheet=1)
+    sheet = definition['Sheets'][0]
+    original = sheet['Visuals'][0]
+    for visual_id in copy_ids:
+        visual = copy.deepcopy(original)
+        visual['BarChartVisual']['VisualId'] = visual_id
+        visual['BarChartVisual']['Title']['FormatText']['PlainText'] = f"Copy {visual_id}"
+        sheet['Visuals'].append(visual)
+        sheet['Layouts'][0]['Configuration']['GridLayout']['Elements'].append(
+            {'ElementId': visual_id, 'ElementType': 'VISUAL', 'ColumnSpan': 12, 'RowSpan': 8})
+    return definition
+
+
+def filter_group(visual_ids):
+    return {'FilterGroupId': 'year', 'CrossDataset': 'SINGLE_DATASET', 'Status': 'ENABLED',
+            'Filters': [{'CategoryFilter': {'FilterId': 'year-filter',
+                                            'Column': {'DataSetIdentifier': 'dataset-0', 'ColumnName': 'year'}}}],
+            'ScopeConfiguration': {'SelectedSheets': {'SheetVisualScopingConfigurations': [
+                {'SheetId': 'a-sheet-0', 'Scope': 'SELECTED_VISUALS', 'VisualIds': visual_ids}]}}}
+
+
+def visual_ids(definition):
+    return [get_visual_id(visual) for visual in definition['Sheets'][0]['Visuals']]
+
+
+def test_collapses_copies_on_the_same_sheet():
+    definition = sheet_with_copies('copy')
+
+    groups = dedup_visuals(definition, COLLAPSE)
+
+    assert len(groups) == 1
+    assert visual_ids(definition) == ['a-visual-0-0']
+    elements = definition['Sheets'][0]['Layouts'][0]['Configuration']['GridLayout']['Elements']
+    assert [element['ElementId'] for element in elements] == ['a-visual-0-0']
+
+
+def test_filtered_chart_is_not_a_duplicate_of_the_unfiltered_one():
+    definition = sheet_with_copies('filtered')
+    definition['FilterGroups'] = [filter_group(['filtered'])]
+
+    assert find_duplicate_visuals(definition) == []
+    dedup_visuals(definition, COLLAPSE)
+    assert visual_ids(definition) == ['a-visual-0-0', 'filtered']
+    assert definition['FilterGroups'][0] == filter_group(['filtered'])
+
+
+def test_copies_sharing_a_filter_collapse_without_moving_it():
+    definition = sheet_with_copies('filtered', 'filtered-copy')
+    definition['FilterGroups'] = [filter_group(['filtered', 'filtered-copy'])]
+
+    dedup_visuals(definition, COLLAPSE)
+
+    assert visual_ids(definition) == ['a-visual-0-0', 'filtered']
+    assert definition['FilterGroups'][0] == filter_group(['filtered'])
+
+
+def navigation_action(action_id):
+    return {'CustomActionId': action_id, 'Name': 'Open details', 'Status': 'ENABLED', 'Trigger': 'DATA_POINT_CLICK',
+            'ActionOperations': [{'NavigationOperation': {'LocalNavigationConfiguration': {
+                'TargetSheetId': 'details'}}}]}
+
+
+def set_actions(definition, visual_id, actions):
+    for visual in definition['Sheets'][0]['Visuals']:
+        if get_visual_id(visual) == visual_id:
+            visual['BarChartVisual']['Actions'] = actions
+
+
+def test_copy_with_its_own_actions_is_not_collapsed():
+    definition = sheet_with_copies('with-action')
+    set_actions(definition, 'with-action', [navigation_action('navigate')])
+
+    dedup_visuals(definition, COLLAPSE)
+
+    assert visual_ids(definition) == ['a-visual-0-0', 'with-action']
+
+
+def test_copies_with_the_same_actions_collapse():
+    definition = sheet_with_copies('copy')
+    set_actions(definition, 'a-visual-0-0', [navigation_action('navigate')])
+    set_actions(definition, 'copy', [navigation_action('navigate-copy')])
+
+    dedup_visuals(definition, COLLAPSE)
+
+    assert visual_ids(definition) == ['a-visual-0-0']